@@ -7,12 +7,11 @@
 # -----------------------------------------------------------------------------
 # Standard Library Imports
 import os
+import re
 import sys
 import time
 from getopt import getopt
 import logging
-import selectors
-import subprocess
 import sys
 
 # -----------------------------------------------------------------------------
@@ -31,7 +30,9 @@ LOG_FILE       = os.path.join(LOG_PATH, "%s.log" % ME.split('.')[FIRST])  # test
 LOG_FORMAT     = "%(asctime)s, %(levelname)s, %(message)s"
 TESTSUITE_PATH = os.path.join(MY_PATH, "../testsuites")
 TESTCASE_PATH  = os.path.join(MY_PATH, "../testcases")
+TESTDATA_PATH  = os.path.join(MY_PATH, "../testdata")
 RESULTS_HOME   = os.path.join(MY_PATH, "../testresults")
+TAG_CACHE      = os.path.join(RESULTS_HOME, ".tag_cache.json")
 CONFIG_PATH    = os.path.join(MY_PATH, "../conf")
 CONFIG_FILE    = os.path.join(CONFIG_PATH,  "%s.conf" % ME.split('.')[FIRST]) # testmaster.cong
 RESOURCE_PATH  = os.path.join(MY_PATH, "../res")
@@ -49,7 +50,9 @@ running   = "running"   #  Test case is being execuited
 passed    = "passed"    # Test case has finished without error or failed step
 failed    = "failed"    # Test case failed one or more steps 
 error     = "error"     # Test case encountered an error during execution  
-test_case_states = [not_ready, ready, running, passed, failed, error]
+resource_limit = "resource-limit" # Test case was stopped by a resource limit
+flaky     = "flaky"     # Test case failed, then passed when it was retried
+test_case_states = [not_ready, ready, running, passed, failed, error, resource_limit, flaky]
 
 # Initialize the logger
 logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format=LOG_FORMAT)
@@ -68,8 +71,9 @@ try:
    from PyQt5.QtWidgets import (QLabel, QComboBox, QTabWidget, QTextEdit, QLineEdit, QDialogButtonBox)
    from PyQt5.QtWidgets import (QSlider, QDial, QScrollBar, QListWidget, QListWidgetItem)
    from PyQt5.QtWidgets import (QInputDialog, QLineEdit, QFileDialog, QDialog, QMessageBox)
+   from PyQt5.QtWidgets import (QTreeWidget, QTreeWidgetItem, QPlainTextEdit, QPushButton, QCheckBox, QSplitter)
    from PyQt5.QtGui import (QPixmap, QFont, QIcon, QStatusTipEvent, QColor,  QPalette, QTextCursor)
-   from PyQt5.QtCore import (Qt, pyqtSignal, QSize, QUrl, QEvent)
+   from PyQt5.QtCore import (Qt, pyqtSignal, QSize, QUrl, QEvent, QTimer)
 
 except ModuleNotFoundError:
    sys.stderr.write("ERROR -- Unable to import the 'PyQt5' library\n")
@@ -79,8 +83,16 @@ except ModuleNotFoundError:
 
 # Import custom libraries 
 sys.path.append(LIBRARY_PATH)
-from config import read_config_file
+from config import RunnerConfig, ConfigError
 from console import Console
+from suite import read_test_suite, resolve_test_cases, suite_affected, TagCache, SuiteError
+from suite import expand_test_cases, count_test_cases
+from runner import TestRunner, RunnerError
+from monitor import FileMonitor, affected_test_cases, changed_test_cases
+from history import ResultHistory, HistoryError
+from browser import list_runs, list_folder, MappedTextFile
+from metrics import create_metrics
+from registry import RunRegistry, RegistryError, FAILED as RUN_FAILED
 
 # ============================================================================= Clickable Image 
 # Create an object of type Image that is clickable. To do this we have to 
@@ -118,6 +130,205 @@ class ClickableQIcon(QIcon):
       else:
          self.clicked.emit()
 
+# ============================================================================= Results Browser
+# A window that lists the past runs in the test results folder and shows the
+# files of a run a page at a time. Runs are listed in batches and the test 
+# cases of a run are only listed when the run is expanded. Files are memory 
+# mapped (see lib/browser.py) so huge output files open at once. 
+class ResultsBrowser(QDialog):
+   """ Browses the suite results folders """
+
+   RUN_BATCH = 100  # Runs added to the list at a time
+
+   def __init__(self, results_home, parent=None):
+      super().__init__(parent)
+      self.results_home = results_home
+      self.text_file    = None  # MappedTextFile being shown
+      self.page         = 0
+      self.match        = None  # (start, end) byte offsets of the last match
+      self.runs         = []    # Runs not in the list yet
+      self.more_item    = None
+      self.setWindowTitle("Test Results Browser")
+
+      # --- Runs and their files
+      self.tree = QTreeWidget()
+      self.tree.setHeaderLabels(["Test Results"])
+      self.tree.itemExpanded.connect(self.expand_item)
+      self.tree.itemClicked.connect(self.open_item)
+
+      # --- File viewer, one page at a time
+      self.viewer = QPlainTextEdit()
+      self.viewer.setReadOnly(True)
+      self.viewer.setLineWrapMode(QPlainTextEdit.NoWrap)
+      self.viewer.setFont(QFont("Courier", 10))
+      self.page_label    = QLabel("")
+      self.first_button  = QPushButton("<<")
+      self.prev_button   = QPushButton("<")
+      self.next_button   = QPushButton(">")
+      self.last_button   = QPushButton(">>")
+      self.first_button.clicked.connect(lambda: self.show_page(0))
+      self.prev_button.clicked.connect(lambda: self.show_page(self.page - 1))
+      self.next_button.clicked.connect(lambda: self.show_page(self.page + 1))
+      self.last_button.clicked.connect(self.show_last_page)
+      self.search_text   = QLineEdit()
+      self.search_text.setPlaceholderText("Search")
+      self.search_text.returnPressed.connect(self.find_next)
+      self.find_button   = QPushButton("Find Next")
+      self.find_button.clicked.connect(self.find_next)
+      self.regex_box     = QCheckBox("Regex")
+      self.case_box      = QCheckBox("Match case")
+
+      controls = QHBoxLayout()
+      for widget in (self.first_button, self.prev_button, self.next_button, self.last_button,
+                     self.page_label, self.search_text, self.find_button, self.regex_box, self.case_box):
+         controls.addWidget(widget)
+      viewer_widget = QWidget()
+      viewer_layout = QVBoxLayout(viewer_widget)
+      viewer_layout.addWidget(self.viewer)
+      viewer_layout.addLayout(controls)
+      splitter = QSplitter(Qt.Horizontal)
+      splitter.addWidget(self.tree)
+      splitter.addWidget(viewer_widget)
+      splitter.setSizes([250, 750])
+      layout = QVBoxLayout()
+      layout.addWidget(splitter)
+      self.setLayout(layout)
+      self.setGeometry(150, 150, 1000, 700)
+
+      # The line index of a file is built a block at a time while the 
+      # window is idle so the page count fills in without blocking
+      self.index_timer = QTimer(self)
+      self.index_timer.timeout.connect(self.index_step)
+
+   # -------------------------------------------------------------------------- runs list
+   def refresh(self):
+      """ Lists the runs again, newest first """
+      self.tree.clear()
+      self.more_item = None
+      self.runs = list_runs(self.results_home)
+      self.add_runs()
+
+   def add_runs(self):
+      if self.more_item is not None:
+         self.tree.takeTopLevelItem(self.tree.indexOfTopLevelItem(self.more_item))
+         self.more_item = None
+      for name in self.runs[:self.RUN_BATCH]:
+         self.tree.addTopLevelItem(self.folder_item(name, os.path.join(self.results_home, name)))
+      self.runs = self.runs[self.RUN_BATCH:]
+      if len(self.runs) > 0:
+         self.more_item = QTreeWidgetItem(["... %d older runs" %len(self.runs)])
+         self.tree.addTopLevelItem(self.more_item)
+
+   def folder_item(self, name, path):
+      item = QTreeWidgetItem([name])
+      item.setData(0, Qt.UserRole, path)
+      item.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
+      return item
+
+   def expand_item(self, item):
+      """ Lists the contents of a folder the first time it is expanded """
+      if item.childCount() > 0:
+         return
+      path = item.data(0, Qt.UserRole)
+      folders, files = list_folder(path)
+      for name in folders:
+         item.addChild(self.folder_item(name, os.path.join(path, name)))
+      for name in files:
+         child = QTreeWidgetItem([name])
+         child.setData(0, Qt.UserRole, os.path.join(path, name))
+         item.addChild(child)
+      if item.childCount() < 1:
+         item.setChildIndicatorPolicy(QTreeWidgetItem.DontShowIndicator)
+
+   def open_item(self, item, column):
+      if item is self.more_item:
+         self.add_runs()
+         return
+      path = item.data(0, Qt.UserRole)
+      if path is not None and os.path.isfile(path):
+         self.open_file(path)
+
+   # -------------------------------------------------------------------------- file viewer
+   def open_file(self, path):
+      self.close_file()
+      try:
+         self.text_file = MappedTextFile(path)
+      except (OSError, ValueError) as e:
+         self.viewer.setPlainText("Unable to open %s: %s" %(path, str(e)))
+         return
+      self.setWindowTitle("Test Results Browser - %s" %os.path.relpath(path, self.results_home))
+      self.match = None
+      self.show_page(0)
+      self.index_timer.start(0)
+
+   def close_file(self):
+      self.index_timer.stop()
+      if self.text_file is not None:
+         self.text_file.close()
+         self.text_file = None
+      self.viewer.clear()
+      self.page_label.setText("")
+
+   def index_step(self):
+      if self.text_file is None or self.text_file.index_step():
+         self.index_timer.stop()
+      self.update_page_label()
+
+   def show_page(self, page, line=None):
+      """ Shows a page of the file, with a line of it selected """
+      if self.text_file is None:
+         return
+      text = self.text_file.read_page(page)
+      if text is None:
+         return
+      self.page = page
+      self.viewer.setPlainText(text)
+      if line is not None:
+         cursor = QTextCursor(self.viewer.document().findBlockByNumber(line))
+         cursor.select(QTextCursor.LineUnderCursor)
+         self.viewer.setTextCursor(cursor)
+         self.viewer.centerCursor()
+      self.update_page_label()
+
+   def show_last_page(self):
+      if self.text_file is not None:
+         self.text_file.index_all()
+         self.show_page(self.text_file.page_count() - 1)
+
+   def update_page_label(self, message=""):
+      if self.text_file is None:
+         return
+      more = "" if self.text_file.complete else "+"
+      self.page_label.setText("Page %d of %d%s, %d%s lines %s" %(self.page + 1, self.text_file.page_count(), more,
+                                                                 self.text_file.line_count(), more, message))
+
+   def find_next(self):
+      """ Finds the search text after the last match, wrapping around at
+          the end of the file, and shows the page holding it """
+      text = self.search_text.text()
+      if self.text_file is None or len(text) < 1:
+         return
+      start = self.match[1] if self.match is not None else self.text_file.pages[self.page]
+      try:
+         found = self.text_file.search(text, start, regex=self.regex_box.isChecked(),
+                                       ignore_case=not self.case_box.isChecked())
+         if found is None and start > 0:
+            found = self.text_file.search(text, 0, regex=self.regex_box.isChecked(),
+                                          ignore_case=not self.case_box.isChecked())
+      except re.error as e:
+         self.update_page_label("-- bad regular expression: %s" %str(e))
+         return
+      if found is None:
+         self.update_page_label("-- not found")
+         return
+      self.match = found
+      page, line = self.text_file.line_at(found[FIRST])
+      self.show_page(page, line)
+
+   def closeEvent(self, event):
+      self.close_file()
+      super().closeEvent(event)
+
 # ============================================================================= Main Window
 # Create the main window and inherit from the base class Qwidget
 class MainWindow(QMainWindow):
@@ -147,11 +358,39 @@ class MainWindow(QMainWindow):
       # self.loaded_test_target = ""
       self.loaded_target = ""
       self.test_case_full_pathname_list = []
+      self.test_case_options_list = []
+      self.test_case_matrix_list = []
+      self.param_totals = {}   # \__ parameter sets of each matrix test case of
+      self.param_tally  = {}   # /   a run and {result: count} of the finished ones
       self.test_case_results = []
+      self.test_suite = {"settings": {}, "cases": []}
+      self.tag_cache = TagCache(TAG_CACHE)  # Tags of the test cases, see lib/suite.py
+      self.file_monitor = None   # Watch mode file monitor
+      self.watch_timer  = None   # Timer that polls the file monitor
+      self.active_runner = None  # TestRunner while test cases are running
+      self.results_browser = None  # Created the first time it is opened
+
+      # Runner settings (worker slots, workspaces, limits), see the conf file
+      try:
+         self.configs = RunnerConfig(CONFIG_FILE)
+      except ConfigError as e:
+         logger.error("%s, using the default settings" %str(e))
+         self.configs = RunnerConfig()
+      # Edits to the conf file are picked up while the tool is open
+      self.config_timer = QTimer(self)
+      self.config_timer.timeout.connect(self.check_config)
+      self.config_timer.start(2000)
+      # Registry of the runs in the results tree, shared with the other GUI
+      # and headless instances that write to it
+      self.registry = RunRegistry(RESULTS_HOME)
+      # Prometheus metrics of the runner, when turned on in the conf file
+      self.metrics = create_metrics(self.configs)
 
       self.pass_color    = QColor(100, 255, 100) # light green 
       self.fail_color    = QColor(255, 100, 100) # light red 
       self.running_color = QColor(255, 255, 100) # light yellow
+      self.limit_color   = QColor(255, 170,  60) # light orange
+      self.flaky_color   = QColor(200, 255, 120) # light yellow green
 
       self.ready_icon     = ClickableQIcon( os.path.join(RESOURCE_PATH, "ready.png"   ) )
       self.running_icon   = ClickableQIcon( os.path.join(RESOURCE_PATH, "running.jpg" ) )
@@ -325,6 +564,11 @@ class MainWindow(QMainWindow):
       open_action.setStatusTip('Open a Test Suite')
       open_action.triggered.connect( self.open_test_suite)
       # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+      browse_results_action = QAction('&Browse Results', self)
+      browse_results_action.setShortcut('Ctrl+B')
+      browse_results_action.setStatusTip('Browse the results of past runs')
+      browse_results_action.triggered.connect( self.open_results_browser)
+      # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
       exit_action = QAction(QIcon(os.path.join(MY_PATH, '../res/exit.png')), '&Exit', self)
       exit_action.setShortcut('Ctrl+Q')
       exit_action.setStatusTip('Exit application')
@@ -344,7 +588,25 @@ class MainWindow(QMainWindow):
       stop_tests_action = QAction(QIcon(os.path.join(MY_PATH, '../res/stop.png')), '&Stop Test', self)
       stop_tests_action.setShortcut('Ctrl+S')
       stop_tests_action.setStatusTip('Stops running tests')
-      stop_tests_action.triggered.connect( self.open_test_suite)
+      stop_tests_action.triggered.connect( self.stop_test_suite)
+      # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+      run_failed_first_action = QAction('Run &Failed First', self)
+      run_failed_first_action.setStatusTip('Run all tests, the ones that failed last time first')
+      run_failed_first_action.triggered.connect( self.run_failed_first)
+      # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+      run_failed_only_action = QAction('Rerun Failed &Only', self)
+      run_failed_only_action.setStatusTip('Run only the tests that failed last time')
+      run_failed_only_action.triggered.connect( self.run_failed_only)
+      # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+      self.watch_action = QAction('&Watch Mode', self)
+      self.watch_action.setShortcut('Ctrl+W')
+      self.watch_action.setStatusTip('Run changed tests again when their files change')
+      self.watch_action.setCheckable(True)
+      self.watch_action.toggled.connect( self.toggle_watch_mode)
+      # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+      execution_profile_action = QAction('E&xecution Profile', self)
+      execution_profile_action.setStatusTip('Select an execution profile from the conf file')
+      execution_profile_action.triggered.connect( self.select_execution_profile)
       # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
       help_action = QAction(QIcon(os.path.join(MY_PATH, '../res/help.png')), '&Help', self)
       help_action.setShortcut('Ctrl+H')
@@ -362,11 +624,16 @@ class MainWindow(QMainWindow):
       helpMenu = menu_bar.addMenu('&Help')
       # - - - - - - - - - - - - - - - - - - -
       fileMenu.addAction(open_action)    
+      fileMenu.addAction(browse_results_action)
       fileMenu.addAction(exit_action)
       # - - - - - - - - - - - - - - - - - - -
       testMenu.addAction(select_target_action)
       testMenu.addAction(run_tests_action)
+      testMenu.addAction(run_failed_first_action)
+      testMenu.addAction(run_failed_only_action)
       testMenu.addAction(stop_tests_action)
+      testMenu.addAction(self.watch_action)
+      testMenu.addAction(execution_profile_action)
       # - - - - - - - - - - - - - - - - - - -
       helpMenu.addAction(help_action)
       helpMenu.addAction(about_action)
@@ -379,6 +646,8 @@ class MainWindow(QMainWindow):
              select_target then calls load_test_cases() 
           Once a test suite is opened, the user may later choose a new target for the same 
           test suite as teh select_target() method call load_test_cases().      """ 
+      if self.run_in_progress():
+         return
       
       self.test_case_data_list = []
       url = QUrl()                                    # This File Dialog should start in  
@@ -390,40 +659,7 @@ class MainWindow(QMainWindow):
       file_dialog.setDirectoryUrl(url)
       self.testsuite_file, _ = file_dialog.getOpenFileName(self,"QFileDialog.getOpenFileName()", "","All Files (*)", options=options)
       if self.testsuite_file:
-         self.test_suite_label.setText("Test Suite: %s" %self.testsuite_file.split('/')[LAST])
-         message = "Loaded Test Suite:  %s" %self.testsuite_file 
-         logger.info(message)
-         # Crate a list of test cases from the test suite file. However, these 
-         # test cases are only file names with not path. We'll have to add the path 
-         # based on the target selected.   
-         try:
-            f = open(self.testsuite_file, 'r')
-            lines = f.readlines()
-            f.close()
-            self.suite_text_area.clear()
-            for line in lines:
-               line = line.strip()
-               self.suite_text_area.append(line)
-         except:
-            message = "Unalbe to read test cases from test suite %s" %self.testsuite_file
-            logger.error(message)
-            self.suite_text_area.setText(message) 
-            lines = []
-
-         self.test_case_file_list = [] # a list of test case file names with no paths
-         for line in lines:
-            line = line.strip()
-            if len(line) < 1:
-               pass
-            elif line.startswith('#'):
-               pass
-            else:
-               self.test_case_file_list.append(line)     
-
-         self.test_case_count = len(self.test_case_file_list)
-         message = "Found %d test cases in %s" %(self.test_case_count, self.testsuite_file.split('/')[LAST])
-         logger.info(message)
-         self.status_bar.showMessage(message)  
+         self.read_test_suite_file()
 
          # open the select a test target for this suite
          self.select_target()  
@@ -432,6 +668,46 @@ class MainWindow(QMainWindow):
          # logger.info("Back from select_target() ... calling load_test_cases()")
          # self.load_test_cases()
 
+   # -------------------------------------------------------------------------- read_test_suite_file() 
+   def read_test_suite_file(self):
+      """ Reads the test suite file into the suite text area and parses the 
+          test cases and settings out of it. """
+      self.test_suite_label.setText("Test Suite: %s" %self.testsuite_file.split('/')[LAST])
+      message = "Loaded Test Suite:  %s" %self.testsuite_file 
+      logger.info(message)
+      # Crate a list of test cases from the test suite file. However, these 
+      # test cases are only file names with not path. We'll have to add the path 
+      # based on the target selected.   
+      try:
+         f = open(self.testsuite_file, 'r')
+         lines = f.readlines()
+         f.close()
+         self.suite_text_area.clear()
+         for line in lines:
+            line = line.strip()
+            self.suite_text_area.append(line)
+      except:
+         message = "Unalbe to read test cases from test suite %s" %self.testsuite_file
+         logger.error(message)
+         self.suite_text_area.setText(message) 
+         lines = []
+
+      self.test_case_file_list = [] # a list of test case file names (or patterns) with no paths
+      self.test_suite = {"settings": {}, "cases": [], "files": [], "dynamic": False}
+      try:
+         self.test_suite = read_test_suite(self.testsuite_file)
+         for case in self.test_suite["cases"]:
+            self.test_case_file_list.append(case["name"])
+      except SuiteError as e:
+         message = str(e)
+         logger.error(message)
+         self.suite_text_area.append(message)
+
+      self.test_case_count = len(self.test_case_file_list)
+      message = "Found %d test cases in %s" %(self.test_case_count, self.testsuite_file.split('/')[LAST])
+      logger.info(message)
+      self.status_bar.showMessage(message)  
+
    # -------------------------------------------------------------------------- load_test_cases()
    def load_test_cases(self):
       """ When we load the test cases from the test suite file we populate the 
@@ -442,15 +718,37 @@ class MainWindow(QMainWindow):
       self.test_cases = []                # Start with an empty list of test cases 
       self.testcase_list_widget.clear()   # Clear any test cases from the test case frame 
       self.testcase_list_widget_items_list = []
+      self.test_case_full_pathname_list = []  # \
+      self.test_case_options_list = []        #  > runnable test cases, their 
+      self.test_case_list_items = []          # /  options and list items
+      self.test_case_matrix_list = []         # parameter matrix of each runnable test case, or None
       
       if len(self.test_case_file_list) > 0:
          
          counter = 0 
+         # Patterns, includes and tag filters make the resolved list differ
+         # from the lines of the suite file. A test case with a parameter 
+         # matrix gets one list item with the number of its parameter sets, 
+         # the sets are read when the test case runs. 
+         try:
+            suite_cases = resolve_test_cases(self.test_suite,
+                                             os.path.join(TESTCASE_PATH, self.loaded_target),
+                                             self.tag_cache,
+                                             os.path.join(TESTDATA_PATH, self.loaded_target))
+         except SuiteError as e:
+            message = str(e)
+            logger.error(message)
+            self.suite_text_area.append(message)
+            self.status_bar.showMessage(message)
+            return
  
-         for t in self.test_case_file_list:
+         for suite_case in suite_cases:
  
             counter += 1
-            logger.info("Loading test case %d of %d %s" %(counter, len(self.test_case_file_list), t) )
+            t = suite_case["name"]
+            if suite_case.get("matrix") is not None:
+               t = "%s (%d parameter sets)" %(t, len(suite_case["matrix"]))
+            logger.info("Loading test case %d of %d %s" %(counter, len(suite_cases), t) )
 
             # In this loop the variable t is the file name of a candidate test case 
             # without the path of the file. We will need to use the target to 
@@ -467,9 +765,9 @@ class MainWindow(QMainWindow):
             #       "failed"    - Test case failed one or more steps 
             #       "error"     - Test case finished with and error, not the same as a failure 
 
-            # Definethe full path of the candidate test case 
-            test_case_path_filename = ""
-            test_case_path_filename =  os.path.join(  os.path.join(TESTCASE_PATH, self.loaded_target), t  )
+            # Definethe full path of the candidate test case, None if the file 
+            # is not in the target folder 
+            test_case_path_filename = suite_case["file"]
             message = "Test case full path %s" %(test_case_path_filename) 
             logger.info(message)
 
@@ -477,11 +775,13 @@ class MainWindow(QMainWindow):
 
             # if the full path test case file exists then we mark it a ready
             # otherwise we mark it a not ready  
-            if os.path.isfile( test_case_path_filename  ):
+            if test_case_path_filename is not None:
                test_case_record = {"name": t, "state":ready, "file": test_case_path_filename}   
                #                                                                 # \  ***    This is the list of    ***
                self.test_case_full_pathname_list.append(test_case_path_filename) #  > ***   executable test cases   ***
                #                                                                 # /  *** used for "run test suite" *** 
+               self.test_case_options_list.append(suite_case["options"])
+               self.test_case_matrix_list.append(suite_case.get("matrix"))
             else: 
                test_case_record = {"name": t, "state":not_ready, "file": None}   
              
@@ -503,6 +803,8 @@ class MainWindow(QMainWindow):
             list_item.setIcon(test_case_record["icon"])
             self.testcase_list_widget.addItem(list_item)
             self.testcase_list_widget_items_list.append(list_item)
+            if test_case_record["state"] == ready:
+               self.test_case_list_items.append(list_item)
       else:
          message = "Failed to load any test cases from %s" %self.testsuite_file.split('/')[LAST] 
          logger.warning(message) 
@@ -524,6 +826,8 @@ class MainWindow(QMainWindow):
    # -------------------------------------------------------------------------- select_target()
    def select_target(self):
       """ Select a target from teh list of available test targets """ 
+      if self.run_in_progress():
+         return
       self.update_list_of_test_targets()
       targets = []
       for target in self.target_list[1:]:
@@ -538,123 +842,144 @@ class MainWindow(QMainWindow):
          logger.info("Back from select_target() ... calling load_test_cases()")
          self.load_test_cases()
 
+         # Watch the folders of the new target 
+         if self.file_monitor is not None:
+            self.start_watch_mode()
+
    # -------------------------------------------------------------------------- run_test_suite()
    def run_test_suite(self):
       """ Execute all of the tests in a test suite. The list of executables is 
           stored in self.test_case_full_pathname_list. """ 
+      self.run_test_cases(range(len(self.test_case_full_pathname_list)))
+
+   # -------------------------------------------------------------------------- run_failed_first()
+   def run_failed_first(self):
+      """ Execute all of the tests, the ones that failed last time first """
+      self.run_test_cases(range(len(self.test_case_full_pathname_list)), "failed-first")
+
+   # -------------------------------------------------------------------------- run_failed_only()
+   def run_failed_only(self):
+      """ Execute only the tests that failed last time """
+      self.run_test_cases(range(len(self.test_case_full_pathname_list)), "failed-only")
+
+   # -------------------------------------------------------------------------- stop_test_suite()
+   def stop_test_suite(self):
+      """ Stops a running test suite, running test cases are killed """
+      if self.active_runner is not None:
+         self.active_runner.stop(kill=True, reason="stopped by the user")
+         self.status_bar.showMessage("Stopping test suite ...")
+
+   # -------------------------------------------------------------------------- run_in_progress()
+   def run_in_progress(self):
+      """ Returns True, with a message, while test cases run. The menu stays 
+          live during a run and the runner callbacks index the test case list 
+          items, so the suite and target must not be reloaded under them. """
+      if self.active_runner is None:
+         return False
+      self.status_bar.showMessage("Test suite running, stop it or wait for it to finish first")
+      return True
+
+   # -------------------------------------------------------------------------- run_test_cases()
+   def run_test_cases(self, indexes, policy=None):
+      """ Execute the test cases at the given indexes of 
+          self.test_case_full_pathname_list. Their list items are updated in place. 
+          The run policy (file-order, failed-first, failed-only) defaults to 
+          the run_policy config. """ 
+
+      if self.active_runner is not None:
+         return  # already running 
           
       if len(self.test_case_full_pathname_list) > 0:
 
-         self.suite_results_folder = os.path.join(RESULTS_HOME, time.strftime("%Y%m%d%H%M%S", time.localtime())   )
-         os.mkdir(self.suite_results_folder)
-         message = "Created suite results folder %s" %self.suite_results_folder
-         logger.info(message)
+         # Order the test cases by their last results 
+         history = ResultHistory(RESULTS_HOME, self.loaded_target)
+         policy  = policy or self.configs.get("run_policy")
+         cases = []
+         self.param_totals = {}
+         self.param_tally  = {}
+         for index in indexes:
+            case = {"file"    : self.test_case_full_pathname_list[index],
+                    "options" : self.test_case_options_list[index],
+                    "index"   : index}
+            if self.test_case_matrix_list[index] is not None:
+               case["matrix"] = self.test_case_matrix_list[index]
+               self.param_totals[index] = len(case["matrix"])
+            cases.append(case)
+         count = sum(self.param_totals.values()) + len(cases) - len(self.param_totals)
+         if policy != "file-order":
+            # Ordering by the last results needs every parameter set, in file
+            # order the runner reads them as it goes
+            cases = list(expand_test_cases(cases))
+         try:
+            cases = history.order(cases, policy)
+         except HistoryError as e:
+            logger.error(str(e))
+            self.status_bar.showMessage(str(e))
+            return
+         if len(cases) < 1:
+            self.status_bar.showMessage("No failed test cases to run")
+            return
+
+         # Runs left behind by a runner that died are marked abandoned
+         for entry in self.registry.reap():
+            logger.warning("Marked run %s abandoned, its runner (pid %s on %s) is gone"
+                           %(entry["id"], entry.get("pid", "?"), entry.get("host", "?")))
+         title = "%s %s" %(self.loaded_target, os.path.basename(self.testsuite_file))
+         try:
+            registered_run = self.registry.create_run(title=title, target=self.loaded_target, suite=self.testsuite_file)
+         except (RegistryError, OSError) as e:
+            message = "Unable to create the run folder: %s" %str(e)
+            logger.error(message)
+            self.status_bar.showMessage(message)
+            return
+         self.suite_results_folder = registered_run.folder
 
          # intiialize a list of dictionaries to store the results of this test suite run
          self.test_suite_results = []  
 
-         # This is the main loop for executing test cases.
-         # In this loop we create folders for the results 
-         # of each test case and call/run each test cases
-         # and provide the test cases results folder name 
-         # as the last argument to the test case invocation
-         # command. We also keep track of the test case 
-         # results and store them in the test case list: 
-         #  self.test_case_results   
-         counter = 0
-         for test_case in self.test_case_full_pathname_list:
-         
-            test_case_results = {}
-            self.active_test_case = test_case
-            self.active_test_case_results_folder = ""
-
-            counter += 1  
-
-            # Make the test case results folder
-            test_case_short_name = test_case.split('/')[LAST]   
-            if '.' in test_case_short_name:
-               test_case_short_name = test_case_short_name.split('.')[FIRST]
-            test_case_results_folder = os.path.join(self.suite_results_folder, test_case_short_name)
-            os.mkdir(test_case_results_folder)
-            self.active_test_case_results_folder = test_case_results_folder
-            message = "Created test case resulst folder %s" %test_case_results_folder
-            logger.info(message)
-
-            # Identify and use the test case list widget item for this test case 
-            list_item  = self.testcase_list_widget_items_list[counter - 1]
-            bg_color   = self.running_color
-            icon       = self.running_icon
-            text       = "Test: %s\nFile: %s\nState: Running" %(test_case.split('/')[LAST], test_case, )
-            self.set_test_case_list_wdiget_item(list_item, icon, bg_color, text )
-            message = "Running Test case %d of %d: %s " %(counter, len(self.test_case_full_pathname_list), test_case)
-            logger.info(message)
+         # The runner executes the test cases in its worker slots, creates a 
+         # results folder for each of them and calls back into the main 
+         # window as test cases start, write output and finish. The index of 
+         # each case is the index of its test case list widget item. 
+         try:
+            runner = TestRunner(self.suite_results_folder, 
+                                data_folder    = os.path.join(TESTDATA_PATH, self.loaded_target),
+                                configs        = self.configs,
+                                on_start       = self.test_case_started,
+                                on_output      = self.test_case_output,
+                                on_finish      = self.test_case_finished,
+                                on_retry       = self.test_case_retried,
+                                on_idle        = qApp.processEvents,
+                                history        = history,
+                                metrics        = self.metrics,
+                                title          = title,
+                                registered_run = registered_run)
+         except RunnerError as e:
+            registered_run.finish(RUN_FAILED, error=str(e))
+            message = "Unable to run the test suite: %s" %str(e)
+            logger.error(message)
             self.status_bar.showMessage(message)
-
-            self.repaint() # heavy sigh ...
-
-            # *************************
-            # *** RUN THE TEST CASE ***
-            # *************************
-            results = self.execute_test_case()
-            if results["return_code"] == 0:
-               list_item  = self.testcase_list_widget_items_list[counter - 1]
-               bg_color   = self.pass_color
-               icon       = self.passed_icon
-               text       = "Test: %s\nFile: %s\nState: PASSED" %(test_case.split('/')[LAST], test_case, )
-               self.set_test_case_list_wdiget_item(list_item, icon, bg_color, text )
-               test_case_results = {"testcase"       : test_case_short_name, 
-                                    "file"           : test_case, 
-                                    "result"         : "passed", 
-                                    "results_folder" : test_case_results_folder }
-            else:
-               list_item  = self.testcase_list_widget_items_list[counter - 1]
-               bg_color   = self.fail_color
-               icon       = self.failed_icon
-               text       = "Test: %s\nFile: %s\nState: FAIILED" %(test_case.split('/')[LAST], test_case, )
-               self.set_test_case_list_wdiget_item(list_item, icon, bg_color, text )
-               test_case_results = {"testcase"       : test_case_short_name, 
-                                    "file"           : test_case, 
-                                    "result"         : "failed", 
-                                    "results_folder" : test_case_results_folder }
-            self.repaint()
-
-            # Write the output and errors files to the test case results folder 
-            # output  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-            tc_output = results["output"]
-            tc_output = tc_output.strip()
-            if len(tc_output) < 1:
-               pass
-            else:
-               output_file = os.path.join(test_case_results_folder, TC_OUTPUT_FILE) 
-               try:
-                  f = open(output_file, 'w')
-                  f.write(tc_output)
-                  f.close()
-               except Exception as e:
-                  message = "Ubnable to write to test case output file %s" %output_file
-                  logger.error(message)
-            # errors  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-            tc_errors = results["error"]
-            tc_errors = tc_errors.strip()
-            if len(tc_errors) < 1:
-               pass
-            else:
-               errors_file = os.path.join(test_case_results_folder, TC_ERRORS_FILE) 
-               try:
-                  f = open(errors_file, 'w')
-                  f.write(tc_errors)
-                  f.close()
-               except Exception as e:
-                  message = "Ubnable to write to test case errors file %s" %errors_file
-                  logger.error(message)
-
-            # Test Suite results can be used later in summary reports or general reporting   
-            self.test_suite_results.append(test_case_results)
-
-            message = "test case %d of %d complete" %(counter, len(self.test_case_full_pathname_list))
+            return
+         self.show_case_names = len(runner.slots) > 1
+         self.finished_count  = 0
+         self.case_count      = count if policy == "file-order" else count_test_cases(cases)
+
+         # ***************************
+         # *** RUN THE TEST CASES  ***
+         # ***************************
+         self.active_runner = runner
+         try:
+            self.test_suite_results = runner.run(cases, self.case_count)
+         finally:
+            self.active_runner = None
+            if self.file_monitor is not None:
+               # What the test cases wrote into their data folder must not 
+               # run them again in watch mode 
+               self.file_monitor.discard([os.path.join(TESTDATA_PATH, self.loaded_target)])
+         if runner.stop_reason is not None:
+            message = "Test suite stopped (%s), %d test cases not run" %(runner.stop_reason, len(runner.not_run))
+            logger.warning(message)
             self.status_bar.showMessage(message)
-            logger.info(message)
-            # Need a method for updateing all of the attributes of a list item 
          
          # Log the results
          logger.info("Test suite results:")
@@ -670,6 +995,221 @@ class MainWindow(QMainWindow):
          mBox.setStandardButtons(QMessageBox.Ok)
          mBox.exec_()
 
+   # -------------------------------------------------------------------------- test_case_started()
+   def test_case_started(self, case):
+      """ Runner callback, marks the list item of a test case as running """
+      test_case  = case["file"]
+      list_item  = self.test_case_list_items[case["index"]]
+      bg_color   = self.running_color
+      icon       = self.running_icon
+      text       = "Test: %s\nFile: %s\nState: Running" %(test_case.split('/')[LAST], test_case, )
+      text      += self.parameter_text(case)
+      self.set_test_case_list_wdiget_item(list_item, icon, bg_color, text )
+      message = "Running Test case %d of %d: %s " %(case["index"] + 1, len(self.test_case_full_pathname_list), test_case)
+      logger.info(message)
+      self.status_bar.showMessage(message)
+      self.repaint() # heavy sigh ...
+
+   # -------------------------------------------------------------------------- parameter_text()
+   def parameter_text(self, case):
+      """ Returns the line naming the parameter set of a matrix test case, 
+          and how many of its sets are done, for its list item. An empty 
+          string for other test cases. """
+      if "param_id" not in case:
+         return ""
+      text  = "\nParameters: %s" %case["param_id"]
+      tally = self.param_tally.get(case["index"])
+      if tally:
+         not_passed = sum(n for r, n in tally.items() if r not in (passed, flaky))
+         text += " (%d of %d sets done, %d not passed)" %(sum(tally.values()), self.param_totals.get(case["index"], 0), not_passed)
+      return text
+
+   # -------------------------------------------------------------------------- test_case_output()
+   def test_case_output(self, case, data, stream):
+      """ Runner callback, shows test case output in the console area. When 
+          test cases run side by side each line is prefixed with its name. """
+      data = "%s" %str(data).strip()
+      if self.show_case_names:
+         data = "\n".join("[%s] %s" %(case["name"], line) for line in data.split("\n"))
+      self.console_text_area.append(data)
+      self.console_text_area.moveCursor(QTextCursor.End)
+      self.repaint()   
+
+   # -------------------------------------------------------------------------- test_case_retried()
+   def test_case_retried(self, case, test_case_results):
+      """ Runner callback, a test case did not pass and waits for its next
+          attempt after the other test cases """
+      test_case  = case["file"]
+      list_item  = self.test_case_list_items[case["index"]]
+      bg_color   = self.running_color
+      icon       = self.running_icon
+      text       = "Test: %s\nFile: %s\nState: Waiting for a retry (%s on attempt %d)" %(test_case.split('/')[LAST], test_case,
+                                                                                       test_case_results["result"],
+                                                                                       test_case_results["attempt"])
+      text      += self.parameter_text(case)
+      self.set_test_case_list_wdiget_item(list_item, icon, bg_color, text )
+      logger.warning("Test case %s %s on attempt %d, it will be retried" %(test_case, test_case_results["result"],
+                                                                            test_case_results["attempt"]))
+      self.repaint()
+
+   # -------------------------------------------------------------------------- test_case_finished()
+   def test_case_finished(self, case, test_case_results):
+      """ Runner callback, shows the result of a test case on its list item """
+      test_case = case["file"]
+      list_item = self.test_case_list_items[case["index"]]
+      result    = test_case_results["result"]
+      if "param_id" in case:
+         # The parameter sets of a matrix share one list item, it keeps 
+         # showing a set that did not pass 
+         tally = self.param_tally.setdefault(case["index"], {})
+         tally[result] = tally.get(result, 0) + 1
+         if result in (passed, flaky):
+            result = next((r for r in tally if r not in (passed, flaky)), result)
+      if result == passed:
+         bg_color   = self.pass_color
+         icon       = self.passed_icon
+         text       = "Test: %s\nFile: %s\nState: PASSED" %(test_case.split('/')[LAST], test_case, )
+      elif result == flaky:
+         bg_color   = self.flaky_color
+         icon       = self.passed_icon
+         text       = "Test: %s\nFile: %s\nState: FLAKY (passed on attempt %d of %d)" %(test_case.split('/')[LAST], test_case,
+                                                                                      test_case_results["attempt"],
+                                                                                      len(test_case_results["attempts"]))
+      elif result == resource_limit:
+         bg_color   = self.limit_color
+         icon       = self.failed_icon
+         text       = "Test: %s\nFile: %s\nState: RESOURCE LIMIT (%s)" %(test_case.split('/')[LAST], test_case, test_case_results.get("resource_limit", "earlier set"))
+      elif result == error:
+         bg_color   = self.fail_color
+         icon       = self.failed_icon
+         text       = "Test: %s\nFile: %s\nState: ERROR" %(test_case.split('/')[LAST], test_case, )
+      else:
+         bg_color   = self.fail_color
+         icon       = self.failed_icon
+         text       = "Test: %s\nFile: %s\nState: FAIILED" %(test_case.split('/')[LAST], test_case, )
+         if "watch_match" in test_case_results:
+            text += "\nMatched: %s" %test_case_results["watch_match"]["line"]
+      text += self.parameter_text(case)
+      if test_case_results.get("affinity"):
+         text += "\nCPUs: %s (%s)" %(test_case_results["affinity"], test_case_results["slot"])
+      if "profile" in test_case_results:
+         text += "\nProfiled (%s), overhead %s" %(test_case_results["profile"]["profiler"], test_case_results["profile"]["overhead"])
+      self.set_test_case_list_wdiget_item(list_item, icon, bg_color, text )
+      self.repaint()
+
+      self.finished_count += 1
+      message = "test case %d of %d complete" %(self.finished_count, self.case_count)
+      self.status_bar.showMessage(message)
+      logger.info(message)
+
+   # -------------------------------------------------------------------------- toggle_watch_mode()
+   def toggle_watch_mode(self, checked):
+      """ Turns watch mode on or off. In watch mode the test case and test 
+          data folders of the target and the test suite file are monitored 
+          and the test cases affected by a change are run again. """
+      if checked:
+         if len(self.test_case_full_pathname_list) < 1:
+            self.status_bar.showMessage("Load a test suite and target before turning on watch mode")
+            self.watch_action.setChecked(False)
+            return
+         self.start_watch_mode()
+      else:
+         self.stop_watch_mode()
+         self.status_bar.showMessage("Watch mode off")
+
+   # -------------------------------------------------------------------------- select_execution_profile()
+   def select_execution_profile(self):
+      """ Select one of the [profile name] sections of the conf file """
+      profiles = ["(none)"] + self.configs.profiles
+      current  = profiles.index(self.configs.active) if self.configs.active in profiles else 0
+      item, okPressed = QInputDialog.getItem(self, "Select Execution Profile", "Profile:", profiles, current, False)
+      if okPressed and item:
+         try:
+            self.configs.select_profile("" if item == "(none)" else item)
+         except ConfigError as e:
+            self.status_bar.showMessage(str(e))
+            return
+         self.metrics = create_metrics(self.configs, self.metrics)
+         message = "Execution profile: %s" %item
+         logger.info(message)
+         self.status_bar.showMessage(message)
+
+   # -------------------------------------------------------------------------- check_config()
+   def check_config(self):
+      """ Reloads the conf file when it changed. Bad settings are reported
+          and the previous ones are kept. """
+      try:
+         if self.configs.reload():
+            self.metrics = create_metrics(self.configs, self.metrics)
+            message = "Reloaded %s" %CONFIG_FILE
+            logger.info(message)
+            self.status_bar.showMessage(message)
+      except ConfigError as e:
+         message = "%s, keeping the previous settings" %str(e)
+         logger.error(message)
+         self.status_bar.showMessage(message)
+
+   # -------------------------------------------------------------------------- start_watch_mode()
+   def start_watch_mode(self):
+      """ (Re)starts monitoring the loaded test suite and target """
+      self.stop_watch_mode()
+      paths = [os.path.join(TESTCASE_PATH, self.loaded_target),
+               os.path.join(TESTDATA_PATH, self.loaded_target)] + \
+              (self.test_suite.get("files") or [self.testsuite_file])
+      self.file_monitor = FileMonitor(paths)
+      self.watch_timer = QTimer(self)
+      self.watch_timer.timeout.connect(self.check_for_changes)
+      self.watch_timer.start(250)
+      message = "Watch mode on (%s)" %self.file_monitor.mode
+      logger.info(message)
+      self.status_bar.showMessage(message)
+
+   # -------------------------------------------------------------------------- stop_watch_mode()
+   def stop_watch_mode(self):
+      if self.watch_timer is not None:
+         self.watch_timer.stop()
+         self.watch_timer = None
+      if self.file_monitor is not None:
+         self.file_monitor.close()
+         self.file_monitor = None
+
+   # -------------------------------------------------------------------------- check_for_changes()
+   def check_for_changes(self):
+      """ Watch mode timer callback, runs the test cases affected by changes """
+      if self.active_runner is not None:
+         return  # changes are picked up once the running test cases are done
+      changes = self.file_monitor.poll()
+      if len(changes) < 1:
+         return
+      logger.info("Watch mode changes: %s" %sorted(changes))
+      old_cases = self.runnable_test_cases()
+      if os.path.abspath(self.testsuite_file) in changes or \
+         suite_affected(self.test_suite, changes, os.path.join(TESTCASE_PATH, self.loaded_target)):
+         # The suite, a suite it includes or, for a suite of patterns and 
+         # tags, the test case folder changed. Reload the suite and run the 
+         # new and changed test cases 
+         self.read_test_suite_file()
+         self.load_test_cases()
+         indexes = set(changed_test_cases(old_cases, self.runnable_test_cases()))
+      else:
+         indexes = set()
+      indexes |= set(affected_test_cases(changes, self.runnable_test_cases(),
+                                         os.path.join(TESTCASE_PATH, self.loaded_target),
+                                         os.path.join(TESTDATA_PATH, self.loaded_target)))
+      if len(indexes) > 0:
+         message = "Watch mode: running %d changed test case(s)" %len(indexes)
+         logger.info(message)
+         self.status_bar.showMessage(message)
+         self.run_test_cases(sorted(indexes))
+      # Other changes made while the test cases ran are picked up on the next 
+      # poll 
+
+   # -------------------------------------------------------------------------- runnable_test_cases()
+   def runnable_test_cases(self):
+      """ Returns the runnable test cases as a list of {"file", "options"} """
+      return [{"file": f, "options": o} for f, o in zip(self.test_case_full_pathname_list, 
+                                                        self.test_case_options_list)]
+
    # -------------------------------------------------------------------------- set_test_case_list_wdiget_item()
    def set_test_case_list_wdiget_item(self, list_widget_item, icon , background_color, text ):
       """ sets the properties of a test cacse list widget item
@@ -688,57 +1228,20 @@ class MainWindow(QMainWindow):
       """ """
       self.about_dialog.exec()
 
+   # -------------------------------------------------------------------------- open_results_browser() 
+   def open_results_browser(self):
+      """ Shows the results browser next to the main window """
+      if self.results_browser is None:
+         self.results_browser = ResultsBrowser(RESULTS_HOME)
+      self.results_browser.refresh()
+      self.results_browser.show()
+      self.results_browser.raise_()
+
    # -------------------------------------------------------------------------- open_help() 
    def open_help(self):
       """ """
       self.help_dialog.exec()
 
-   # -------------------------------------------------------------------------- execute_test_case()
-   def execute_test_case(self):
-      """ """
-
-      # If the active test case is a python script then be sure to run it 
-      # UNBUFFERED mode otehrwise just execute the active test case 
-      if self.active_test_case.endswith('.py') or self.active_test_case.endswith('.Py') or self.active_test_case.endswith('.PY') :
-         command_list = [PYTHON_INTERPRETER, "-u", self.active_test_case]
-      else:
-         command_list = [self.active_test_case]
-      message = "RUNING:\n%s\n\nRESULTS IN:\n%s\n\n" %(self.active_test_case, self.active_test_case_results_folder)
-      logger.info(message)   
-
-      p = subprocess.Popen(command_list           , 
-                           stdout=subprocess.PIPE ,
-                           stderr=subprocess.PIPE )
-
-      output_buffer  = ""
-      error_buffer   = ""
-      return_code    = 127
-
-      sel = selectors.DefaultSelector()
-      sel.register(p.stdout, selectors.EVENT_READ)
-      sel.register(p.stderr, selectors.EVENT_READ)
-      
-      while p.poll() == None:
-         for key, _ in sel.select():
-            
-            data = key.fileobj.read1().decode()
-            if not data:
-               break
-            if key.fileobj is p.stdout:
-               output_buffer += data             
-            else:
-               error_buffer += data   
-
-            data = "%s" %str(data).strip()
-            # text_buffer += data
-            self.console_text_area.append(data)
-            self.console_text_area.moveCursor(QTextCursor.End)
-            self.repaint()   
-   
-      return {"return_code": p.poll()      ,
-              "output"     : output_buffer ,
-              "error"      : error_buffer  }   
-
    # -------------------------------------------------------------------------- event()
    def event(self, e):
       """ Manages the default text of the status bar """
@@ -0,0 +1,372 @@
+#!/usr/bin/python3
+
+# The Test Master II headless runner
+# Runs a test suite against a target from the command line without the GUI,
+# for lab machines and CI. Results are written to the testresults folder
+# exactly as the GUI writes them. See the README and HELP files
+
+# -----------------------------------------------------------------------------
+# Standard Library Imports
+import os
+import sys
+import logging
+from getopt import getopt, GetoptError
+
+# -----------------------------------------------------------------------------
+# Some useful variables
+VERSION        = "1.0.0"
+APP_NAME       = "Test Master II (headless)"
+FIRST          = 0
+LAST           = -1
+ME             = os.path.split(sys.argv[FIRST])[LAST]  # Name of this file
+MY_PATH        = os.path.dirname(os.path.realpath(__file__))  # Path for this file
+LIBRARY_PATH   = os.path.join(MY_PATH, "../lib")
+LOG_PATH       = os.path.join(MY_PATH, "../log")
+LOG_FILE       = os.path.join(LOG_PATH, "%s.log" % ME.split('.')[FIRST])  # testmaster_cli.log
+LOG_FORMAT     = "%(asctime)s, %(levelname)s, %(message)s"
+TESTSUITE_PATH = os.path.join(MY_PATH, "../testsuites")
+TESTCASE_PATH  = os.path.join(MY_PATH, "../testcases")
+TESTDATA_PATH  = os.path.join(MY_PATH, "../testdata")
+RESULTS_HOME   = os.path.join(MY_PATH, "../testresults")
+TAG_CACHE      = os.path.join(RESULTS_HOME, ".tag_cache.json")
+CONFIG_PATH    = os.path.join(MY_PATH, "../conf")
+CONFIG_FILE    = os.path.join(CONFIG_PATH, "testmaster_2.conf")  # shared with the GUI
+PASSED         = "\033[32mPASSED\033[0m"  # \
+WARNING        = "\033[33mWARNING\033[0m" #  \___ Linux-specific colorization
+FAILED         = "\033[31mFAILED\033[0m"  #  /
+ERROR          = "\033[31mERROR\033[0m"   # /
+FLAKY          = "\033[33mFLAKY\033[0m"
+RETRY          = "\033[33mRETRY\033[0m"
+
+USAGE = """Usage: %s -s <test suite> -t <target> [options]
+
+   -s, --suite <file>    test suite file, a path or a file in the testsuites folder
+   -t, --target <name>   test target, a folder in the testcases folder
+   -j, --jobs <n|auto>   number of worker slots (overrides the conf file)
+   -w, --watch           keep running, run changed test cases again
+   -p, --policy <name>   file-order, failed-first or failed-only (overrides the 
+                         conf file), ordered by the last result of each test case
+   -x, --exec-profile <name>
+                         execution profile from the conf file, e.g. ci or perf
+   -f, --fail-fast <n>   stop starting test cases after n did not pass
+   -k, --kill            with --fail-fast, also kill the running test cases
+   -r, --retries <n>     run a test case that did not pass up to n more times
+                         after the other test cases, passing on a retry is
+                         reported as flaky
+   -m, --metrics <port>  serve Prometheus metrics on http://127.0.0.1:<port>/metrics
+   -c, --case <name>     run only this test case of the suite
+   -P, --profile         run the python test cases under a profiler, the
+                         profile is written to their results folders
+                         e.g. -c test_03.py -P profiles a single test case
+   -h, --help            show this help
+   -v, --version         show the version
+""" % ME
+
+# Initialize the logger
+logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format=LOG_FORMAT)
+logger = logging.getLogger()
+logger.info("%s Started =======================================================" % ME)
+
+# Import custom libraries
+sys.path.append(LIBRARY_PATH)
+from config import RunnerConfig, ConfigError
+from console import Console
+from suite import read_test_suite, resolve_test_cases, suite_affected, TagCache, SuiteError
+from suite import expand_test_cases, count_test_cases
+from runner import TestRunner, RunnerError
+from runner import passed, failed, error, resource_limit, flaky
+from monitor import FileMonitor, affected_test_cases, changed_test_cases
+from history import ResultHistory, HistoryError
+from metrics import create_metrics
+from registry import RunRegistry, RegistryError, FAILED as RUN_FAILED
+
+RESULT_LABELS = {passed: PASSED, failed: FAILED, error: ERROR, resource_limit: WARNING, flaky: FLAKY}
+
+
+# ============================================================================= HeadlessRunner
+class HeadlessRunner():
+   """ Loads a test suite for a target and runs it """
+
+   def __init__(self, suite_file, target, config, metrics=None, only=None, profile=False):
+      self.suite_file = suite_file
+      self.target     = target
+      self.config     = config   # RunnerConfig
+      self.console    = Console()
+      self.suite      = None
+      self.cases      = []  # runnable test cases {"name", "file", "options"[, "matrix"]}
+      self.case_count = 0   # test cases they expand to, parameter sets counted
+      self.tag_cache  = TagCache(TAG_CACHE)
+      self.history    = ResultHistory(RESULTS_HOME, target)
+      self.registry   = RunRegistry(RESULTS_HOME)  # shared with other runner instances
+      self.metrics    = metrics
+      self.only       = only     # name of the single test case to run
+      self.profile    = profile  # profile every test case that is run
+
+   # -------------------------------------------------------------------------- load()
+   def load(self):
+      """ Reads the test suite and finds its test cases in the target folder.
+          Test cases that are not in the target folder are reported and
+          skipped. Returns False if the suite cannot be read or does not
+          have the test case asked for. """
+      try:
+         self.suite = read_test_suite(self.suite_file)
+         suite_cases = resolve_test_cases(self.suite, os.path.join(TESTCASE_PATH, self.target), self.tag_cache,
+                                          os.path.join(TESTDATA_PATH, self.target))
+      except SuiteError as e:
+         self.console.write_error(str(e))
+         logger.error(str(e))
+         return False
+      self.cases = []
+      for case in suite_cases:
+         if self.only is not None and self.only not in (case["name"], os.path.splitext(case["name"])[FIRST]):
+            continue
+         if self.profile:
+            case["options"]["profile"] = case["options"].get("profile", []) + ["yes"]
+         if case["file"] is None:
+            message = "Test case %s not found for target %s" %(case["name"], self.target)
+            self.console.write_warning(message)
+            logger.warning(message)
+         elif "matrix" in case and case["matrix"].is_empty():
+            message = "No parameter sets in %s for test case %s" %(case["matrix"].source, case["name"])
+            self.console.write_warning(message)
+            logger.warning(message)
+         else:
+            self.cases.append(case)
+      # Counting reads every parameter file, it is done once per load
+      self.case_count = count_test_cases(self.cases)
+      message = "Found %d test cases in %s" %(self.case_count, os.path.basename(self.suite_file))
+      logger.info(message)
+      if self.only is not None and len(self.cases) < 1:
+         self.console.write_error("Test case %s is not in %s" %(self.only, os.path.basename(self.suite_file)))
+         return False
+      return True
+
+   # -------------------------------------------------------------------------- run()
+   def run(self, indexes=None):
+      """ Runs the test cases at the indexes (all by default) and returns
+          the list of results """
+      if indexes is None:
+         indexes = range(len(self.cases))
+      cases = [dict((k, self.cases[i][k]) for k in ("file", "options", "matrix") if k in self.cases[i]) for i in indexes]
+      policy = self.config.get("run_policy")
+      if policy != "file-order":
+         # Ordering by the last results needs every parameter set, in file
+         # order the runner reads them as it goes
+         cases = list(expand_test_cases(cases))
+      cases = self.history.order(cases, policy)
+      if policy == "file-order" and len(indexes) == len(self.cases):
+         count = self.case_count
+      else:
+         count = count_test_cases(cases)
+      if len(cases) < 1:
+         self.console.write_warning("No test cases to run. Nothing to do")
+         return []
+      for entry in self.registry.reap():
+         self.console.write_warning("Marked run %s abandoned, its runner (pid %s on %s) is gone"
+                                    %(entry["id"], entry.get("pid", "?"), entry.get("host", "?")))
+      title = "%s %s" %(self.target, os.path.basename(self.suite_file))
+      try:
+         run = self.registry.create_run(title=title, target=self.target, suite=self.suite_file)
+      except (RegistryError, OSError) as e:
+         raise RunnerError("Unable to create the run folder: %s" %str(e))
+      suite_results_folder = run.folder
+      try:
+         runner = TestRunner(suite_results_folder,
+                             data_folder    = os.path.join(TESTDATA_PATH, self.target),
+                             configs        = self.config,
+                             on_finish      = self.test_case_finished,
+                             on_retry       = self.test_case_retried,
+                             history        = self.history,
+                             metrics        = self.metrics,
+                             title          = title,
+                             registered_run = run)
+      except RunnerError as e:
+         run.finish(RUN_FAILED, error=str(e))
+         raise
+      self.console.write_message("Running %d test cases, results in %s" %(count, suite_results_folder))
+      results = runner.run(cases, count)
+      logger.info("Test suite results:")
+      logger.info(str(results))
+      counts = {}
+      for r in results:
+         counts[r["result"]] = counts.get(r["result"], 0) + 1
+      summary = ", ".join("%d %s" %(counts[k], k) for k in sorted(counts))
+      self.console.write_message("Done: %s" %summary)
+      if runner.stop_reason is not None:
+         self.console.write_warning("Run stopped (%s), %d test cases not run" %(runner.stop_reason, len(runner.not_run)))
+      return results
+
+   # -------------------------------------------------------------------------- test_case_finished()
+   def test_case_finished(self, case, test_case_results):
+      """ Runner callback, prints one line per finished test case """
+      result  = test_case_results["result"]
+      details = ""
+      if "watch_match" in test_case_results:
+         details = " -- %s" %test_case_results["watch_match"]["line"]
+      elif "resource_limit" in test_case_results:
+         details = " -- %s limit" %test_case_results["resource_limit"]
+      if "attempts" in test_case_results:
+         details += " -- attempt %d of %d" %(test_case_results["attempt"], len(test_case_results["attempts"]))
+      if test_case_results.get("profile", {}).get("summary"):
+         details += " -- profile in %s, overhead %s" %(test_case_results["profile"]["summary"],
+                                                       test_case_results["profile"]["overhead"])
+      self.console.write_message("%s %s (%.2fs)%s" %(RESULT_LABELS.get(result, result),
+                                                    test_case_results["testcase"],
+                                                    test_case_results["duration"], details))
+
+   # -------------------------------------------------------------------------- test_case_retried()
+   def test_case_retried(self, case, test_case_results):
+      """ Runner callback, a test case did not pass and will run again """
+      self.console.write_message("%s %s (%.2fs) -- %s on attempt %d" %(RETRY, test_case_results["testcase"],
+                                                                     test_case_results["duration"],
+                                                                     test_case_results["result"],
+                                                                     test_case_results["attempt"]))
+
+   # -------------------------------------------------------------------------- reload_config()
+   def reload_config(self):
+      """ Picks up an edited conf file, keeping the old settings if the
+          new ones are bad """
+      try:
+         if self.config.reload():
+            self.metrics = create_metrics(self.config, self.metrics)
+            self.console.write_message("Reloaded %s" %self.config.file_name)
+      except ConfigError as e:
+         self.console.write_error("%s, keeping the previous settings" %str(e))
+
+   # -------------------------------------------------------------------------- watch()
+   def watch(self):
+      """ Runs the suite, then runs the affected test cases again every time
+          the test cases, test data or the suite files change. Stops on Ctrl+C. """
+      self.run()
+      monitor = FileMonitor([os.path.join(TESTCASE_PATH, self.target),
+                             os.path.join(TESTDATA_PATH, self.target)] + self.suite["files"])
+      self.console.write_message("Watching for changes (%s), Ctrl+C to stop" %monitor.mode)
+      try:
+         while True:
+            changes = monitor.wait()
+            logger.info("Watch mode changes: %s" %sorted(changes))
+            indexes = set()
+            if suite_affected(self.suite, changes, os.path.join(TESTCASE_PATH, self.target)):
+               old_cases = self.cases
+               if self.load():
+                  indexes |= set(changed_test_cases(old_cases, self.cases))
+            indexes |= set(affected_test_cases(changes, self.cases,
+                                               os.path.join(TESTCASE_PATH, self.target),
+                                               os.path.join(TESTDATA_PATH, self.target)))
+            if len(indexes) > 0:
+               self.reload_config()
+               self.run(sorted(indexes))
+               # What the test cases wrote into their data folder must not
+               # run them again
+               monitor.discard([os.path.join(TESTDATA_PATH, self.target)])
+      except KeyboardInterrupt:
+         pass
+      finally:
+         monitor.close()
+
+
+# === MAIN ====================================================================
+def main(argv):
+   """ Parses the command line and runs the test suite. Returns 0 when every
+       test case passed (flaky ones included), 1 when a test case did not
+       pass and 2 for usage errors. """
+   c = Console()
+   try:
+      opts, args = getopt(argv, "s:t:j:wp:x:f:kr:m:c:Phv", ["suite=", "target=", "jobs=", "watch", "policy=", "exec-profile=",
+                                                           "fail-fast=", "kill", "retries=", "metrics=", "case=", "profile",
+                                                           "help", "version"])
+   except GetoptError as e:
+      c.write_error(str(e))
+      sys.stderr.write(USAGE)
+      return 2
+   suite_file = None
+   target     = None
+   jobs       = None
+   watch      = False
+   policy     = None
+   fail_fast  = None
+   retries    = None
+   kill       = False
+   port       = None
+   execution  = None
+   only       = None
+   profile    = False
+   for opt, value in opts:
+      if opt in ("-h", "--help"):
+         sys.stdout.write(USAGE)
+         return 0
+      elif opt in ("-v", "--version"):
+         c.write_message("%s %s" %(APP_NAME, VERSION))
+         return 0
+      elif opt in ("-s", "--suite"):
+         suite_file = value
+      elif opt in ("-t", "--target"):
+         target = value
+      elif opt in ("-j", "--jobs"):
+         jobs = value
+      elif opt in ("-w", "--watch"):
+         watch = True
+      elif opt in ("-p", "--policy"):
+         policy = value
+      elif opt in ("-x", "--exec-profile"):
+         execution = value
+      elif opt in ("-f", "--fail-fast"):
+         fail_fast = value
+      elif opt in ("-r", "--retries"):
+         retries = value
+      elif opt in ("-k", "--kill"):
+         kill = True
+      elif opt in ("-m", "--metrics"):
+         port = value
+      elif opt in ("-c", "--case"):
+         only = value
+      elif opt in ("-P", "--profile"):
+         profile = True
+   if suite_file is None or target is None:
+      sys.stderr.write(USAGE)
+      return 2
+   if not os.path.isfile(suite_file) and os.path.isfile(os.path.join(TESTSUITE_PATH, suite_file)):
+      suite_file = os.path.join(TESTSUITE_PATH, suite_file)
+   if not os.path.isdir(os.path.join(TESTCASE_PATH, target)):
+      c.write_error("Unknown target %s" %target)
+      return 2
+
+   # Command line options override the conf file and the execution profile
+   overrides = {}
+   if jobs is not None:
+      overrides["jobs"] = jobs
+   if policy is not None:
+      overrides["run_policy"] = policy
+   if fail_fast is not None:
+      overrides["fail_fast"] = fail_fast
+   if retries is not None:
+      overrides["retries"] = retries
+   if kill:
+      overrides["fail_fast_kill"] = "yes"
+   if port is not None:
+      overrides["metrics_port"] = port
+   try:
+      config = RunnerConfig(CONFIG_FILE, profile=execution, overrides=overrides)
+   except ConfigError as e:
+      c.write_error(str(e))
+      return 2
+   if config.active:
+      logger.info("Using execution profile %s" %config.active)
+
+   metrics  = create_metrics(config)
+   headless = HeadlessRunner(suite_file, target, config, metrics, only, profile)
+   if not headless.load():
+      return 2
+   try:
+      if watch:
+         headless.watch()
+         return 0
+      results = headless.run()
+   except (RunnerError, HistoryError) as e:
+      c.write_error(str(e))
+      return 2
+   return 0 if all(r["result"] in (passed, flaky) for r in results) else 1
+
+
+if __name__ == '__main__':
+   sys.exit(main(sys.argv[1:]))
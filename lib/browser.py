@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+
+# Results Browser Library
+# Helpers for browsing past runs in the testresults folder. Runs are listed
+# from the top folder only; the test cases of a run are listed when the run
+# is opened. Output files are memory mapped and shown a page of lines at a
+# time, so a 500 MB output.txt opens at once and only the pages looked at
+# are read from disk. The line index is sparse (the offset of every page)
+# and is built block by block as far as it is needed. Searches run over the
+# mapped file and never load it into memory. To run unit tests for this
+# library execute this library as main from the command line.
+
+import os
+import re
+import mmap
+import bisect
+import shutil
+import tempfile
+import unittest
+
+# -----------------------------------------------------------------------------
+# Some useful variables
+VERSION     = "1.0.0"
+FIRST       = 0
+LAST        = -1
+PAGE_LINES  = 1000             # Lines shown per page
+INDEX_BLOCK = 4 * 1024 * 1024  # Bytes indexed per step
+
+
+def list_runs(results_home):
+   """ Returns the names of the suite results folders, newest first. Only
+       the results home folder itself is read. """
+   names = []
+   try:
+      with os.scandir(results_home) as entries:
+         for entry in entries:
+            if not entry.name.startswith('.') and entry.is_dir():
+               names.append(entry.name)
+   except OSError:
+      return []
+   return sorted(names, reverse=True)
+
+
+def list_folder(folder):
+   """ Returns the (sub folder names, file names) of a results folder """
+   folders = []
+   files   = []
+   try:
+      with os.scandir(folder) as entries:
+         for entry in entries:
+            if entry.name.startswith('.'):
+               continue
+            if entry.is_dir():
+               folders.append(entry.name)
+            else:
+               files.append(entry.name)
+   except OSError:
+      pass
+   return sorted(folders), sorted(files)
+
+
+class MappedTextFile():
+   """ A read only text file shown in pages of lines """
+
+   def __init__(self, file_name, page_lines=PAGE_LINES):
+      self.file_name     = file_name
+      self.page_lines    = page_lines
+      self.file          = open(file_name, 'rb')
+      self.size          = os.fstat(self.file.fileno()).st_size
+      if self.size > 0:
+         self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+      else:
+         self.map = b""  # an empty file cannot be mapped
+      self.pages         = [0]  # Byte offset of the first line of every page
+      self.lines_in_page = 0    # Lines indexed in the last page
+      self.indexed       = 0    # Bytes indexed so far
+
+   @property
+   def complete(self):
+      return self.indexed >= self.size
+
+   def index_step(self, block=INDEX_BLOCK):
+      """ Indexes the next block of the file, always ending on a whole
+          line. Returns True when the whole file is indexed. """
+      if self.complete:
+         return True
+      end = min(self.size, self.indexed + block)
+      if end < self.size:
+         newline = self.map.find(b"\n", end - 1)
+         end = self.size if newline < 0 else newline + 1
+      parts   = self.map[self.indexed:end].split(b"\n")
+      lengths = [n + 1 for n in map(len, parts[:LAST])]
+      if len(parts[LAST]) > 0:  # last line of the file has no newline
+         lengths.append(len(parts[LAST]))
+      offset = self.indexed
+      i      = 0
+      while i < len(lengths):
+         need = min(self.page_lines - self.lines_in_page, len(lengths) - i)
+         offset += sum(lengths[i:i + need])
+         i += need
+         self.lines_in_page += need
+         if self.lines_in_page == self.page_lines and offset < self.size:
+            self.pages.append(offset)
+            self.lines_in_page = 0
+      self.indexed = end
+      return self.complete
+
+   def index_all(self):
+      while not self.index_step():
+         pass
+
+   def page_count(self):
+      """ Number of pages found so far, final once the index is complete """
+      return len(self.pages)
+
+   def line_count(self):
+      """ Number of lines found so far, final once the index is complete """
+      return (len(self.pages) - 1) * self.page_lines + self.lines_in_page
+
+   def read_page(self, page):
+      """ Returns the text of a page, indexing the file as far as needed.
+          Returns None for a page past the end of the file. """
+      while page + 1 >= len(self.pages) and not self.complete:
+         self.index_step()
+      if page < 0 or page >= len(self.pages):
+         return None
+      start = self.pages[page]
+      end   = self.pages[page + 1] if page + 1 < len(self.pages) else self.size
+      text  = self.map[start:end].decode("utf-8", errors="replace")
+      return text[:-1] if text.endswith("\n") else text
+
+   def search(self, text, start=0, regex=False, ignore_case=False):
+      """ Finds text in the file from the byte offset start. Returns the
+          (start, end) byte offsets of the match or None. Raises re.error
+          for a bad regular expression. """
+      pattern = text.encode("utf-8")
+      if not regex:
+         pattern = re.escape(pattern)
+      found = re.compile(pattern, re.IGNORECASE if ignore_case else 0).search(self.map, start)
+      if found is None:
+         return None
+      return found.start(), found.end()
+
+   def line_at(self, offset):
+      """ Returns the (page, line in the page) holding a byte offset """
+      while not self.complete and self.indexed <= offset:
+         self.index_step()
+      page = bisect.bisect_right(self.pages, offset) - 1
+      return page, self.map[self.pages[page]:offset].count(b"\n")
+
+   def close(self):
+      if isinstance(self.map, mmap.mmap):
+         self.map.close()
+      self.file.close()
+
+
+# Unit tests
+class UnitTests(unittest.TestCase):
+   """ """
+   def setUp(self):
+      self.scratch = tempfile.mkdtemp()
+
+   def tearDown(self):
+      shutil.rmtree(self.scratch, ignore_errors=True)
+
+   def write(self, name, text):
+      file_name = os.path.join(self.scratch, name)
+      f = open(file_name, 'w')
+      f.write(text)
+      f.close()
+      return file_name
+
+   def test_list_runs(self):
+      """ """
+      for name in ("20200101000000", "20200102000000", "20200102000000_2", ".hidden"):
+         os.mkdir(os.path.join(self.scratch, name))
+      self.write(".last_results_TARGET_1.json", "{}")
+      self.assertEqual(list_runs(self.scratch), ["20200102000000_2", "20200102000000", "20200101000000"])
+      os.mkdir(os.path.join(self.scratch, "20200101000000", "test_01"))
+      self.write(os.path.join("20200101000000", "summary.txt"), "x")
+      self.assertEqual(list_folder(os.path.join(self.scratch, "20200101000000")), (["test_01"], ["summary.txt"]))
+      self.assertEqual(list_runs(os.path.join(self.scratch, "qwert")), [])
+
+   def test_pages(self):
+      """ """
+      lines = ["line %d" % n for n in range(25)]
+      f = MappedTextFile(self.write("output.txt", "\n".join(lines) + "\n"), page_lines=10)
+      self.assertEqual(f.read_page(0), "\n".join(lines[:10]))
+      self.assertEqual(f.read_page(2), "\n".join(lines[20:]))
+      self.assertIsNone(f.read_page(3))
+      self.assertEqual(f.line_count(), 25)
+      f.close()
+
+   def test_small_blocks(self):
+      """ """
+      lines = ["x" * (n % 7) for n in range(100)]
+      f = MappedTextFile(self.write("output.txt", "\n".join(lines)), page_lines=10)
+      f.index_step(block=5)
+      self.assertFalse(f.complete)  # indexed one block at a time
+      while not f.index_step(block=5):
+         pass
+      self.assertEqual(f.page_count(), 10)
+      self.assertEqual(f.line_count(), 100)
+      self.assertEqual(f.read_page(9), "\n".join(lines[90:]))
+      f.close()
+
+   def test_search(self):
+      """ """
+      text = "".join("line %d\n" % n for n in range(30)) + "Traceback: boom\n"
+      f = MappedTextFile(self.write("errors.txt", text), page_lines=10)
+      start, end = f.search("traceback", ignore_case=True)
+      self.assertEqual(f.line_at(start), (3, 0))
+      self.assertEqual(f.line_at(f.search("line 15")[FIRST]), (1, 5))
+      self.assertIsNone(f.search("line 15", start=end))
+      self.assertEqual(f.search(r"line 2\d", regex=True), (text.index("line 20"), text.index("line 20") + 7))
+      f.close()
+
+   def test_empty_file(self):
+      """ """
+      f = MappedTextFile(self.write("output.txt", ""))
+      self.assertEqual(f.read_page(0), "")
+      self.assertIsNone(f.search("x"))
+      f.close()
+
+
+if __name__ == "__main__":
+   # If this library is executed as a main program
+   # Then execute the unit tests
+   unittest.main()
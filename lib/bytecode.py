@@ -0,0 +1,397 @@
+#!/usr/bin/python3
+
+# Bytecode Cache Library
+# Compiles the python test cases of a run, and the helper modules next to
+# them, before the first test case starts. The test case trees are read only
+# on the lab machines so python can not write its own __pycache__ files there
+# and would compile every test case from source each time it is run. The
+# cache belongs to the runner instead:
+#    <cache>/<interpreter tag>/scripts/<hash>.pyc   test cases, named by a
+#                            hash of their path and source, loaded as
+#                            __main__ by a small bootstrap
+#    <cache>/<interpreter tag>/modules/...          helper modules, laid out
+#                            like the test case tree and checked against
+#                            the hash of their source when the bootstrap
+#                            imports them from the folder of the test case
+# A test case that does not compile is reported before the run starts. Cache
+# files that no run used for MAX_AGE are removed, at most once a day. To
+# run unit tests for this library execute this library as main from the
+# command line.
+
+import os
+import sys
+import hashlib
+import marshal
+import tempfile
+import time
+import traceback
+import importlib.util
+import shutil
+import subprocess
+import unittest
+
+# -----------------------------------------------------------------------------
+# Some useful variables
+VERSION        = "1.0.0"
+FIRST          = 0
+LAST           = -1
+WARNING        = "\033[33mWARNING\033[0m"
+HEADER_SIZE    = 16
+FLAG_HASH      = 0b01  # \__ pyc header flags, see PEP 552
+FLAG_CHECKED   = 0b10  # /
+SKIP_FOLDERS   = ("__pycache__",)
+MAX_AGE        = 30 * 24 * 3600  # Seconds an unused cache file is kept
+PRUNE_INTERVAL = 24 * 3600       # Seconds between two looks for them
+PRUNE_STAMP    = ".pruned"
+
+# Runs a cached test case like "python script args" would run it. The code
+# is compiled from source when the cached file has gone. Only the modules
+# found in the folder of the test case, and below it, are loaded from the
+# cache, every other import (the standard library, site-packages) is left to
+# python as usual.
+BOOTSTRAP = """import os, sys, types, marshal, builtins, importlib.machinery, importlib.util
+cached, modules, script = sys.argv[1:4]
+sys.argv = sys.argv[3:]
+tree = os.path.dirname(os.path.abspath(script))
+sys.path[0] = tree
+class CachedLoader(importlib.machinery.SourceFileLoader):
+   def get_code(self, fullname):
+      path = self.get_filename(fullname)
+      source = self.get_data(path)
+      head, tail = os.path.split(path)
+      pyc = os.path.join(modules, head.lstrip(os.sep), "%s.%s.pyc" % (tail.rpartition(".")[0], sys.implementation.cache_tag))
+      header = importlib.util.MAGIC_NUMBER + (3).to_bytes(4, "little") + importlib.util.source_hash(source)
+      try:
+         f = open(pyc, "rb")
+         data = f.read()
+         f.close()
+         if data[:16] == header:
+            return marshal.loads(data[16:])
+      except (OSError, EOFError, ValueError):
+         pass
+      return compile(source, path, "exec", dont_inherit=True)
+class CachedFinder():
+   @staticmethod
+   def find_spec(name, path=None, target=None):
+      entries = [p for p in (path or sys.path) if os.path.join(os.path.abspath(p or "."), "").startswith(tree + os.sep)]
+      spec = importlib.machinery.PathFinder.find_spec(name, entries) if entries else None
+      if spec is None or type(spec.loader) is not importlib.machinery.SourceFileLoader:
+         return None
+      spec.loader = CachedLoader(spec.loader.name, spec.loader.path)
+      return spec
+sys.meta_path.insert(0, CachedFinder)
+try:
+   f = open(cached, "rb")
+   f.seek(16)
+   code = marshal.load(f)
+   f.close()
+except (OSError, EOFError, ValueError):
+   f = open(script, "rb")
+   code = compile(f.read(), script, "exec", dont_inherit=True)
+   f.close()
+main = types.ModuleType("__main__")
+main.__file__ = script
+main.__builtins__ = builtins
+sys.modules["__main__"] = main
+exec(code, main.__dict__)
+"""
+
+
+class BytecodeError(Exception):
+   """ Raised when the cache folder cannot be used """
+   pass
+
+
+def default_cache_root():
+   """ Returns the cache folder of the runner for the current user """
+   home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+   return os.path.join(home, "testmaster", "bytecode")
+
+
+def compile_error_text(e):
+   """ Returns the python style message of a SyntaxError """
+   return "".join(traceback.format_exception_only(type(e), e))
+
+
+def is_python(file_name):
+   return file_name.lower().endswith(".py")
+
+
+class BytecodeCache():
+   """ Runner owned cache of compiled python test cases and helpers """
+
+   def __init__(self, root=None):
+      """ Constructor for an object of type BytecodeCache
+             root : cache folder, see default_cache_root()
+          The test cases must be run by the interpreter this library runs
+          in, the code is only valid for that one. """
+      self.tag      = sys.implementation.cache_tag
+      self.root     = os.path.join(os.path.abspath(root or default_cache_root()), self.tag)
+      self.scripts  = os.path.join(self.root, "scripts")
+      self.modules  = os.path.join(self.root, "modules")
+      self.compiled = 0   # \__ files compiled and found compiled since
+      self.reused   = 0   # /   the cache was created
+      self.cached   = {}  # test case file -> cached code file
+      try:
+         os.makedirs(self.scripts, exist_ok=True)
+         os.makedirs(self.modules, exist_ok=True)
+      except OSError as e:
+         raise BytecodeError("Unable to create the bytecode cache %s: %s" % (self.root, e.strerror))
+      self.prune()
+
+   # -------------------------------------------------------------------------- cache files
+   def script_file(self, file_name, source):
+      """ Returns the cached code file of a test case. The name is a hash of
+          the path, which is compiled into the code, and of the source. """
+      key = hashlib.sha256(os.path.abspath(file_name).encode("utf-8", "surrogateescape") + b"\0" + source)
+      return os.path.join(self.scripts, key.hexdigest()[:40] + ".pyc")
+
+   def module_file(self, file_name):
+      """ Returns where the bootstrap looks for a compiled helper module """
+      head, tail = os.path.split(os.path.abspath(file_name))
+      return os.path.join(self.modules, head.lstrip(os.sep), "%s.%s.pyc" % (tail.rpartition('.')[FIRST], self.tag))
+
+   def write_code(self, cached_file, source, code, flags):
+      """ Writes a hash based pyc file in one step, other runner instances
+          may be reading the same cache """
+      data = importlib.util.MAGIC_NUMBER + flags.to_bytes(4, "little") + \
+             importlib.util.source_hash(source) + marshal.dumps(code)
+      folder = os.path.dirname(cached_file)
+      os.makedirs(folder, exist_ok=True)
+      f = tempfile.NamedTemporaryFile('wb', dir=folder, prefix=".pyc_", delete=False)
+      try:
+         f.write(data)
+         f.close()
+         os.replace(f.name, cached_file)
+      except OSError:
+         f.close()
+         if os.path.exists(f.name):
+            os.remove(f.name)
+         raise
+
+   def is_current(self, cached_file, source, flags):
+      """ True when the cached file was compiled from this source by this
+          interpreter """
+      try:
+         f = open(cached_file, 'rb')
+         header = f.read(HEADER_SIZE)
+         f.close()
+      except OSError:
+         return False
+      return header == importlib.util.MAGIC_NUMBER + flags.to_bytes(4, "little") + importlib.util.source_hash(source)
+
+   def compile_file(self, file_name, cached_file, flags):
+      """ Compiles a file into the cache unless it is there already.
+          Raises SyntaxError (and ValueError for null bytes) from the
+          compiler and OSError when the file cannot be read. """
+      f = open(file_name, 'rb')
+      source = f.read()
+      f.close()
+      if cached_file is None:
+         cached_file = self.script_file(file_name, source)
+      if self.is_current(cached_file, source, flags):
+         self.reused += 1
+         try:
+            os.utime(cached_file)  # still in use, see prune()
+         except OSError:
+            pass
+         return cached_file
+      code = compile(source, file_name, "exec", dont_inherit=True)
+      self.write_code(cached_file, source, code, flags)
+      self.compiled += 1
+      return cached_file
+
+   def prune(self, max_age=MAX_AGE, interval=PRUNE_INTERVAL):
+      """ Removes the cache files that no run used for max_age seconds:
+          test cases that were edited or removed and helper modules that
+          went away. Does nothing when the cache was pruned less than
+          interval seconds ago. Returns the number of files removed. """
+      stamp = os.path.join(self.root, PRUNE_STAMP)
+      now   = time.time()
+      try:
+         if now - os.stat(stamp).st_mtime < interval:
+            return 0
+      except OSError:
+         pass
+      removed = 0
+      for top in (self.scripts, self.modules):
+         for path, folder_names, file_names in os.walk(top, topdown=False):
+            for name in file_names:
+               file_name = os.path.join(path, name)
+               try:
+                  if now - os.stat(file_name).st_mtime > max_age:
+                     os.remove(file_name)
+                     removed += 1
+               except OSError:
+                  pass
+            if path != top:
+               try:
+                  os.rmdir(path)  # only when it is empty
+               except OSError:
+                  pass
+      try:
+         open(stamp, 'w').close()
+      except OSError:
+         pass
+      return removed
+
+   # -------------------------------------------------------------------------- compile stages
+   def compile_script(self, file_name):
+      """ Compiles a test case. Returns None, or the error message when it
+          does not compile. """
+      try:
+         self.cached[file_name] = self.compile_file(file_name, None, FLAG_HASH)
+      except (SyntaxError, ValueError) as e:
+         self.cached.pop(file_name, None)
+         return compile_error_text(e)
+      except OSError as e:
+         # Left for the test case run to report, it may not be a file yet
+         self.cached.pop(file_name, None)
+         sys.stderr.write("%s -- Unable to compile %s: %s\n" % (WARNING, file_name, str(e)))
+      return None
+
+   def compile_scripts(self, file_names):
+      """ Compiles test cases. Returns {file: error message} for the ones
+          that do not compile. """
+      errors = {}
+      for file_name in file_names:
+         if is_python(file_name) and file_name not in errors:
+            message = self.compile_script(file_name)
+            if message is not None:
+               errors[file_name] = message
+      return errors
+
+   def compile_modules(self, folders, skip=()):
+      """ Compiles the python files below the folders, other than the ones
+          in skip, as helper modules. Returns {file: error message} for the
+          ones that do not compile; python reports those again when a test
+          case imports them. """
+      errors = {}
+      skip   = set(os.path.abspath(f) for f in skip)
+      for folder in folders:
+         for path, folder_names, file_names in os.walk(folder):
+            folder_names[:] = [d for d in folder_names if d not in SKIP_FOLDERS and not d.startswith('.')]
+            for name in file_names:
+               file_name = os.path.join(path, name)
+               if not is_python(name) or os.path.abspath(file_name) in skip:
+                  continue
+               try:
+                  self.compile_file(file_name, self.module_file(file_name), FLAG_HASH | FLAG_CHECKED)
+               except (SyntaxError, ValueError) as e:
+                  errors[file_name] = compile_error_text(e)
+               except OSError:
+                  pass
+      return errors
+
+   # -------------------------------------------------------------------------- command()
+   def command(self, command_list):
+      """ Returns the command that runs a python test case, [python, -u,
+          script, ...], from the cache. The command is returned unchanged
+          for a test case that was not compiled. """
+      script = command_list[2]
+      if script not in self.cached:
+         return command_list
+      return [command_list[FIRST], "-u", "-c", BOOTSTRAP, self.cached[script], self.modules] + command_list[2:]
+
+
+def create_bytecode_cache(setting):
+   """ Creates the bytecode cache for the bytecode_cache setting: none to
+       turn it off, auto for the cache folder of the user or a folder.
+       Returns None when it is off or cannot be created. """
+   setting = (setting or "auto").strip()
+   if setting.lower() == "none":
+      return None
+   try:
+      return BytecodeCache(None if setting.lower() == "auto" else setting)
+   except BytecodeError as e:
+      sys.stderr.write("%s -- %s, test cases are compiled from source\n" % (WARNING, str(e)))
+      return None
+
+
+# Unit tests
+class UnitTests(unittest.TestCase):
+   """ """
+   def setUp(self):
+      self.scratch = tempfile.mkdtemp()
+      self.cache   = BytecodeCache(os.path.join(self.scratch, "cache"))
+
+   def tearDown(self):
+      shutil.rmtree(self.scratch, ignore_errors=True)
+
+   def script(self, name, code):
+      file_name = os.path.join(self.scratch, name)
+      f = open(file_name, 'w')
+      f.write(code)
+      f.close()
+      return file_name
+
+   def test_run_from_cache(self):
+      """ """
+      self.script("helper.py", "VALUE = 42\n")
+      case = self.script("case.py", "import sys, helper\nprint(__name__, helper.VALUE, sys.argv[1:], "
+                                    "__file__ == %r)\nsys.exit(4)\n" % os.path.join(self.scratch, "case.py"))
+      self.assertEqual(self.cache.compile_scripts([case]), {})
+      self.assertEqual(self.cache.compile_modules([self.scratch], skip=[case]), {})
+      self.assertTrue(os.path.isfile(self.cache.module_file(os.path.join(self.scratch, "helper.py"))))
+      command = self.cache.command([sys.executable, "-u", case, "a"])
+      self.assertIn(BOOTSTRAP, command)
+      process = subprocess.run(command, stdout=subprocess.PIPE, cwd=self.scratch)
+      self.assertEqual(process.returncode, 4)
+      self.assertEqual(process.stdout, b"__main__ 42 ['a'] True\n")
+      helper = os.path.join(self.scratch, "helper.py")
+      f = open(helper, 'rb')
+      self.assertTrue(self.cache.is_current(self.cache.module_file(helper), f.read(), FLAG_HASH | FLAG_CHECKED))
+      f.close()
+
+   def test_only_helpers_from_cache(self):
+      """ """
+      os.mkdir(os.path.join(self.scratch, "tests"))
+      self.script(os.path.join("tests", "helper.py"), "VALUE = 42\n")
+      case = self.script(os.path.join("tests", "case.py"), "import json, email.message, helper\n"
+                                                           "print(type(helper.__loader__).__name__, type(json.__loader__).__name__)\n")
+      self.cache.compile_scripts([case])
+      self.cache.compile_modules([os.path.dirname(case)], skip=[case])
+      env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+      process = subprocess.run(self.cache.command([sys.executable, "-u", case]), stdout=subprocess.PIPE, env=env)
+      self.assertEqual(process.stdout, b"CachedLoader SourceFileLoader\n")
+      # Nothing but the helper module went into the cache, nothing into the tree
+      cached = [os.path.join(path, f) for path, _, files in os.walk(self.cache.modules) for f in files]
+      self.assertEqual(cached, [self.cache.module_file(os.path.join(self.scratch, "tests", "helper.py"))])
+      self.assertFalse(os.path.exists(os.path.join(self.scratch, "tests", "__pycache__")))
+
+   def test_prune(self):
+      """ """
+      old = self.script("old.py", "print(1)\n")
+      new = self.script("new.py", "print(2)\n")
+      self.cache.compile_scripts([old, new])
+      os.utime(self.cache.cached[old], (0, 0))
+      self.assertEqual(self.cache.prune(), 0)  # pruned when the cache was created
+      self.assertEqual(self.cache.prune(interval=0), 1)
+      self.assertFalse(os.path.exists(self.cache.cached[old]))
+      self.assertTrue(os.path.exists(self.cache.cached[new]))
+
+   def test_reuse_and_change(self):
+      """ """
+      case = self.script("case.py", "print(1)\n")
+      self.cache.compile_scripts([case])
+      first = self.cache.cached[case]
+      self.cache.compile_scripts([case])
+      self.assertEqual((self.cache.compiled, self.cache.reused), (1, 1))
+      self.script("case.py", "print(2)\n")
+      self.cache.compile_scripts([case])
+      self.assertNotEqual(self.cache.cached[case], first)
+
+   def test_syntax_error(self):
+      """ """
+      case = self.script("bad.py", "print('a'\n")
+      errors = self.cache.compile_scripts([case])
+      self.assertIn("SyntaxError", errors[case])
+      self.assertIn("bad.py", errors[case])
+      self.assertEqual(self.cache.command([sys.executable, "-u", case]), [sys.executable, "-u", case])
+      self.assertIsNone(create_bytecode_cache("none"))
+
+
+if __name__ == "__main__":
+   # If this library is executed as a main program
+   # Then execute the unit tests
+   unittest.main()
@@ -3,14 +3,34 @@
 # This library holds functions that allow scripts to read encrypted configuration
 # files. To run unit tests for this library execute this library as main from the
 # command line.
+#
+# RunnerConfig is the typed view of the configuration file used by the test
+# runner. Every known setting has a type and a default (see SETTINGS) and is
+# checked when the file is read; a bad value raises ConfigError pointing at
+# the file and line. A file is parsed again only when its modification time
+# or size changes, so reading the settings before every run is cheap and an
+# edited file is picked up without restarting (hot reload). The file may end
+# with execution profiles, named sets of settings that replace the ones at
+# the top of the file when the profile is chosen:
+#
+#    jobs        1
+#    [profile ci]
+#    jobs        auto
+#    timeout     600
 
 import os
 import sys
+import tempfile
 import unittest
 
+from workspace import WORKSPACE_MODES
+from limits import parse_size, LimitError
+from history import RUN_POLICIES
+from report import REPORT_FORMATS
+
 # -----------------------------------------------------------------------------
 # Some useful variables
-VERSION  = "1.0.2"
+VERSION  = "1.1.0"
 VERBOSE  = False
 DEBUG    = False
 FIRST    = 0
@@ -21,6 +41,292 @@ PASSED   = "\033[32mPASSED\033[0m"  # \
 FAILED   = "\033[31mFAILED\033[0m"  #  > Linux-specific colorization
 ERROR    = "\033[31mERROR\033[0m"   # /
 
+PROFILE_SECTION = "profile"  # [profile <name>] starts an execution profile
+TRUE_WORDS      = ("yes", "true", "on", "1")
+FALSE_WORDS     = ("no", "false", "off", "0")
+
+# Parsed files: absolute path -> ((mtime, size), lines, base, profiles)
+_parsed_files = {}
+
+
+class ConfigError(Exception):
+   """ Raised for a configuration file that cannot be read or holds a bad
+       value. The message starts with the file and line. """
+   def __init__(self, message, source=None, line=None):
+      if source is not None:
+         message = "%s:%d: %s" % (source, line, message) if line else "%s: %s" % (source, message)
+      super().__init__(message)
+
+
+class Setting():
+   """ Type, default and limits of a known setting """
+
+   def __init__(self, kind, default, choices=None, minimum=None):
+      self.kind    = kind      # str, bool, int, float, size, choice, list or jobs
+      self.default = default   # typed default value
+      self.choices = choices
+      self.minimum = minimum
+
+   def convert(self, name, text):
+      """ Returns the typed value of a setting, raises ValueError with the
+          reason when the text is not a valid value """
+      text = text.strip()
+      if self.kind == "str":
+         return text
+      if self.kind == "bool":
+         if text.lower() in TRUE_WORDS:
+            return True
+         if text.lower() in FALSE_WORDS:
+            return False
+         raise ValueError("%s must be yes or no, found \"%s\"" % (name, text))
+      if self.kind == "choice":
+         if text.lower() not in self.choices:
+            raise ValueError("%s must be one of %s, found \"%s\"" % (name, ", ".join(self.choices), text))
+         return text.lower()
+      if self.kind == "list":
+         values = [v.strip().lower() for v in text.split(',') if v.strip().lower() not in ("", "none")]
+         for value in values:
+            if value not in self.choices:
+               raise ValueError("%s takes %s or none, found \"%s\"" % (name, ", ".join(self.choices), value))
+         return values
+      if self.kind == "jobs" and text.lower() == "auto":
+         return "auto"
+      try:
+         if self.kind == "float":
+            value = float(text)
+         elif self.kind == "size":
+            value = parse_size(text)
+         else:
+            value = int(text)
+      except (ValueError, LimitError):
+         kinds = {"float": "a number", "size": "a size such as 512K or 2G", "int": "a whole number",
+                  "jobs": "a whole number or auto"}
+         raise ValueError("%s must be %s, found \"%s\"" % (name, kinds[self.kind], text))
+      if self.minimum is not None and value < self.minimum:
+         raise ValueError("%s must be at least %s, found \"%s\"" % (name, self.minimum, text))
+      return value
+
+
+# Settings of the test runner. Other keys (slot_<name>, test values) are
+# kept as plain strings.
+SETTINGS = {
+   # Worker slots and scheduling, see lib/runner.py and lib/history.py
+   "jobs"                      : Setting("jobs",   1, minimum=1),
+   "run_policy"                : Setting("choice", "file-order", choices=RUN_POLICIES),
+   "fail_fast"                 : Setting("int",    0, minimum=0),
+   "fail_fast_kill"            : Setting("bool",   False),
+   "retries"                   : Setting("int",    0, minimum=0),
+   "retry_workspace"           : Setting("bool",   False),
+   # Test case processes
+   "timeout"                   : Setting("float",  0.0, minimum=0),    # seconds, 0 is no timeout
+   "output_cap"                : Setting("size",   0, minimum=0),      # bytes per stream, 0 keeps all
+   "read_size"                 : Setting("size",   65536, minimum=1),  # bytes read from a pipe at a time
+   "select_timeout"            : Setting("float",  0.1, minimum=0.001),
+   "stream_grace"              : Setting("float",  1.0, minimum=0),
+   "bytecode_cache"            : Setting("str",    "auto"),            # auto, none or a folder, see lib/bytecode.py
+   # Scratch workspaces, see lib/workspace.py
+   "workspace_mode"            : Setting("choice", "none", choices=WORKSPACE_MODES),
+   "workspace_root"            : Setting("str",    ""),
+   "workspace_tmpfs"           : Setting("bool",   False),
+   "workspace_keep_on_failure" : Setting("bool",   False),
+   "workspace_argument"        : Setting("bool",   False),
+   # Resource limits, see lib/limits.py
+   "limit_as"                  : Setting("size",   None, minimum=1),
+   "limit_cpu"                 : Setting("int",    None, minimum=1),
+   "limit_nofile"              : Setting("int",    None, minimum=1),
+   "limit_nproc"               : Setting("int",    None, minimum=1),
+   "limit_fsize"               : Setting("size",   None, minimum=1),
+   "limit_memory"              : Setting("size",   None, minimum=1),
+   "limit_cgroup"              : Setting("str",    None),
+   # Reports and metrics, see lib/report.py and lib/metrics.py
+   "reports"                   : Setting("list",   list(REPORT_FORMATS), choices=REPORT_FORMATS),
+   "metrics_port"              : Setting("int",    0, minimum=0),
+   "metrics_host"              : Setting("str",    "127.0.0.1"),
+   "metrics_textfile"          : Setting("str",    ""),
+   "metrics_interval"          : Setting("float",  5.0, minimum=0),
+   # Execution profile used when none is asked for
+   "execution_profile"         : Setting("str",    ""),
+}
+
+
+def parse_config_lines(lines, source):
+   """ Splits the lines of a config file into the settings at the top and
+       the execution profiles. Returns (base, profiles) where base is
+       {key: (value, line number)} and profiles is {name: base}. """
+   base     = {}
+   profiles = {}
+   section  = base
+   for line_number, line in enumerate(lines, 1):
+      line = line.strip()
+      if len(line) < 1 or line[FIRST] == '#':
+         continue  # Skip blank and comment lines
+      if line[FIRST] == '[':
+         words = line.strip("[]").split()
+         if not line.endswith(']') or len(words) != 2 or words[FIRST] != PROFILE_SECTION:
+            raise ConfigError("expected \"[%s <name>]\", found \"%s\"" % (PROFILE_SECTION, line), source, line_number)
+         section = profiles.setdefault(words[LAST], {})
+         continue
+      parts = line.split(None, 1)
+      if len(parts) < 2:
+         raise ConfigError("expected \"<key> <value>\", found \"%s\"" % line, source, line_number)
+      section[parts[FIRST]] = (parts[LAST].strip(), line_number)
+   return base, profiles
+
+
+def parse_config_file(file_name):
+   """ Returns the (base, profiles) of a config file, parsing it only when
+       it changed since the last call """
+   path = os.path.abspath(file_name)
+   try:
+      st = os.stat(path)
+      stamp = (st.st_mtime_ns, st.st_size)
+      cached = _parsed_files.get(path)
+      if cached is not None and cached[FIRST] == stamp:
+         return cached[1], cached[2]
+      f = open(path, 'r')
+      lines = f.readlines()
+      f.close()
+   except OSError as e:
+      raise ConfigError("unable to read the file: %s" % e.strerror, file_name)
+   base, profiles = parse_config_lines(lines, file_name)
+   _parsed_files[path] = (stamp, base, profiles)
+   return base, profiles
+
+
+def file_stamp(file_name):
+   try:
+      st = os.stat(file_name)
+      return (st.st_mtime_ns, st.st_size)
+   except OSError:
+      return None
+
+
+class RunnerConfig():
+   """ Typed runner settings from a config file, an execution profile and
+       overrides (from the command line) """
+
+   def __init__(self, file_name=None, profile=None, overrides=None):
+      """ Constructor for an object of type RunnerConfig
+             file_name : config file, None for the defaults only
+             profile   : execution profile to use, None for the one named by
+                         execution_profile in the file
+             overrides : {key: text} applied last
+          Raises ConfigError when the file cannot be read or a value is bad. """
+      self.file_name = file_name
+      self.profile   = profile
+      self.overrides = dict(overrides or {})
+      self.stamp     = None
+      self.bad_stamp = None  # stamp of the last file version that failed
+      self.values    = {}  # key -> typed value
+      self.texts     = {}  # key -> text as written
+      self.profiles  = []
+      self.load()
+
+   @classmethod
+   def from_dict(cls, configs):
+      """ Typed settings from a dictionary of strings """
+      return cls(None, overrides=configs)
+
+   # -------------------------------------------------------------------------- load()
+   def load(self):
+      """ Reads and checks the settings. Nothing changes when it fails. """
+      base, profiles = ({}, {})
+      stamp = None
+      if self.file_name is not None:
+         stamp = file_stamp(self.file_name)
+         base, profiles = parse_config_file(self.file_name)
+      sources = [(base, self.file_name)]
+      profile = self.profile
+      if profile is None and "execution_profile" in base:
+         profile = base["execution_profile"][FIRST]
+      if profile:
+         if profile not in profiles:
+            known = ", ".join(sorted(profiles)) or "none"
+            raise ConfigError("unknown execution profile \"%s\", profiles: %s" % (profile, known), self.file_name or "command line")
+         sources.append((profiles[profile], self.file_name))
+      sources.append((dict((k, (v, 0)) for k, v in self.overrides.items()), "command line"))
+      # Check every profile so a typo is found before the profile is used
+      for name in profiles:
+         self.typed_values([(profiles[name], self.file_name)])
+      self.values, self.texts = self.typed_values(sources)
+      self.values["execution_profile"] = profile or ""
+      self.profiles = sorted(profiles)
+      self.active   = profile or ""
+      self.stamp    = stamp
+
+   @staticmethod
+   def typed_values(sources):
+      values = dict((key, setting.default) for key, setting in SETTINGS.items())
+      texts  = {}
+      for entries, source in sources:
+         for key, (text, line) in entries.items():
+            if key in SETTINGS:
+               try:
+                  values[key] = SETTINGS[key].convert(key, text)
+               except ValueError as e:
+                  raise ConfigError(str(e), source or "command line", line)
+            else:
+               values[key] = text
+            texts[key] = text
+      return values, texts
+
+   def changed(self):
+      """ True when the config file was edited since it was read """
+      return self.file_name is not None and file_stamp(self.file_name) != self.stamp
+
+   def reload(self):
+      """ Reads the file again if it changed. Returns True when it did.
+          Raises ConfigError and keeps the old settings for a bad file, once
+          for each version of it: a bad file is not read again until it is
+          edited. """
+      stamp = file_stamp(self.file_name) if self.file_name is not None else None
+      if not self.changed() or stamp == self.bad_stamp:
+         return False
+      try:
+         self.load()
+      except ConfigError:
+         self.bad_stamp = stamp
+         raise
+      return True
+
+   def select_profile(self, profile):
+      """ Switches to another execution profile, "" for none """
+      old = self.profile
+      self.profile = profile
+      try:
+         self.load()
+      except ConfigError:
+         self.profile = old
+         raise
+
+   # -------------------------------------------------------------------------- values
+   def get(self, key, default=None):
+      """ Returns the typed value of a setting """
+      value = self.values.get(key)
+      return default if value is None else value
+
+   def __getitem__(self, key):
+      return self.values[key]
+
+   def __contains__(self, key):
+      return key in self.texts
+
+   def text(self, key, default=None):
+      """ Returns a setting as it was written in the file """
+      return self.texts.get(key, default)
+
+   def with_prefix(self, prefix):
+      """ Returns {key: text} for the settings whose key starts with prefix """
+      return dict((k, v) for k, v in self.texts.items() if k.startswith(prefix))
+
+
+def as_config(configs):
+   """ Returns a RunnerConfig for a RunnerConfig, a dictionary or None """
+   if isinstance(configs, RunnerConfig):
+      return configs
+   return RunnerConfig.from_dict(configs or {})
+
+
 def read_config_file(file_name, delimiter=' '):
    """ Reads a config file and returns a dictionary of key/value pairs from
        the configuration file. If anything goes wrong then return an
@@ -38,14 +344,14 @@ def read_config_file(file_name, delimiter=' '):
             pass  # Skip blank lines
          elif line[FIRST] == '#':
             pass  # Skip comment lines
+         elif line[FIRST] == '[':
+            break  # Execution profiles follow, see RunnerConfig
          elif line.find(delimiter) == -1:
             pass  # Skip mal-formed lines (lines without an equal sign character'=')
          else:
             # Process remaining lines
-            line                = line.strip()  # Clean up the whitespace
-            key                 = line.split(delimiter, 1)[FIRST].strip()
-            value               = line.split(delimiter, 1)[LAST].strip()
-            configurations[key] = value
+            key, value          = line.split(delimiter, 1)
+            configurations[key.strip()] = value.strip()
    except Exception as e:
         sys.stderr.write("%s -- Unable to read from configurations file %s\n" % (ERROR, file_name))
         print(str(e))
@@ -57,6 +363,13 @@ def read_config_file(file_name, delimiter=' '):
 # Unit tests
 class UnitTests(unittest.TestCase):
    """ """
+   def write_config(self, text):
+      f = tempfile.NamedTemporaryFile('w', suffix=".conf", delete=False)
+      f.write(text)
+      f.close()
+      self.addCleanup(os.remove, f.name)
+      return f.name
+
    def test_known_good_call(self):
       config_file = "../conf/testmaster.conf"
       configs = read_config_file(config_file)
@@ -70,7 +383,68 @@ class UnitTests(unittest.TestCase):
       self.assertEqual(configs, {})
 
 
+   def test_typed_values(self):
+      config = RunnerConfig(self.write_config("# comment\njobs  4\nfail_fast_kill yes\noutput_cap 2M\n"
+                                              "reports junit, html\ntest1 Value 1\n"))
+      self.assertEqual(config.get("jobs"), 4)
+      self.assertTrue(config.get("fail_fast_kill"))
+      self.assertEqual(config.get("output_cap"), 2 * 1024 * 1024)
+      self.assertEqual(config.get("reports"), ["junit", "html"])
+      self.assertEqual(config.get("timeout"), 0.0)   # default
+      self.assertEqual(config.get("test1"), "Value 1")
+      self.assertEqual(config.text("output_cap"), "2M")
+      self.assertIsNone(config.get("limit_cpu"))
+
+
+   def test_error_points_at_line(self):
+      file_name = self.write_config("jobs 2\n\nfail_fast lots\n")
+      with self.assertRaises(ConfigError) as e:
+         RunnerConfig(file_name)
+      self.assertTrue(str(e.exception).startswith("%s:3: fail_fast must be a whole number" % file_name))
+      self.assertRaises(ConfigError, RunnerConfig, self.write_config("jobs\n"))
+      self.assertRaises(ConfigError, RunnerConfig, self.write_config("[ci]\njobs 2\n"))
+      self.assertRaises(ConfigError, RunnerConfig, self.write_config("[profile ci]\njobs none\n"))
+      self.assertRaises(ConfigError, RunnerConfig, "qwert")
+      self.assertRaises(ConfigError, RunnerConfig.from_dict, {"run_policy": "qwert"})
+
+
+   def test_profiles(self):
+      file_name = self.write_config("jobs 1\ntimeout 0\n[profile ci]\njobs auto\ntimeout 600\n[profile perf]\njobs 1\n")
+      self.assertEqual(RunnerConfig(file_name).get("jobs"), 1)
+      config = RunnerConfig(file_name, profile="ci", overrides={"jobs": "3"})
+      self.assertEqual(config.get("timeout"), 600.0)
+      self.assertEqual(config.get("jobs"), 3)       # the command line wins
+      self.assertEqual(config.profiles, ["ci", "perf"])
+      self.assertRaises(ConfigError, RunnerConfig, file_name, "qwert")
+      self.assertRaises(ConfigError, config.select_profile, "qwert")
+      self.assertEqual(config.active, "ci")
+      self.assertEqual(read_config_file(file_name), {"jobs": "1", "timeout": "0"})
+
+
+   def test_hot_reload(self):
+      file_name = self.write_config("jobs 2\n")
+      config = RunnerConfig(file_name)
+      self.assertFalse(config.reload())
+      f = open(file_name, 'w')
+      f.write("jobs 5\n# longer file so the size changes\n")
+      f.close()
+      self.assertTrue(config.changed())
+      self.assertTrue(config.reload())
+      self.assertEqual(config.get("jobs"), 5)
+      f = open(file_name, 'w')
+      f.write("jobs five\n")
+      f.close()
+      self.assertRaises(ConfigError, config.reload)
+      self.assertEqual(config.get("jobs"), 5)  # bad file, old settings kept
+      self.assertFalse(config.reload())        # reported once
+      f = open(file_name, 'w')
+      f.write("jobs 3\n")
+      f.close()
+      self.assertTrue(config.reload())
+      self.assertEqual(config.get("jobs"), 3)
+
+
 if __name__ == "__main__":
    # If this library is executed as a main program
-   # Then execute the unit tests 
+   # Then execute the unit tests
    unittest.main()
@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+
+# Result History Library
+# Remembers the last result of every test case of a target so the next run
+# can start with the test cases that failed last time, or run only those.
+# The history is a small JSON file per target in the results folder. Several
+# runner instances may share it: each one merges only the results it recorded
+# into the file, under a lock. To run unit tests for this library execute
+# this library as main from the command line.
+
+import os
+import sys
+import json
+import fcntl
+import shutil
+import tempfile
+import unittest
+
+# -----------------------------------------------------------------------------
+# Some useful variables
+VERSION  = "1.0.0"
+FIRST    = 0
+LAST     = -1
+WARNING  = "\033[33mWARNING\033[0m"
+
+# Run policies
+#    file-order   run the test cases in the order of the suite file
+#    failed-first test cases that did not pass last time first, then the ones
+#                 that never ran, then the ones that passed
+#    failed-only  only the test cases that did not pass last time
+RUN_POLICIES = ["file-order", "failed-first", "failed-only"]
+PASSED       = "passed"
+
+
+class HistoryError(Exception):
+   """ Raised for an unknown run policy """
+   pass
+
+
+def history_key(case):
+   """ Returns the name a test case is remembered by, each parameter set
+       of a matrix test case on its own """
+   if "param_id" in case:
+      return "%s[%s]" % (os.path.basename(case["file"]), case["param_id"])
+   return os.path.basename(case["file"])
+
+
+class ResultHistory():
+   """ Last recorded result of each test case of a target """
+
+   def __init__(self, results_home, target):
+      self.file_name = os.path.join(results_home, ".last_results_%s.json" % target)
+      self.lock_name = os.path.join(results_home, ".last_results_%s.lock" % target)
+      self.results   = {}  # history key -> result
+      self.updates   = {}  # results recorded since the last save
+      self.changed   = False
+      self.load()
+
+   def load(self):
+      try:
+         f = open(self.file_name, 'r')
+         self.results = json.load(f)
+         f.close()
+      except FileNotFoundError:
+         self.results = {}
+      except (OSError, ValueError) as e:
+         sys.stderr.write("%s -- Ignoring result history %s: %s\n" % (WARNING, self.file_name, str(e)))
+         self.results = {}
+      return self.results
+
+   def record(self, case, result):
+      self.results[history_key(case)] = result
+      self.updates[history_key(case)] = result
+      self.changed = True
+
+   def last_result(self, case):
+      return self.results.get(history_key(case))
+
+   def save(self):
+      """ Writes the history. The results recorded here are merged into
+          the file as it is now, so runs of the same target by other
+          instances are kept. The file is replaced in one step so a reader
+          never sees a half written file. """
+      if not self.changed:
+         return
+      folder = os.path.dirname(self.file_name)
+      try:
+         lock = open(self.lock_name, 'a')
+      except OSError as e:
+         sys.stderr.write("%s -- Unable to save result history %s: %s\n" % (WARNING, self.file_name, str(e)))
+         return
+      try:
+         fcntl.flock(lock, fcntl.LOCK_EX)
+         self.load()
+         self.results.update(self.updates)
+         f = tempfile.NamedTemporaryFile('w', dir=folder, prefix=".history_", delete=False)
+         try:
+            json.dump(self.results, f, indent=1, sort_keys=True)
+            f.close()
+            os.replace(f.name, self.file_name)
+            self.updates = {}
+            self.changed = False
+         except OSError as e:
+            sys.stderr.write("%s -- Unable to save result history %s: %s\n" % (WARNING, self.file_name, str(e)))
+            if os.path.exists(f.name):
+               os.remove(f.name)
+      finally:
+         lock.close()  # releases the lock
+
+   def order(self, cases, policy):
+      """ Returns the test cases in the order the run policy asks for """
+      if policy not in RUN_POLICIES:
+         raise HistoryError("Unknown run policy \"%s\", use one of %s" % (policy, ", ".join(RUN_POLICIES)))
+      if policy == "file-order":
+         return list(cases)
+      not_passed = []
+      never_ran  = []
+      passed     = []
+      for case in cases:
+         result = self.last_result(case)
+         if result is None:
+            never_ran.append(case)
+         elif result == PASSED:
+            passed.append(case)
+         else:
+            not_passed.append(case)
+      if policy == "failed-only":
+         return not_passed
+      return not_passed + never_ran + passed
+
+
+# Unit tests
+class UnitTests(unittest.TestCase):
+   """ """
+   def setUp(self):
+      self.scratch = tempfile.mkdtemp()
+      self.cases   = [{"file": "/t/test_%02d.py" % n} for n in range(1, 6)]
+
+   def tearDown(self):
+      shutil.rmtree(self.scratch, ignore_errors=True)
+
+   def names(self, cases):
+      return [history_key(c) for c in cases]
+
+   def test_order(self):
+      """ """
+      history = ResultHistory(self.scratch, "TARGET_1")
+      history.record(self.cases[0], "passed")
+      history.record(self.cases[2], "failed")
+      history.record(self.cases[4], "resource-limit")
+      history.record(self.cases[3], "passed")
+      self.assertEqual(self.names(history.order(self.cases, "failed-first")),
+                       ["test_03.py", "test_05.py", "test_02.py", "test_01.py", "test_04.py"])
+      self.assertEqual(self.names(history.order(self.cases, "failed-only")), ["test_03.py", "test_05.py"])
+      self.assertEqual(history.order(self.cases, "file-order"), self.cases)
+      self.assertRaises(HistoryError, history.order, self.cases, "qwert")
+
+   def test_save_and_load(self):
+      """ """
+      history = ResultHistory(self.scratch, "TARGET_1")
+      history.record(self.cases[1], "failed")
+      history.save()
+      self.assertEqual(ResultHistory(self.scratch, "TARGET_1").last_result(self.cases[1]), "failed")
+      self.assertIsNone(ResultHistory(self.scratch, "TARGET_2").last_result(self.cases[1]))
+
+   def test_instances_merge(self):
+      """ """
+      first  = ResultHistory(self.scratch, "TARGET_1")
+      second = ResultHistory(self.scratch, "TARGET_1")
+      first.record(self.cases[0], "failed")
+      second.record(self.cases[1], "passed")
+      first.save()
+      second.save()
+      history = ResultHistory(self.scratch, "TARGET_1")
+      self.assertEqual((history.last_result(self.cases[0]), history.last_result(self.cases[1])), ("failed", "passed"))
+
+   def test_bad_history_file(self):
+      """ """
+      f = open(os.path.join(self.scratch, ".last_results_TARGET_1.json"), 'w')
+      f.write("{qwert")
+      f.close()
+      self.assertEqual(ResultHistory(self.scratch, "TARGET_1").results, {})
+
+
+if __name__ == "__main__":
+   # If this library is executed as a main program
+   # Then execute the unit tests
+   unittest.main()
@@ -0,0 +1,305 @@
+#!/usr/bin/python3
+
+# Resource Limits Library
+# Keeps a runaway test case from starving the host. Limits are applied to the
+# test case process with rlimits just before it starts and, optionally, the
+# process is placed in its own cgroup v2 group so memory and process counts
+# are enforced for the whole process tree. After the test case exits the
+# limits object reports whether a limit was hit so the test case can be given
+# the "resource-limit" state instead of a plain failure. To run unit tests for
+# this library execute this library as main from the command line.
+
+import os
+import sys
+import signal
+import resource
+import subprocess
+import tempfile
+import unittest
+
+# -----------------------------------------------------------------------------
+# Some useful variables
+VERSION  = "1.0.0"
+FIRST    = 0
+LAST     = -1
+WARNING  = "\033[33mWARNING\033[0m"
+
+# Suite setting / test case option   -> (rlimit, description)
+#    limit_as     address space in bytes, K/M/G suffixes allowed
+#    limit_cpu    CPU seconds
+#    limit_nofile open files
+#    limit_nproc  processes. The rlimit counts every process of the user so
+#                 use limit_cgroup for an exact per test case count.
+#    limit_fsize  largest file the test case may write, K/M/G suffixes allowed
+RLIMIT_OPTIONS = {"limit_as"     : (resource.RLIMIT_AS,     "address space" ),
+                  "limit_cpu"    : (resource.RLIMIT_CPU,    "cpu seconds"   ),
+                  "limit_nofile" : (resource.RLIMIT_NOFILE, "open files"    ),
+                  "limit_nproc"  : (resource.RLIMIT_NPROC,  "processes"     ),
+                  "limit_fsize"  : (resource.RLIMIT_FSIZE,  "output file size")}
+#    limit_memory cgroup memory.max for the whole process tree
+#    limit_cgroup cgroup v2 folder under which each test case gets a group,
+#                 e.g. /sys/fs/cgroup/testmaster.slice (must be writable)
+CGROUP_OPTIONS = ["limit_memory", "limit_cgroup"]
+LIMIT_OPTIONS  = list(RLIMIT_OPTIONS) + CGROUP_OPTIONS
+
+# Messages a process prints when an rlimit makes a call fail. The kernel
+# does not say which limit made a call fail, so these are only a guess. They
+# are used for a limit that was set and has no signal or cgroup counter to
+# show it was hit.
+BREACH_MESSAGES = {"limit_as"     : ["MemoryError", "Cannot allocate memory", "std::bad_alloc"],
+                   "limit_nofile" : ["Too many open files"],
+                   "limit_nproc"  : ["Resource temporarily unavailable", "BlockingIOError"]}
+SIZE_SUFFIXES   = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+_memory_warned = False  # limit_memory without limit_cgroup already reported
+
+
+class LimitError(Exception):
+   """ Raised for a malformed limit value """
+   pass
+
+
+def parse_size(value):
+   """ Converts a value such as 4096, 512K, 512M or 2G to an integer """
+   text = str(value).strip().upper().rstrip("B")
+   try:
+      if text and text[LAST] in SIZE_SUFFIXES:
+         return int(float(text[:LAST]) * SIZE_SUFFIXES[text[LAST]])
+      return int(text)
+   except ValueError:
+      raise LimitError("Bad limit value \"%s\"" % value)
+
+
+class ResourceLimits():
+   """ Resource limits for one test case """
+
+   def __init__(self, limits=None, memory=None, cgroup_parent=None):
+      """ Constructor for an object of type ResourceLimits
+             limits        : {option name: integer} for the RLIMIT_OPTIONS
+             memory        : cgroup memory.max in bytes
+             cgroup_parent : cgroup v2 folder that holds the test case groups """
+      self.limits        = dict(limits or {})
+      self.memory        = memory
+      self.cgroup_parent = cgroup_parent
+      self.cgroup        = None  # Folder of the cgroup for the running test case
+      self.guessed       = False # The last breach was guessed from the error output
+
+   @classmethod
+   def from_options(cls, options):
+      """ Creates the limits from a dictionary of {option name: value string}.
+          Options that are missing or None are not limited. limit_memory is
+          left out, with a warning, when there is no limit_cgroup to apply
+          it with. """
+      global _memory_warned
+      limits = {}
+      for key in RLIMIT_OPTIONS:
+         if options.get(key) is not None:
+            limits[key] = parse_size(options[key])
+      memory = options.get("limit_memory")
+      if memory is not None:
+         memory = parse_size(memory)
+         if not options.get("limit_cgroup"):
+            if not _memory_warned:
+               _memory_warned = True
+               sys.stderr.write("%s -- limit_memory needs limit_cgroup, the memory of the test cases is "
+                                "not limited (limit_as limits each process)\n" % WARNING)
+            memory = None
+      return cls(limits, memory, options.get("limit_cgroup"))
+
+   def __bool__(self):
+      return len(self.limits) > 0 or self.memory is not None
+
+   def describe(self):
+      """ Returns a short text listing the limits that apply, limit_memory
+          only once the cgroup that enforces it has been created """
+      items = ["%s=%d" % (key, value) for key, value in sorted(self.limits.items())]
+      if self.memory is not None and self.cgroup is not None:
+         items.append("limit_memory=%d" % self.memory)
+      if self.cgroup is not None:
+         items.append("cgroup=%s" % self.cgroup)
+      return " ".join(items)
+
+   # -------------------------------------------------------------------------- before the test case
+   def create_cgroup(self, name):
+      """ Creates a cgroup for the test case when a cgroup parent is set.
+          Returns the cgroup folder or None if cgroups are not available. """
+      if not self.cgroup_parent:
+         return None
+      cgroup = None
+      try:
+         cgroup = tempfile.mkdtemp(prefix="%s_" % name, dir=self.cgroup_parent)
+         if self.memory is not None:
+            self._write(cgroup, "memory.max", str(self.memory))
+            self._write(cgroup, "memory.swap.max", "0")
+         if "limit_nproc" in self.limits:
+            self._write(cgroup, "pids.max", str(self.limits["limit_nproc"]))
+         self.cgroup = cgroup
+      except OSError as e:
+         sys.stderr.write("%s -- Unable to create a cgroup under %s: %s\n" % (WARNING, self.cgroup_parent, str(e)))
+         if cgroup is not None:
+            try:
+               os.rmdir(cgroup)
+            except OSError:
+               pass
+         self.cgroup = None
+      return self.cgroup
+
+   def preexec(self):
+      """ Runs in the child process between fork and exec (Popen preexec_fn).
+          Joins the cgroup and sets the rlimits. """
+      if self.cgroup is not None:
+         self._write(self.cgroup, "cgroup.procs", str(os.getpid()))
+      for key, value in self.limits.items():
+         rlimit = RLIMIT_OPTIONS[key][FIRST]
+         hard   = value
+         if rlimit == resource.RLIMIT_CPU:
+            hard = value + 1  # SIGXCPU at the soft limit, SIGKILL a second later
+         _, current_hard = resource.getrlimit(rlimit)
+         if current_hard != resource.RLIM_INFINITY:
+            value = min(value, current_hard)
+            hard  = min(hard, current_hard)
+         resource.setrlimit(rlimit, (value, hard))
+
+   # -------------------------------------------------------------------------- after the test case
+   def breach(self, return_code, error_output=""):
+      """ Returns a description of the limit the test case ran into, or None
+          if the test case was not stopped by a limit. Signals and cgroup
+          counters are proof, the error output is only looked at for limits
+          that have neither and sets guessed when it decides. """
+      self.guessed = False
+      if return_code == 0:
+         return None
+      if "limit_cpu" in self.limits and return_code == -signal.SIGXCPU:
+         return RLIMIT_OPTIONS["limit_cpu"][LAST]
+      if "limit_fsize" in self.limits and return_code == -signal.SIGXFSZ:
+         return RLIMIT_OPTIONS["limit_fsize"][LAST]
+      if self.cgroup is not None:
+         if self._event_count("memory.events", "oom_kill") > 0:
+            return "memory"
+         if self._event_count("pids.events", "max") > 0:
+            return RLIMIT_OPTIONS["limit_nproc"][LAST]
+      for key, messages in BREACH_MESSAGES.items():
+         if key == "limit_nproc" and self.cgroup is not None:
+            continue  # pids.events counts it
+         if key in self.limits:
+            for m in messages:
+               if m in error_output:
+                  self.guessed = True
+                  return RLIMIT_OPTIONS[key][LAST]
+      if "limit_fsize" in self.limits and "File too large" in error_output:
+         self.guessed = True
+         return RLIMIT_OPTIONS["limit_fsize"][LAST]
+      return None
+
+   def remove_cgroup(self):
+      """ Removes the cgroup of the test case """
+      if self.cgroup is not None:
+         try:
+            os.rmdir(self.cgroup)
+         except OSError as e:
+            sys.stderr.write("%s -- Unable to remove cgroup %s: %s\n" % (WARNING, self.cgroup, str(e)))
+         self.cgroup = None
+
+   def _event_count(self, file_name, event):
+      try:
+         f = open(os.path.join(self.cgroup, file_name), 'r')
+         lines = f.readlines()
+         f.close()
+      except OSError:
+         return 0
+      for line in lines:
+         fields = line.split()
+         if len(fields) == 2 and fields[FIRST] == event:
+            return int(fields[LAST])
+      return 0
+
+   @staticmethod
+   def _write(folder, file_name, value):
+      f = open(os.path.join(folder, file_name), 'w')
+      f.write(value)
+      f.close()
+
+
+# Unit tests
+class UnitTests(unittest.TestCase):
+   """ """
+   def run_limited(self, limits, code):
+      p = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE, preexec_fn=limits.preexec)
+      _, error = p.communicate()
+      return p.returncode, error.decode()
+
+   def test_parse_size(self):
+      """ """
+      self.assertEqual(parse_size("4096"), 4096)
+      self.assertEqual(parse_size("512K"), 512 * 1024)
+      self.assertEqual(parse_size("2g"), 2 * 1024 ** 3)
+      self.assertEqual(parse_size("1.5M"), 1536 * 1024)
+      self.assertRaises(LimitError, parse_size, "qwert")
+
+   def test_from_options(self):
+      """ """
+      limits = ResourceLimits.from_options({"limit_as": "1G", "limit_cpu": "10", "limit_nofile": None})
+      self.assertEqual(limits.limits, {"limit_as": 1024 ** 3, "limit_cpu": 10})
+      self.assertTrue(limits)
+      self.assertFalse(ResourceLimits.from_options({}))
+      # No cgroup to enforce it, the memory limit is not claimed
+      limits = ResourceLimits.from_options({"limit_memory": "1G"})
+      self.assertIsNone(limits.memory)
+      self.assertFalse(limits)
+      self.assertEqual(ResourceLimits.from_options({"limit_memory": "1G", "limit_cgroup": "/qwert"}).memory, 1024 ** 3)
+
+   def test_no_breach_on_pass(self):
+      """ """
+      limits = ResourceLimits({"limit_nofile": 64})
+      self.assertEqual(self.run_limited(limits, "pass")[FIRST], 0)
+      self.assertIsNone(limits.breach(0, ""))
+
+   def test_open_files_breach(self):
+      """ """
+      limits = ResourceLimits({"limit_nofile": 32})
+      code = "fs = [open('/dev/null') for i in range(100)]"
+      return_code, error = self.run_limited(limits, code)
+      self.assertEqual(limits.breach(return_code, error), "open files")
+
+   def test_file_size_breach(self):
+      """ """
+      limits = ResourceLimits({"limit_fsize": 1024})
+      with tempfile.TemporaryDirectory() as folder:
+         code = "import signal; signal.signal(signal.SIGXFSZ, signal.SIG_DFL); " \
+                "open(%r, 'w').write('x' * 100000)" % os.path.join(folder, "big")
+         return_code, error = self.run_limited(limits, code)
+      self.assertEqual(limits.breach(return_code, error), "output file size")
+
+   def test_cpu_breach(self):
+      """ """
+      limits = ResourceLimits({"limit_cpu": 1})
+      return_code, error = self.run_limited(limits, "while True: pass")
+      self.assertEqual(limits.breach(return_code, error), "cpu seconds")
+
+   def test_plain_failure_is_not_a_breach(self):
+      """ """
+      limits = ResourceLimits({"limit_as": 1024 ** 3})
+      self.assertIsNone(limits.breach(1, "AssertionError: step 3 failed"))
+      self.assertIsNone(limits.breach(1, "cuda: out of memory"))
+      self.assertEqual(limits.breach(1, "MemoryError"), "address space")
+      self.assertTrue(limits.guessed)
+      self.assertIsNone(ResourceLimits({"limit_cpu": 1}).breach(1, "MemoryError"))
+
+   def test_failed_cgroup_is_removed(self):
+      """ """
+      class NoSwapAccounting(ResourceLimits):
+         @staticmethod
+         def _write(folder, file_name, value):
+            if file_name == "memory.swap.max":
+               raise OSError("No such file or directory")
+      with tempfile.TemporaryDirectory() as parent:
+         limits = NoSwapAccounting({}, memory=1024 ** 2, cgroup_parent=parent)
+         self.assertIsNone(limits.create_cgroup("test_01"))
+         self.assertEqual(os.listdir(parent), [])
+
+
+if __name__ == "__main__":
+   # If this library is executed as a main program
+   # Then execute the unit tests
+   unittest.main()
@@ -0,0 +1,322 @@
+#!/usr/bin/python3
+
+# Metrics Library
+# Counts what the test runner is doing and publishes it in the Prometheus
+# text exposition format, either on a small local HTTP endpoint or as a file
+# for the node_exporter textfile collector. Updating a metric is a plain
+# integer or float addition in the run loop; the text is only put together
+# when the endpoint is scraped or the file is written. To run unit tests for
+# this library execute this library as main from the command line.
+
+import os
+import sys
+import time
+import bisect
+import resource
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from config import as_config
+
+# -----------------------------------------------------------------------------
+# Some useful variables
+VERSION          = "1.0.0"
+FIRST            = 0
+LAST             = -1
+WARNING          = "\033[33mWARNING\033[0m"
+PREFIX           = "testmaster_"
+CONTENT_TYPE     = "text/plain; version=0.0.4; charset=utf-8"
+DURATION_BUCKETS = [0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+SPAWN_BUCKETS    = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1]
+TEXTFILE_NAME    = "testmaster.prom"
+
+
+class Histogram():
+   """ Cumulative histogram with fixed buckets """
+
+   def __init__(self, buckets):
+      self.buckets = list(buckets)
+      self.counts  = [0] * (len(self.buckets) + 1)  # last one is +Inf
+      self.sum     = 0.0
+
+   def observe(self, value):
+      self.counts[bisect.bisect_left(self.buckets, value)] += 1
+      self.sum += value
+
+   def lines(self, name):
+      counts = list(self.counts)  # copy, the run loop may be adding to it
+      lines  = []
+      total  = 0
+      for bound, count in zip(self.buckets + ["+Inf"], counts):
+         total += count
+         lines.append('%s_bucket{le="%s"} %d' % (name, bound, total))
+      lines.append("%s_sum %.6f" % (name, self.sum))
+      lines.append("%s_count %d" % (name, total))
+      return lines
+
+
+def runner_rss():
+   """ Resident set size of this process in bytes """
+   try:
+      f = open("/proc/self/statm", 'r')
+      pages = int(f.read().split()[1])
+      f.close()
+      return pages * os.sysconf("SC_PAGE_SIZE")
+   except (OSError, ValueError, IndexError):
+      return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # peak, in KB on Linux
+
+
+class RunnerMetrics():
+   """ Metrics of the test runner. One object lives as long as the program
+       so the counters keep counting across runs. """
+
+   def __init__(self, textfile=None, interval=5.0):
+      """ Constructor for an object of type RunnerMetrics
+             textfile : file rewritten for the textfile collector, or None
+             interval : least seconds between two writes of the file """
+      self.textfile   = textfile
+      self.interval   = interval
+      self.written    = 0.0
+      self.queued     = 0
+      self.running    = 0
+      self.slots      = 0
+      self.runs       = 0
+      self.retries    = 0
+      self.completed  = {}  # result -> count
+      self.output     = {"stdout": 0, "stderr": 0}
+      self.durations  = Histogram(DURATION_BUCKETS)
+      self.spawns     = Histogram(SPAWN_BUCKETS)
+      self.started_at = time.time()
+      self.server     = None  # MetricsServer, see create_metrics()
+
+   # -------------------------------------------------------------------------- updates from the runner
+   def run_started(self, queued, slots):
+      self.runs  += 1
+      self.queued = queued
+      self.slots  = slots
+
+   def case_started(self, spawn_seconds):
+      self.queued = max(0, self.queued - 1)
+      self.running += 1
+      self.spawns.observe(spawn_seconds)
+
+   def case_output(self, stream, count):
+      self.output[stream] += count
+
+   def case_finished(self, result, duration, started=True):
+      if started:
+         self.running = max(0, self.running - 1)
+      else:
+         self.queued = max(0, self.queued - 1)
+      self.completed[result] = self.completed.get(result, 0) + 1
+      self.durations.observe(duration)
+
+   def case_retried(self):
+      """ A test case failed and waits for its next attempt """
+      self.running = max(0, self.running - 1)
+      self.queued += 1
+      self.retries += 1
+
+   def run_finished(self):
+      self.queued  = 0
+      self.running = 0
+      self.write_textfile()
+
+   def tick(self):
+      """ Called from the run loop, writes the textfile now and then """
+      if self.textfile is not None and time.time() - self.written >= self.interval:
+         self.write_textfile()
+
+   # -------------------------------------------------------------------------- exposition
+   def render(self):
+      """ Returns the metrics in the Prometheus text format """
+      lines = []
+
+      def metric(name, kind, help_text, samples):
+         lines.append("# HELP %s%s %s" % (PREFIX, name, help_text))
+         lines.append("# TYPE %s%s %s" % (PREFIX, name, kind))
+         lines.extend(samples)
+
+      p = PREFIX
+      metric("cases_queued", "gauge", "Test cases waiting for a worker slot",
+             ["%scases_queued %d" % (p, self.queued)])
+      metric("cases_running", "gauge", "Test cases running",
+             ["%scases_running %d" % (p, self.running)])
+      metric("worker_slots", "gauge", "Worker slots of the current run",
+             ["%sworker_slots %d" % (p, self.slots)])
+      metric("runs_total", "counter", "Test suite runs started",
+             ["%sruns_total %d" % (p, self.runs)])
+      metric("case_retries_total", "counter", "Attempts of test cases that failed and were run again",
+             ["%scase_retries_total %d" % (p, self.retries)])
+      completed = dict(self.completed)
+      metric("cases_completed_total", "counter", "Test cases finished, by result",
+             ['%scases_completed_total{result="%s"} %d' % (p, r, completed[r]) for r in sorted(completed)])
+      metric("case_duration_seconds", "histogram", "Test case run time",
+             self.durations.lines(p + "case_duration_seconds"))
+      output = dict(self.output)
+      metric("output_bytes_total", "counter", "Bytes of test case output captured, by stream",
+             ['%soutput_bytes_total{stream="%s"} %d' % (p, s, output[s]) for s in sorted(output)])
+      metric("spawn_latency_seconds", "histogram", "Time taken to start a test case process",
+             self.spawns.lines(p + "spawn_latency_seconds"))
+      metric("runner_rss_bytes", "gauge", "Resident memory of the runner process",
+             ["%srunner_rss_bytes %d" % (p, runner_rss())])
+      metric("runner_start_time_seconds", "gauge", "Time the runner started, seconds since the epoch",
+             ["%srunner_start_time_seconds %.3f" % (p, self.started_at)])
+      return "\n".join(lines) + "\n"
+
+   def write_textfile(self):
+      """ Replaces the textfile in one step, as the collector asks for """
+      if self.textfile is None:
+         return
+      self.written = time.time()
+      try:
+         f = tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(self.textfile)),
+                                         prefix=".metrics_", delete=False)
+         f.write(self.render())
+         f.close()
+         os.replace(f.name, self.textfile)
+      except OSError as e:
+         sys.stderr.write("%s -- Unable to write metrics file %s: %s\n" % (WARNING, self.textfile, str(e)))
+         self.textfile = None
+
+
+class MetricsServer():
+   """ Serves the metrics on http://<host>:<port>/metrics from a thread """
+
+   def __init__(self, metrics, port, host="127.0.0.1"):
+      class Handler(BaseHTTPRequestHandler):
+         def do_GET(handler):
+            if handler.path.split('?')[FIRST] not in ("/", "/metrics"):
+               handler.send_error(404)
+               return
+            body = metrics.render().encode("utf-8")
+            handler.send_response(200)
+            handler.send_header("Content-Type", CONTENT_TYPE)
+            handler.send_header("Content-Length", str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+
+         def log_message(handler, format, *args):
+            pass  # keep scrapes out of the console
+
+      self.address = (host, port)  # as asked for, port may be 0
+      self.server  = HTTPServer((host, port), Handler)
+      self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+      self.thread.start()
+
+   @property
+   def port(self):
+      return self.server.server_address[1]
+
+   def close(self):
+      self.server.shutdown()
+      self.server.server_close()
+
+
+def create_metrics(config, metrics=None):
+   """ Creates the runner metrics from the configuration (a RunnerConfig):
+          metrics_port      port of the HTTP endpoint, 0 or empty turns it off
+          metrics_host      address the endpoint listens on, 127.0.0.1 by default
+          metrics_textfile  file for the node_exporter textfile collector
+          metrics_interval  seconds between writes of the textfile
+       Returns None when neither the endpoint nor the textfile is set. After
+       the configuration was reloaded, pass the metrics in use: they keep
+       their counters, take the new textfile and interval and the endpoint
+       is opened again when its port or address changed. """
+   config   = as_config(config)
+   port     = config.get("metrics_port")
+   host     = config.get("metrics_host")
+   textfile = config.get("metrics_textfile")
+   if metrics is not None and metrics.server is not None and (port <= 0 or metrics.server.address != (host, port)):
+      metrics.server.close()
+      metrics.server = None
+   if port <= 0 and not textfile:
+      return None
+   if textfile and os.path.isdir(textfile):
+      textfile = os.path.join(textfile, TEXTFILE_NAME)
+   if metrics is None:
+      metrics = RunnerMetrics(textfile or None, config.get("metrics_interval"))
+   else:
+      metrics.textfile = textfile or None
+      metrics.interval = config.get("metrics_interval")
+   if port > 0 and metrics.server is None:
+      try:
+         metrics.server = MetricsServer(metrics, port, host)
+      except OSError as e:
+         sys.stderr.write("%s -- Unable to serve metrics on port %d: %s\n" % (WARNING, port, str(e)))
+   return metrics
+
+
+# Unit tests
+class UnitTests(unittest.TestCase):
+   """ """
+   def test_histogram(self):
+      """ """
+      h = Histogram([1, 5])
+      for value in (0.5, 1, 3, 10):
+         h.observe(value)
+      self.assertEqual(h.lines("d"), ['d_bucket{le="1"} 2', 'd_bucket{le="5"} 3', 'd_bucket{le="+Inf"} 4',
+                                      "d_sum 14.500000", "d_count 4"])
+
+   def test_render(self):
+      """ """
+      m = RunnerMetrics()
+      m.run_started(3, 2)
+      m.case_started(0.004)
+      m.case_output("stdout", 100)
+      m.case_finished("passed", 1.2)
+      m.case_finished("error", 0.0, started=False)
+      text = m.render()
+      self.assertIn("testmaster_cases_queued 1\n", text)
+      self.assertIn("testmaster_cases_running 0\n", text)
+      self.assertIn('testmaster_cases_completed_total{result="passed"} 1\n', text)
+      self.assertIn('testmaster_output_bytes_total{stream="stdout"} 100\n', text)
+      self.assertIn('testmaster_spawn_latency_seconds_bucket{le="0.005"} 1\n', text)
+      self.assertIn("testmaster_case_duration_seconds_count 2\n", text)
+      self.assertGreater(runner_rss(), 0)
+
+   def test_textfile(self):
+      """ """
+      folder = tempfile.mkdtemp()
+      self.addCleanup(os.rmdir, folder)
+      m = create_metrics({"metrics_textfile": folder})
+      self.addCleanup(os.remove, os.path.join(folder, TEXTFILE_NAME))
+      m.run_finished()
+      f = open(os.path.join(folder, TEXTFILE_NAME))
+      self.assertIn("testmaster_runs_total 0", f.read())
+      f.close()
+      self.assertIsNone(create_metrics({}))
+
+   def test_reconfigure(self):
+      """ """
+      folder = tempfile.mkdtemp()
+      self.addCleanup(shutil.rmtree, folder)
+      m = create_metrics({"metrics_textfile": os.path.join(folder, "a.prom")})
+      m.run_started(1, 1)
+      self.assertIs(create_metrics({"metrics_textfile": os.path.join(folder, "b.prom")}, m), m)
+      self.assertEqual((m.textfile, m.runs), (os.path.join(folder, "b.prom"), 1))  # counters kept
+      m.server = MetricsServer(m, 0)
+      server = m.server
+      self.assertIs(create_metrics({"metrics_textfile": m.textfile}, m), m)
+      self.assertIsNone(m.server)  # endpoint turned off
+      self.assertEqual(server.server.fileno(), -1)  # socket closed
+      self.assertIsNone(create_metrics({}, m))
+
+   def test_server(self):
+      """ """
+      from urllib.request import urlopen
+      m = RunnerMetrics()
+      server = MetricsServer(m, 0)
+      self.addCleanup(server.close)
+      response = urlopen("http://127.0.0.1:%d/metrics" % server.port, timeout=5)
+      self.assertIn(b"testmaster_cases_running 0", response.read())
+      response.close()
+
+
+if __name__ == "__main__":
+   # If this library is executed as a main program
+   # Then execute the unit tests
+   unittest.main()
@@ -0,0 +1,376 @@
+#!/usr/bin/python3
+
+# File Monitor Library
+# Watches the test case folder, the test data folder and the test suite file
+# of a target for changes so that only the affected test cases are run again.
+# Linux inotify is used when it is available, otherwise the folders are
+# polled. Changes are debounced: a burst of writes (an editor saving a file,
+# a data set being copied) is reported once, after things have been quiet
+# for a moment. To run unit tests for this library execute this library as
+# main from the command line.
+
+import os
+import sys
+import time
+import struct
+import ctypes
+import ctypes.util
+import fnmatch
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+# -----------------------------------------------------------------------------
+# Some useful variables
+VERSION  = "1.0.0"
+FIRST    = 0
+LAST     = -1
+WARNING  = "\033[33mWARNING\033[0m"
+
+DEBOUNCE      = 0.5   # Seconds of quiet before changes are reported
+POLL_INTERVAL = 1.0   # Seconds between folder scans when polling
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_ISDIR       = 0x40000000
+IN_IGNORED     = 0x00008000
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+WATCH_MASK     = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+                 IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER   = struct.Struct("iIII")
+
+
+class Inotify():
+   """ Minimal ctypes wrapper around the Linux inotify calls """
+
+   def __init__(self):
+      name = ctypes.util.find_library("c")
+      self.libc = ctypes.CDLL(name, use_errno=True)
+      self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+      if self.fd < 0:
+         raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+      self.folders = {}  # watch descriptor -> folder
+
+   def add_watch(self, folder):
+      wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+      if wd < 0:
+         raise OSError(ctypes.get_errno(), "inotify_add_watch failed for %s" % folder)
+      self.folders[wd] = folder
+
+   def read_events(self):
+      """ Returns a list of (path, mask) tuples, empty if nothing happened """
+      try:
+         data = os.read(self.fd, 65536)
+      except BlockingIOError:
+         return []
+      events = []
+      offset = 0
+      while offset + EVENT_HEADER.size <= len(data):
+         wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+         offset += EVENT_HEADER.size
+         name = data[offset:offset + length].rstrip(b"\0")
+         offset += length
+         folder = self.folders.get(wd)
+         if folder is None:
+            continue
+         if mask & IN_IGNORED:
+            del self.folders[wd]
+            continue
+         path = os.path.join(folder, os.fsdecode(name)) if name else folder
+         events.append((path, mask))
+      return events
+
+   def close(self):
+      os.close(self.fd)
+
+
+class FileMonitor():
+   """ Reports changed files under a list of folders and files """
+
+   def __init__(self, paths, debounce=DEBOUNCE, use_inotify=True):
+      """ Constructor for an object of type FileMonitor
+             paths       : folders (watched with their sub folders) and files
+             debounce    : seconds of quiet before changes are reported
+             use_inotify : False forces polling """
+      self.paths     = [os.path.abspath(p) for p in paths]
+      self.debounce  = debounce
+      self.pending   = set()  # Changed paths not reported yet
+      self.last      = 0.0    # Time of the last change seen
+      self.inotify   = None
+      self.snapshot  = {}
+      self.scanned   = 0.0
+      if use_inotify:
+         try:
+            self.inotify = Inotify()
+            for folder in self._folders():
+               self.inotify.add_watch(folder)
+         except (OSError, AttributeError) as e:
+            sys.stderr.write("%s -- inotify not available, polling for changes: %s\n" % (WARNING, str(e)))
+            if self.inotify is not None:
+               self.inotify.close()
+            self.inotify = None
+      if self.inotify is None:
+         self.snapshot = self._scan()
+         self.scanned  = time.time()
+
+   @property
+   def mode(self):
+      return "inotify" if self.inotify is not None else "polling"
+
+   def poll(self):
+      """ Checks for changes without blocking. Returns the set of changed
+          paths once they have been quiet for the debounce time, otherwise
+          an empty set. """
+      now = time.time()
+      if self.inotify is not None:
+         changed = self._inotify_changes()
+      elif now - self.scanned >= min(POLL_INTERVAL, self.debounce):
+         changed = self._poll_changes()
+         self.scanned = now
+      else:
+         changed = set()
+      if changed:
+         self.pending |= changed
+         self.last = now
+      if self.pending and now - self.last >= self.debounce:
+         changes = self.pending
+         self.pending = set()
+         return changes
+      return set()
+
+   def wait(self, timeout=None, interval=0.1):
+      """ Blocks until there are changes or the timeout runs out. Returns
+          the set of changed paths. """
+      end = None if timeout is None else time.time() + timeout
+      while True:
+         changes = self.poll()
+         if changes or (end is not None and time.time() >= end):
+            return changes
+         time.sleep(interval)
+
+   def discard(self, folders):
+      """ Forgets the changes seen so far under the folders, e.g. the files
+          the test cases wrote into their data folder while they ran, so a
+          run does not trigger itself again. Other changes stay pending. """
+      if self.inotify is not None:
+         changed = self._inotify_changes()
+      else:
+         changed = self._poll_changes()
+         self.scanned = time.time()
+      self.pending |= changed
+      folders = [os.path.abspath(f) + os.sep for f in folders]
+      self.pending = set(p for p in self.pending
+                         if not any((p + os.sep).startswith(f) for f in folders))
+
+   def close(self):
+      if self.inotify is not None:
+         self.inotify.close()
+         self.inotify = None
+
+   # -------------------------------------------------------------------------- internals
+   def _folders(self):
+      """ Folders to watch: every folder under a watched folder and the
+          parent folder of a watched file (editors often replace files) """
+      folders = []
+      for path in self.paths:
+         if os.path.isdir(path):
+            for folder, _, _ in os.walk(path):
+               folders.append(folder)
+         elif os.path.isdir(os.path.dirname(path)):
+            folders.append(os.path.dirname(path))
+      return sorted(set(folders))
+
+   def _wanted(self, path):
+      for p in self.paths:
+         if path == p or path.startswith(p + os.sep):
+            return True
+      return False
+
+   def _inotify_changes(self):
+      changed = set()
+      for path, mask in self.inotify.read_events():
+         if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and self._wanted(path):
+            for folder, _, files in os.walk(path):  # watch new sub folders too
+               try:
+                  self.inotify.add_watch(folder)
+               except OSError:
+                  pass
+               changed.update(os.path.join(folder, f) for f in files)
+         if self._wanted(path):
+            changed.add(path)
+      return changed
+
+   def _scan(self):
+      snapshot = {}
+      for path in self.paths:
+         if os.path.isdir(path):
+            for folder, _, files in os.walk(path):
+               for f in files:
+                  self._stat(os.path.join(folder, f), snapshot)
+         else:
+            self._stat(path, snapshot)
+      return snapshot
+
+   @staticmethod
+   def _stat(path, snapshot):
+      try:
+         st = os.stat(path)
+         snapshot[path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+      except OSError:
+         pass
+
+   def _poll_changes(self):
+      snapshot = self._scan()
+      changed  = set(path for path in snapshot if self.snapshot.get(path) != snapshot[path])
+      changed |= set(self.snapshot) - set(snapshot)
+      self.snapshot = snapshot
+      return changed
+
+
+def affected_test_cases(changes, cases, testcase_folder, data_folder):
+   """ Returns the indexes of the test cases that have to run again after
+       the changes:
+          - a test case whose file changed
+          - every test case when another file in the test case folder (a
+            helper module) changed
+          - for a change under the data folder, the test cases whose data=
+            patterns (relative to the data folder) match it, or every test
+            case that has no data= option; the params= file or pattern of a
+            parameter matrix counts as one of its data= patterns
+       cases is a list of {"file": ..., "options": {...}} dictionaries. """
+   testcase_folder = os.path.abspath(testcase_folder)
+   data_folder     = os.path.abspath(data_folder) if data_folder else None
+   files    = {}  # path -> indexes, the parameter sets of a matrix share one file
+   for i, case in enumerate(cases):
+      if case.get("file"):
+         files.setdefault(os.path.abspath(case["file"]), []).append(i)
+   affected = set()
+   for path in changes:
+      path = os.path.abspath(path)
+      if path in files:
+         affected.update(files[path])
+      elif path.startswith(testcase_folder + os.sep):
+         if "__pycache__" not in path and not path.endswith((".pyc", "~", ".swp")):
+            return list(range(len(cases)))
+      elif data_folder and path.startswith(data_folder + os.sep):
+         relative = os.path.relpath(path, data_folder)
+         for i, case in enumerate(cases):
+            patterns = case.get("options", {}).get("data", [])
+            if len(patterns) > 0:
+               patterns = patterns + case.get("options", {}).get("params", [])
+            if len(patterns) < 1 or any(fnmatch.fnmatch(relative, p) for p in patterns):
+               affected.add(i)
+   return sorted(affected)
+
+
+def changed_test_cases(old_cases, new_cases):
+   """ Returns the indexes of the test cases in new_cases that are new or
+       whose options or parameters changed compared to old_cases, after a
+       suite reload """
+   def key(c):
+      return (c["file"], sorted(c["options"].items()), sorted(c.get("params", {}).items()))
+   old = [key(c) for c in old_cases]
+   return [i for i, c in enumerate(new_cases) if key(c) not in old]
+
+
+# Unit tests
+class UnitTests(unittest.TestCase):
+   """ """
+   def setUp(self):
+      self.scratch = tempfile.mkdtemp()
+      self.cases   = os.path.join(self.scratch, "testcases")
+      self.data    = os.path.join(self.scratch, "testdata")
+      os.makedirs(self.cases)
+      os.makedirs(os.path.join(self.data, "set1"))
+      self.write(os.path.join(self.cases, "test_01.py"), "pass\n")
+
+   def tearDown(self):
+      shutil.rmtree(self.scratch, ignore_errors=True)
+
+   def write(self, path, text):
+      f = open(path, 'w')
+      f.write(text)
+      f.close()
+
+   def check_monitor(self, use_inotify):
+      monitor = FileMonitor([self.cases, self.data], debounce=0.2, use_inotify=use_inotify)
+      time.sleep(0.05)
+      self.assertEqual(monitor.poll(), set())
+      time.sleep(0.02)  # make sure the mtime moves when polling
+      self.write(os.path.join(self.cases, "test_01.py"), "print('changed')\n")
+      self.write(os.path.join(self.data, "set1", "a.csv"), "1,2\n")
+      changes = monitor.wait(timeout=5)
+      monitor.close()
+      self.assertIn(os.path.join(self.cases, "test_01.py"), changes)
+      self.assertIn(os.path.join(self.data, "set1", "a.csv"), changes)
+
+   def test_inotify_monitor(self):
+      """ """
+      self.check_monitor(True)
+
+   def test_polling_monitor(self):
+      """ """
+      self.check_monitor(False)
+
+   def test_debounce(self):
+      """ """
+      monitor = FileMonitor([self.cases], debounce=0.3)
+      self.write(os.path.join(self.cases, "test_01.py"), "1\n")
+      time.sleep(0.1)
+      self.assertEqual(monitor.poll(), set())  # still settling
+      self.assertEqual(len(monitor.wait(timeout=5)), 1)
+      monitor.close()
+
+   def check_discard(self, use_inotify):
+      monitor = FileMonitor([self.cases, self.data], debounce=0.2, use_inotify=use_inotify)
+      time.sleep(0.02)
+      # a test case that writes into its data folder while it runs ...
+      script = os.path.join(self.cases, "test_02.py")
+      self.write(script, "open(%r, 'w').write('result')\n" %os.path.join(self.data, "set1", "out.txt"))
+      subprocess.call([sys.executable, script])
+      # ... does not trigger itself again once the run is over
+      monitor.discard([self.data])
+      changes = monitor.wait(timeout=1)
+      monitor.close()
+      self.assertEqual(changes, set([script]))
+
+   def test_discard(self):
+      """ """
+      self.check_discard(True)
+      self.check_discard(False)
+
+   def test_changed_test_cases(self):
+      """ """
+      old = [{"file": "a", "options": {}}, {"file": "b", "options": {"watch": ["X"]}}]
+      new = [{"file": "a", "options": {}}, {"file": "b", "options": {"watch": ["Y"]}}, {"file": "c", "options": {}}]
+      self.assertEqual(changed_test_cases(old, new), [1, 2])
+
+   def test_affected_test_cases(self):
+      """ """
+      cases = [{"file": os.path.join(self.cases, "test_01.py"), "options": {}},
+               {"file": os.path.join(self.cases, "test_02.py"), "options": {"data": ["set2/*"]}},
+               {"file": os.path.join(self.cases, "test_03.py"), "options": {"data": ["set1/*"]}}]
+      changed = lambda *paths: affected_test_cases(paths, cases, self.cases, self.data)
+      self.assertEqual(changed(os.path.join(self.cases, "test_02.py")), [1])
+      self.assertEqual(changed(os.path.join(self.data, "set1", "a.csv")), [0, 2])
+      self.assertEqual(changed(os.path.join(self.cases, "helpers.py")), [0, 1, 2])
+      self.assertEqual(changed(os.path.join(self.cases, "__pycache__", "helpers.pyc")), [])
+      # Every parameter set of a matrix runs again when its file changes
+      matrix = [dict(cases[FIRST], param_id="row%d" % n, params={}) for n in (1, 2, 3)]
+      self.assertEqual(affected_test_cases([cases[FIRST]["file"]], matrix + cases[1:], self.cases, self.data), [0, 1, 2])
+      self.assertEqual(changed(os.path.join(self.scratch, "qwert")), [])
+
+
+if __name__ == "__main__":
+   # If this library is executed as a main program
+   # Then execute the unit tests
+   unittest.main()
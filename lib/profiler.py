@@ -0,0 +1,233 @@
+#!/usr/bin/python3
+
+# Profiler Library
+# Runs a python test case under a profiler when the suite asks for it with
+#    set profile yes               <- every test case of the suite
+#    test_01.py  profile=yes       <- this test case only
+# Options:
+#    profiler=cprofile    deterministic profiler from the standard library
+#                         (the default), writes profile.pstats
+#    profiler=py-spy      sampling profiler, run out of process, writes the
+#                         collapsed stacks to profile.folded
+#    profiler=auto        py-spy when it is installed, otherwise cProfile
+#    profile_top=30       number of functions in the text summary
+# A text summary of the slowest functions is written to profile.txt in the
+# test case results folder. Profiling slows the test case down: the summary
+# and the test case results say by how much, so profiled durations are not
+# mistaken for normal ones. To run unit tests for this library execute this
+# library as main from the command line.
+
+import os
+import io
+import sys
+import time
+import shutil
+import pstats
+import cProfile
+import tempfile
+import functools
+import subprocess
+import unittest
+
+# -----------------------------------------------------------------------------
+# Some useful variables
+VERSION       = "1.0.0"
+FIRST         = 0
+LAST          = -1
+PROFILERS     = ["auto", "cprofile", "py-spy"]
+STATS_FILE    = "profile.pstats"
+FOLDED_FILE   = "profile.folded"
+SUMMARY_FILE  = "profile.txt"
+DEFAULT_TOP   = 30
+SAMPLING_RATE = 100  # py-spy samples per second
+
+# Runs a script under cProfile like "python script args" would run it, keeps
+# its exit code (python -m cProfile does not) and saves the stats even when
+# the script raises.
+BOOTSTRAP = """import os, sys, runpy, cProfile
+stats_file, script = sys.argv[1], sys.argv[2]
+sys.argv = sys.argv[2:]
+sys.path[0] = os.path.dirname(os.path.abspath(script))
+profile = cProfile.Profile()
+code = 0
+try:
+   profile.runcall(runpy.run_path, script, run_name="__main__")
+except SystemExit as e:
+   code = e.code
+finally:
+   profile.dump_stats(stats_file)
+sys.exit(code)
+"""
+
+
+class ProfilerError(Exception):
+   """ Raised for an unknown profiler """
+   pass
+
+
+@functools.lru_cache()
+def call_overhead(calls=20000):
+   """ Seconds cProfile adds to a function call on this machine, measured
+       once per process """
+   def nothing():
+      pass
+   start = time.perf_counter()
+   for _ in range(calls):
+      nothing()
+   plain = time.perf_counter() - start
+   profile = cProfile.Profile()
+   start = time.perf_counter()
+   profile.enable()
+   for _ in range(calls):
+      nothing()
+   profile.disable()
+   return max(0.0, (time.perf_counter() - start - plain) / calls)
+
+
+def choose_profiler(name):
+   """ Returns "cprofile" or "py-spy" for a profiler option value """
+   name = (name or "cprofile").strip().lower()
+   if name not in PROFILERS:
+      raise ProfilerError("Unknown profiler \"%s\", use one of %s" % (name, ", ".join(PROFILERS)))
+   if name == "auto":
+      return "py-spy" if shutil.which("py-spy") else "cprofile"
+   return name
+
+
+class TestCaseProfiler():
+   """ Profiles one run of a python test case """
+
+   def __init__(self, results_folder, profiler="cprofile", top=DEFAULT_TOP):
+      self.results_folder = os.path.abspath(results_folder)
+      self.profiler       = choose_profiler(profiler)
+      self.top            = top
+
+   def command(self, command_list):
+      """ Wraps the command of a python test case, [python, -u, script, ...] """
+      python, script_and_args = command_list[FIRST], command_list[2:]
+      if self.profiler == "py-spy":
+         return ["py-spy", "record", "--format", "raw", "--rate", str(SAMPLING_RATE),
+                 "--output", os.path.join(self.results_folder, FOLDED_FILE), "--"] + command_list
+      return [python, "-u", "-c", BOOTSTRAP, os.path.join(self.results_folder, STATS_FILE)] + script_and_args
+
+   def finish(self, name, duration):
+      """ Writes the text summary after the test case finished. Returns the
+          profile entry of the test case results. """
+      if self.profiler == "py-spy":
+         stats_file = os.path.join(self.results_folder, FOLDED_FILE)
+         overhead   = "sampled out of process at %d Hz, the test case only pauses while a sample is taken" % SAMPLING_RATE
+         body       = self.folded_summary(stats_file)
+      else:
+         stats_file = os.path.join(self.results_folder, STATS_FILE)
+         overhead, body = self.pstats_summary(stats_file, duration)
+      results = {"profiler": self.profiler, "stats": stats_file, "overhead": overhead}
+      if body is None:
+         results["summary"] = None
+         return results
+      text  = "Profile of %s (%s), run time %.2fs\n" % (name, self.profiler, duration)
+      text += "Overhead: %s\n\n" % overhead
+      text += body
+      summary_file = os.path.join(self.results_folder, SUMMARY_FILE)
+      f = open(summary_file, 'w')
+      f.write(text)
+      f.close()
+      results["summary"] = summary_file
+      return results
+
+   def pstats_summary(self, stats_file, duration):
+      """ Returns the (overhead, text) of a cProfile run, text is None if
+          the test case left no stats """
+      if not os.path.isfile(stats_file):
+         return "unknown, no profile was saved", None
+      stream = io.StringIO()
+      stats  = pstats.Stats(stats_file, stream=stream)
+      calls  = sum(s[1] for s in stats.stats.values())
+      extra  = calls * call_overhead()
+      overhead = "about %.2fs (%.0f%% of the run time) estimated for %d calls at %.2fus per call" % (
+                 extra, 100.0 * extra / duration if duration > 0 else 0.0, calls, call_overhead() * 1e6)
+      stats.sort_stats("cumulative").print_stats(self.top)
+      stats.sort_stats("tottime").print_stats(self.top)
+      return overhead, stream.getvalue()
+
+   def folded_summary(self, stats_file):
+      """ Returns the text summary of py-spy collapsed stacks: the functions
+          seen in the most samples, with and without their callees """
+      if not os.path.isfile(stats_file):
+         return None
+      total      = 0
+      inclusive  = {}
+      self_count = {}
+      f = open(stats_file, 'r', errors="replace")
+      for line in f:
+         stack, _, count = line.rstrip("\n").rpartition(' ')
+         try:
+            count = int(count)
+         except ValueError:
+            continue
+         frames = stack.split(';')
+         total += count
+         self_count[frames[LAST]] = self_count.get(frames[LAST], 0) + count
+         for frame in set(frames):
+            inclusive[frame] = inclusive.get(frame, 0) + count
+      f.close()
+      lines = ["%d samples" % total, ""]
+      for title, counts in (("Total (with callees)", inclusive), ("Self", self_count)):
+         lines.append("%-10s %7s  %s" % ("samples", "%", title))
+         for frame in sorted(counts, key=counts.get, reverse=True)[:self.top]:
+            lines.append("%-10d %6.1f%%  %s" % (counts[frame], 100.0 * counts[frame] / max(total, 1), frame))
+         lines.append("")
+      return "\n".join(lines)
+
+
+# Unit tests
+class UnitTests(unittest.TestCase):
+   """ """
+   def setUp(self):
+      self.scratch = tempfile.mkdtemp()
+
+   def tearDown(self):
+      shutil.rmtree(self.scratch, ignore_errors=True)
+
+   def script(self, code):
+      file_name = os.path.join(self.scratch, "slow.py")
+      f = open(file_name, 'w')
+      f.write(code)
+      f.close()
+      return file_name
+
+   def test_cprofile_keeps_exit_code(self):
+      """ """
+      script   = self.script("import sys\ndef work():\n   return sum(range(100000))\nwork()\nprint(sys.argv[1:])\nsys.exit(3)\n")
+      profiler = TestCaseProfiler(self.scratch, "cprofile")
+      process  = subprocess.run(profiler.command([sys.executable, "-u", script, "a"]), stdout=subprocess.PIPE)
+      self.assertEqual(process.returncode, 3)
+      self.assertEqual(process.stdout.strip(), b"['a']")
+      results = profiler.finish("slow", 1.0)
+      self.assertTrue(os.path.isfile(results["stats"]))
+      f = open(results["summary"])
+      text = f.read()
+      f.close()
+      self.assertIn("work", text)
+      self.assertIn("Overhead: about", text)
+
+   def test_folded_summary(self):
+      """ """
+      f = open(os.path.join(self.scratch, FOLDED_FILE), 'w')
+      f.write("main (a.py:1);work (a.py:3) 30\nmain (a.py:1) 10\nmain (a.py:1);io (a.py:9) 60\n")
+      f.close()
+      profiler = TestCaseProfiler(self.scratch, "cprofile")
+      text = profiler.folded_summary(os.path.join(self.scratch, FOLDED_FILE))
+      self.assertIn("100 samples", text)
+      self.assertIn(" 60.0%  io (a.py:9)", text)
+
+   def test_choose_profiler(self):
+      """ """
+      self.assertEqual(choose_profiler(None), "cprofile")
+      self.assertIn(choose_profiler("auto"), ("cprofile", "py-spy"))
+      self.assertRaises(ProfilerError, choose_profiler, "qwert")
+
+
+if __name__ == "__main__":
+   # If this library is executed as a main program
+   # Then execute the unit tests
+   unittest.main()
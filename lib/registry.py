@@ -0,0 +1,297 @@
+#!/usr/bin/python3
+
+# Run Registry Library
+# Gives every run of a test suite a unique id and results folder and keeps a
+# registry of the runs in <results home>/.runs so several GUI and headless
+# instances can share one results tree. Each run has two files there:
+#    <run id>.json   what the run is and how it ended, replaced in one step
+#    <run id>.lock   exists while the run is going, its runner holds an
+#                    exclusive flock on it
+# The lock is released by the operating system when a runner dies, so a
+# lock file that can be locked belongs to a run nobody is finishing. Such
+# runs are marked abandoned, with a note in their results folder, the next
+# time an instance reaps the registry. To run unit tests for this library
+# execute this library as main from the command line.
+
+import os
+import sys
+import json
+import time
+import fcntl
+import socket
+import shutil
+import secrets
+import tempfile
+import unittest
+
+# -----------------------------------------------------------------------------
+# Some useful variables
+VERSION         = "1.0.0"
+FIRST           = 0
+LAST            = -1
+WARNING         = "\033[33mWARNING\033[0m"
+REGISTRY_FOLDER = ".runs"
+ABANDONED_FILE  = "abandoned.txt"
+CLAIM_ATTEMPTS  = 100
+
+# Run states
+RUNNING   = "running"
+FINISHED  = "finished"   # every test case ran
+STOPPED   = "stopped"    # stopped by the user or fail fast, see stop_reason
+FAILED    = "error"      # the runner could not run the suite
+ABANDONED = "abandoned"  # the runner died before it finished the run
+
+
+class RegistryError(Exception):
+   """ Raised when a run cannot be registered """
+   pass
+
+
+def new_run_id(when=None):
+   """ Returns a run id: the date time stamp the results folders always had
+       (so they still sort by start time), the process id and a random part
+       so that runs started in the same second never share an id """
+   stamp = time.strftime("%Y%m%d%H%M%S", time.localtime(when))
+   return "%s_%d_%s" % (stamp, os.getpid(), secrets.token_hex(2))
+
+
+def create_run_folder(results_home):
+   """ Creates the results folder of a run in one step and returns its
+       (run id, path) """
+   for _ in range(CLAIM_ATTEMPTS):
+      run_id = new_run_id()
+      folder = os.path.join(results_home, run_id)
+      try:
+         os.mkdir(folder)
+         return run_id, folder
+      except FileExistsError:
+         continue
+   raise RegistryError("Unable to create a unique run folder in %s" % results_home)
+
+
+def write_json(file_name, data):
+   """ Replaces a JSON file in one step so a reader never sees half of it """
+   f = tempfile.NamedTemporaryFile('w', dir=os.path.dirname(file_name), prefix=".entry_", delete=False)
+   try:
+      json.dump(data, f, indent=1, sort_keys=True)
+      f.close()
+      os.replace(f.name, file_name)
+   except OSError:
+      f.close()
+      if os.path.exists(f.name):
+         os.remove(f.name)
+      raise
+
+
+def try_lock(fd):
+   """ True when the exclusive flock of the file was taken """
+   try:
+      fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      return True
+   except BlockingIOError:
+      return False
+
+
+class RegisteredRun():
+   """ A run in the registry, held by this process until it is finished """
+
+   def __init__(self, registry, run_id, folder, lock_fd, entry):
+      self.registry = registry
+      self.id       = run_id
+      self.folder   = folder
+      self.lock_fd  = lock_fd
+      self.entry    = entry
+
+   def finish(self, status=FINISHED, **details):
+      """ Records how the run ended and releases its lock. The entry is
+          written before the lock file goes so a reaper never takes a
+          finished run for an abandoned one. """
+      if self.lock_fd is None:
+         return
+      self.entry.update(details)
+      self.entry["status"]   = status
+      self.entry["finished"] = round(time.time(), 3)
+      try:
+         write_json(self.registry.entry_file(self.id), self.entry)
+      except OSError as e:
+         sys.stderr.write("%s -- Unable to update run %s: %s\n" % (WARNING, self.id, str(e)))
+      try:
+         os.remove(self.registry.lock_file(self.id))
+      except OSError:
+         pass
+      os.close(self.lock_fd)
+      self.lock_fd = None
+
+
+class RunRegistry():
+   """ The runs of one results tree """
+
+   def __init__(self, results_home):
+      self.results_home = results_home
+      self.folder       = os.path.join(results_home, REGISTRY_FOLDER)
+      os.makedirs(self.folder, exist_ok=True)
+
+   def entry_file(self, run_id):
+      return os.path.join(self.folder, run_id + ".json")
+
+   def lock_file(self, run_id):
+      return os.path.join(self.folder, run_id + ".lock")
+
+   # -------------------------------------------------------------------------- create_run()
+   def create_run(self, **info):
+      """ Claims a new run id, creates its results folder and registers it
+          as running. Extra keyword arguments (title, target, suite, ...)
+          are kept in the entry. Returns a RegisteredRun. """
+      fd, temp_name = tempfile.mkstemp(dir=self.folder, prefix=".claim_")
+      try:
+         # The lock is taken before the lock file has its name so a reaper
+         # can never find it unlocked while this run is alive
+         fcntl.flock(fd, fcntl.LOCK_EX)
+         for _ in range(CLAIM_ATTEMPTS):
+            run_id = new_run_id()
+            try:
+               os.link(temp_name, self.lock_file(run_id))  # fails if the id is taken
+            except FileExistsError:
+               continue
+            try:
+               folder = os.path.join(self.results_home, run_id)
+               os.mkdir(folder)
+            except OSError:
+               os.remove(self.lock_file(run_id))
+               raise
+            break
+         else:
+            raise RegistryError("Unable to claim a unique run id in %s" % self.folder)
+         entry = {"id"      : run_id,
+                  "folder"  : folder,
+                  "status"  : RUNNING,
+                  "pid"     : os.getpid(),
+                  "host"    : socket.gethostname(),
+                  "started" : round(time.time(), 3)}
+         entry.update(info)
+         write_json(self.entry_file(run_id), entry)
+      except BaseException:
+         os.close(fd)
+         raise
+      finally:
+         os.remove(temp_name)
+      return RegisteredRun(self, run_id, folder, fd, entry)
+
+   # -------------------------------------------------------------------------- runs()
+   def read_entry(self, run_id):
+      try:
+         f = open(self.entry_file(run_id), 'r')
+         entry = json.load(f)
+         f.close()
+         return entry
+      except (OSError, ValueError):
+         return None
+
+   def runs(self, status=None):
+      """ Returns the entries of the registered runs, newest first """
+      entries = []
+      try:
+         names = os.listdir(self.folder)
+      except OSError:
+         return []
+      for name in sorted(names, reverse=True):
+         if name.endswith(".json") and not name.startswith('.'):
+            entry = self.read_entry(name[:-len(".json")])
+            if entry is not None and (status is None or entry.get("status") == status):
+               entries.append(entry)
+      return entries
+
+   # -------------------------------------------------------------------------- reap()
+   def reap(self):
+      """ Marks the runs whose runner died as abandoned and returns their
+          entries. Only the lock files are looked at, so this stays cheap
+          however many runs the tree holds. """
+      abandoned = []
+      try:
+         names = os.listdir(self.folder)
+      except OSError:
+         return []
+      for name in names:
+         if not name.endswith(".lock") or name.startswith('.'):
+            continue
+         run_id = name[:-len(".lock")]
+         try:
+            fd = os.open(self.lock_file(run_id), os.O_RDWR)
+         except OSError:
+            continue  # finished meanwhile
+         try:
+            if not try_lock(fd):
+               continue  # its runner is alive
+            entry = self.read_entry(run_id) or {"id": run_id, "folder": os.path.join(self.results_home, run_id)}
+            if entry.get("status", RUNNING) == RUNNING:
+               entry["status"]       = ABANDONED
+               entry["abandoned_at"] = round(time.time(), 3)
+               entry["abandoned_by"] = "%d@%s" % (os.getpid(), socket.gethostname())
+               write_json(self.entry_file(run_id), entry)
+               self.write_abandoned_note(entry)
+               abandoned.append(entry)
+            os.remove(self.lock_file(run_id))
+         except OSError as e:
+            sys.stderr.write("%s -- Unable to reap run %s: %s\n" % (WARNING, run_id, str(e)))
+         finally:
+            os.close(fd)
+      return abandoned
+
+   def write_abandoned_note(self, entry):
+      """ Leaves a note in the results folder of an abandoned run """
+      if not os.path.isdir(entry["folder"]):
+         return
+      started = entry.get("started")
+      lines = ["Run %s was abandoned: its runner (pid %s on %s) stopped before the run finished." %
+               (entry["id"], entry.get("pid", "?"), entry.get("host", "?")),
+               "Started   %s" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)) if started else "?"),
+               "Detected  %s by %s" % (time.strftime("%Y-%m-%d %H:%M:%S"), entry["abandoned_by"]),
+               "The results of the test cases that finished are in this folder, the reports end there."]
+      f = open(os.path.join(entry["folder"], ABANDONED_FILE), 'w')
+      f.write("\n".join(lines) + "\n")
+      f.close()
+
+
+# Unit tests
+class UnitTests(unittest.TestCase):
+   """ """
+   def setUp(self):
+      self.scratch = tempfile.mkdtemp()
+
+   def tearDown(self):
+      shutil.rmtree(self.scratch, ignore_errors=True)
+
+   def test_unique_ids(self):
+      """ """
+      folders = set(create_run_folder(self.scratch)[LAST] for _ in range(200))
+      self.assertEqual(len(folders), 200)
+      self.assertTrue(all(os.path.isdir(f) for f in folders))
+
+   def test_finish(self):
+      """ """
+      registry = RunRegistry(self.scratch)
+      run = registry.create_run(title="TARGET_1 suite.txt")
+      self.assertTrue(os.path.isdir(run.folder))
+      self.assertEqual(registry.runs(RUNNING)[FIRST]["title"], "TARGET_1 suite.txt")
+      self.assertEqual(registry.reap(), [])  # alive, this process holds the lock
+      run.finish(STOPPED, stop_reason="stopped")
+      self.assertEqual(registry.runs()[FIRST]["status"], STOPPED)
+      self.assertFalse(os.path.exists(registry.lock_file(run.id)))
+
+   def test_reap_dead_runner(self):
+      """ """
+      import subprocess
+      code = ("import sys; sys.path.insert(0, %r); from registry import RunRegistry; "
+              "print(RunRegistry(%r).create_run().id)" % (os.path.dirname(os.path.abspath(__file__)), self.scratch))
+      run_id = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE).stdout.decode().strip()
+      registry = RunRegistry(self.scratch)
+      self.assertEqual([e["id"] for e in registry.reap()], [run_id])
+      self.assertEqual(registry.read_entry(run_id)["status"], ABANDONED)
+      self.assertTrue(os.path.isfile(os.path.join(self.scratch, run_id, ABANDONED_FILE)))
+      self.assertEqual(registry.reap(), [])
+
+
+if __name__ == "__main__":
+   # If this library is executed as a main program
+   # Then execute the unit tests
+   unittest.main()
@@ -0,0 +1,384 @@
+#!/usr/bin/python3
+
+# Report Library
+# Writes the results of a test suite run to the suite results folder as
+#    junit.xml      JUnit XML for CI servers
+#    results.jsonl  one JSON object per test case
+#    report.html    static HTML report, split into pages of test cases
+# The reports are written as each test case finishes and every file is a
+# valid report after every write, so a run that is killed still leaves a
+# usable partial report. The HTML pages link to the output.txt/errors.txt
+# files of the test cases instead of inlining them. To run unit tests for
+# this library execute this library as main from the command line.
+
+import os
+import re
+import sys
+import json
+import html
+import time
+import shutil
+import tempfile
+import unittest
+from xml.sax.saxutils import quoteattr, escape
+
+# -----------------------------------------------------------------------------
+# Some useful variables
+VERSION        = "1.0.0"
+FIRST          = 0
+LAST           = -1
+WARNING        = "\033[33mWARNING\033[0m"
+JUNIT_FILE     = "junit.xml"
+JSONL_FILE     = "results.jsonl"
+HTML_FILE      = "report.html"
+HTML_PAGE_FILE = "report_page_%04d.html"
+HTML_PAGE_SIZE = 500    # Test cases per HTML page
+ERRORS_TAIL    = 4096   # Bytes of errors.txt put in a JUnit failure
+TC_OUTPUT_FILE = "output.txt"
+TC_ERRORS_FILE = "errors.txt"
+PROFILE_FILE   = "profile.txt"
+REPORT_FORMATS = ["junit", "jsonl", "html"]
+PASSING        = ("passed", "flaky")  # results that count as passed
+XML_INVALID    = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def replace_file(file_name, text):
+   """ Writes a file in one step so it is never seen half written """
+   f = tempfile.NamedTemporaryFile('w', dir=os.path.dirname(file_name), prefix=".report_", delete=False)
+   f.write(text)
+   f.close()
+   os.replace(f.name, file_name)
+
+
+def xml_text(text):
+   """ Escapes text for XML and drops the control characters (colour
+       codes in test output) that XML does not allow """
+   return escape(XML_INVALID.sub("", text))
+
+
+def result_details(results):
+   """ Returns a one line explanation of a result that did not pass """
+   if results["result"] == "flaky":
+      return "Passed on attempt %d of %d" % (results["attempt"], len(results["attempts"]))
+   if "compile_error" in results:
+      return "Does not compile: %s" % results["compile_error"]
+   if "watch_match" in results:
+      return "Watch pattern matched: %s" % results["watch_match"]["line"]
+   if "resource_limit" in results:
+      if results.get("resource_limit_guessed"):
+         return "Stopped by the %s limit (judging by the error output)" % results["resource_limit"]
+      return "Stopped by the %s limit" % results["resource_limit"]
+   if results.get("stopped"):
+      return "Killed when the run was stopped"
+   if results["result"] not in PASSING:
+      return "Return code %s" % results.get("return_code")
+   return ""
+
+
+class Reporter():
+   """ Base class of the reporters """
+
+   def __init__(self, suite_results_folder):
+      self.folder = suite_results_folder
+
+   def start(self, title):
+      pass
+
+   def case_finished(self, results):
+      pass
+
+   def finish(self, summary):
+      """ summary is {"counts": {result: count}, "duration": seconds,
+          "stop_reason": text or None, "not_run": count} """
+      pass
+
+
+# ============================================================================= JSON lines
+class JsonLinesReporter(Reporter):
+   """ Appends one JSON object per finished test case """
+
+   def start(self, title):
+      self.file = open(os.path.join(self.folder, JSONL_FILE), 'a')
+
+   def case_finished(self, results):
+      self.file.write(json.dumps(results, sort_keys=True) + "\n")
+      self.file.flush()
+
+   def finish(self, summary):
+      self.file.write(json.dumps({"summary": summary}, sort_keys=True) + "\n")
+      self.file.close()
+
+
+# ============================================================================= JUnit XML
+class JUnitReporter(Reporter):
+   """ Writes a JUnit XML file. Each test case element is appended in front
+       of the closing tags, which are written again after it, so the file is
+       well formed between test cases. The suite totals are filled in when
+       the run finishes. """
+
+   CLOSING = "</testsuite>\n</testsuites>\n"
+
+   def start(self, title):
+      self.title     = title
+      self.file_name = os.path.join(self.folder, JUNIT_FILE)
+      self.file      = open(self.file_name, 'w', encoding="utf-8")
+      self.file.write('<?xml version="1.0" encoding="UTF-8"?>\n<testsuites>\n')
+      self.file.write('<testsuite name=%s timestamp=%s>\n' % (quoteattr(title), quoteattr(time.strftime("%Y-%m-%dT%H:%M:%S"))))
+      self.body_start = self.file.tell()
+      self._close_tags()
+
+   def case_finished(self, results):
+      self.file.seek(self.body_end)
+      self.file.truncate()
+      name    = quoteattr(results["testcase"])
+      file_   = quoteattr(results["file"])
+      element = '  <testcase name=%s classname=%s file=%s time="%.3f">\n' % (name, quoteattr(os.path.basename(self.folder)), file_, results["duration"])
+      result  = results["result"]
+      if result not in PASSING:
+         tag     = "failure" if result == "failed" else "error"
+         message = quoteattr(XML_INVALID.sub("", result_details(results)))
+         element += '    <%s type=%s message=%s>%s</%s>\n' % (tag, quoteattr(result), message,
+                                                             xml_text(self._errors_tail(results)), tag)
+      # Earlier attempts of a retried test case, as the surefire rerun format has them
+      for attempt in results.get("attempts", [])[:LAST]:
+         tag = "flakyFailure" if result == "flaky" else "rerunFailure"
+         element += '    <%s type=%s message=%s><system-out>%s</system-out></%s>\n' % (
+                    tag, quoteattr(attempt["result"]), quoteattr("Attempt %d: return code %s" % (attempt["attempt"], attempt["return_code"])),
+                    escape(os.path.join(attempt["folder"] or "", TC_OUTPUT_FILE)), tag)
+      element += '    <system-out>%s</system-out>\n' % escape(os.path.join(results["results_folder"], TC_OUTPUT_FILE))
+      element += '  </testcase>\n'
+      self.file.write(element)
+      self._close_tags()
+
+   def finish(self, summary):
+      """ Rewrites the testsuite element with the totals """
+      counts   = summary["counts"]
+      failures = counts.get("failed", 0)
+      errors   = sum(n for r, n in counts.items() if r not in PASSING + ("failed",))
+      tests    = sum(counts.values())
+      self.file.close()
+      header = '<?xml version="1.0" encoding="UTF-8"?>\n<testsuites tests="%d" failures="%d" errors="%d">\n' % (tests, failures, errors)
+      header += '<testsuite name=%s tests="%d" failures="%d" errors="%d" skipped="%d" time="%.3f">\n' % (
+                quoteattr(self.title), tests, failures, errors, summary["not_run"], summary["duration"])
+      # body_start and body_end are byte offsets, copy the body as bytes 
+      tmp = tempfile.NamedTemporaryFile('wb', dir=self.folder, prefix=".report_", delete=False)
+      tmp.write(header.encode("utf-8"))
+      f = open(self.file_name, 'rb')
+      f.seek(self.body_start)
+      remaining = self.body_end - self.body_start
+      while remaining > 0:
+         chunk = f.read(min(remaining, 1024 * 1024))
+         if not chunk:
+            break
+         tmp.write(chunk)
+         remaining -= len(chunk)
+      f.close()
+      tmp.write(self.CLOSING.encode("utf-8"))
+      tmp.close()
+      os.replace(tmp.name, self.file_name)
+
+   def _close_tags(self):
+      self.body_end = self.file.tell()
+      self.file.write(self.CLOSING)
+      self.file.flush()
+
+   def _errors_tail(self, results):
+      try:
+         f = open(os.path.join(results["results_folder"], TC_ERRORS_FILE), 'rb')
+         f.seek(0, os.SEEK_END)
+         f.seek(max(0, f.tell() - ERRORS_TAIL))
+         text = f.read().decode("utf-8", errors="replace")
+         f.close()
+         return text
+      except OSError:
+         return ""
+
+
+# ============================================================================= HTML
+class HtmlReporter(Reporter):
+   """ Writes a static HTML report: an index page with the totals and a
+       link to every page, and pages of HTML_PAGE_SIZE test cases. Only the
+       page being filled and the index are rewritten as test cases finish. """
+
+   STYLE = ("body{font-family:sans-serif} table{border-collapse:collapse} "
+            "td,th{border:1px solid #ccc;padding:2px 6px;text-align:left} "
+            ".passed{background:#c8ffc8} .flaky{background:#ffffc8} .failed,.error{background:#ffc8c8} "
+            ".resource-limit{background:#ffd8a0}")
+
+   def __init__(self, suite_results_folder, page_size=HTML_PAGE_SIZE):
+      super().__init__(suite_results_folder)
+      self.page_size = page_size
+
+   def start(self, title):
+      self.title   = title
+      self.started = time.strftime("%Y-%m-%d %H:%M:%S")
+      self.pages   = []   # [(file name, number of test cases, number not passed)]
+      self.rows    = []   # rows of the page being filled
+      self.failed  = 0
+      self.counts  = {}
+      self.summary = None
+      self._write_index()
+
+   def case_finished(self, results):
+      if len(self.rows) >= self.page_size:
+         self.rows   = []
+         self.failed = 0
+      if len(self.rows) == 0:
+         self.pages.append(None)
+      result = results["result"]
+      self.counts[result] = self.counts.get(result, 0) + 1
+      if result not in PASSING:
+         self.failed += 1
+      self.rows.append(self._row(results))
+      page = HTML_PAGE_FILE % len(self.pages)
+      self.pages[LAST] = (page, len(self.rows), self.failed)
+      self._write_page(page, len(self.pages))
+      self._write_index()
+
+   def finish(self, summary):
+      self.summary = summary
+      self._write_index()
+
+   def _row(self, results):
+      links = []
+      case_folder = os.path.basename(results["results_folder"])
+      for file_name in (TC_OUTPUT_FILE, TC_ERRORS_FILE, PROFILE_FILE):
+         if os.path.isfile(os.path.join(results["results_folder"], file_name)):
+            links.append('<a href="%s/%s">%s</a>' % (html.escape(case_folder), file_name, file_name))
+      return '<tr class="%s"><td>%s</td><td>%s</td><td>%.2fs</td><td>%s</td><td>%s</td></tr>' % (
+             html.escape(results["result"]), html.escape(results["result"]), html.escape(results["testcase"]),
+             results["duration"], html.escape(result_details(results)), " ".join(links))
+
+   def _page(self, title, body):
+      return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>%s</title><style>%s</style></head>\n'
+              '<body>\n%s\n</body></html>\n') % (html.escape(title), self.STYLE, body)
+
+   def _write_page(self, page, number):
+      body  = '<h1>%s</h1>\n<p><a href="%s">Back to the summary</a> - page %d</p>\n' % (html.escape(self.title), HTML_FILE, number)
+      body += '<table>\n<tr><th>Result</th><th>Test case</th><th>Time</th><th>Details</th><th>Files</th></tr>\n'
+      body += "\n".join(self.rows)
+      body += '\n</table>'
+      replace_file(os.path.join(self.folder, page), self._page("%s - page %d" % (self.title, number), body))
+
+   def _write_index(self):
+      if self.summary is None:
+         state = "Running, %d test cases finished" % sum(self.counts.values())
+      else:
+         state = "Finished in %.1fs" % self.summary["duration"]
+         if self.summary["stop_reason"]:
+            state += " -- PARTIAL: %s, %d test cases not run" % (self.summary["stop_reason"], self.summary["not_run"])
+      body  = '<h1>%s</h1>\n<p>Started %s. %s</p>\n<table>\n' % (html.escape(self.title), self.started, html.escape(state))
+      for result in sorted(self.counts):
+         body += '<tr class="%s"><td>%s</td><td>%d</td></tr>\n' % (html.escape(result), html.escape(result), self.counts[result])
+      body += '</table>\n<h2>Pages</h2>\n<ul>\n'
+      for number, (page, count, failed) in enumerate(self.pages, 1):
+         body += '<li><a href="%s">Page %d</a>: %d test cases, %d not passed</li>\n' % (page, number, count, failed)
+      body += '</ul>'
+      replace_file(os.path.join(self.folder, HTML_FILE), self._page(self.title, body))
+
+
+def create_reporters(suite_results_folder, formats):
+   """ Returns the reporters for a list of format names """
+   reporters = {"junit": JUnitReporter, "jsonl": JsonLinesReporter, "html": HtmlReporter}
+   created = []
+   for name in formats:
+      if name not in reporters:
+         sys.stderr.write("%s -- Unknown report format %s, use %s\n" % (WARNING, name, ", ".join(REPORT_FORMATS)))
+         continue
+      created.append(reporters[name](suite_results_folder))
+   return created
+
+
+# Unit tests
+class UnitTests(unittest.TestCase):
+   """ """
+   def setUp(self):
+      self.folder = tempfile.mkdtemp()
+
+   def tearDown(self):
+      shutil.rmtree(self.folder, ignore_errors=True)
+
+   def results(self, name, result="passed"):
+      folder = os.path.join(self.folder, name)
+      os.mkdir(folder)
+      f = open(os.path.join(folder, TC_ERRORS_FILE), 'w')
+      f.write("Traceback <boom> & more \033[31mred\033[0m")
+      f.close()
+      return {"testcase": name, "file": "/t/%s.py" % name, "result": result, "results_folder": folder,
+              "return_code": 0 if result == "passed" else 1, "duration": 1.5}
+
+   def summary(self, counts):
+      return {"counts": counts, "duration": 3.0, "stop_reason": None, "not_run": 0}
+
+   def parse_junit(self):
+      import xml.etree.ElementTree as ET
+      return ET.parse(os.path.join(self.folder, JUNIT_FILE)).getroot()
+
+   def test_junit_is_valid_while_running(self):
+      """ """
+      r = JUnitReporter(self.folder)
+      r.start("TARGET_1_Suite1")
+      self.assertEqual(len(self.parse_junit().findall(".//testcase")), 0)
+      r.case_finished(self.results("test_01"))
+      r.case_finished(self.results("test_02", "failed"))
+      root = self.parse_junit()
+      self.assertEqual(len(root.findall(".//testcase")), 2)
+      self.assertIn("<boom>", root.find(".//failure").text)
+      r.finish(self.summary({"passed": 1, "failed": 1}))
+      suite = self.parse_junit().find("testsuite")
+      self.assertEqual(suite.get("tests"), "2")
+      self.assertEqual(suite.get("failures"), "1")
+      self.assertEqual(len(suite.findall("testcase")), 2)
+
+   def test_junit_non_ascii(self):
+      """ """
+      r = JUnitReporter(self.folder)
+      r.start("Süite ✓")
+      results = self.results("test_é", "failed")
+      f = open(os.path.join(results["results_folder"], TC_ERRORS_FILE), 'w', encoding="utf-8")
+      f.write("Grüße, 日本語 ✗\n" * 100)
+      f.close()
+      r.case_finished(results)
+      r.case_finished(self.results("test_02"))
+      r.finish(self.summary({"passed": 1, "failed": 1}))
+      suite = self.parse_junit().find("testsuite")
+      self.assertEqual(suite.get("name"), "Süite ✓")
+      self.assertEqual([c.get("name") for c in suite.findall("testcase")], ["test_é", "test_02"])
+      self.assertIn("日本語", suite.find(".//failure").text)
+
+   def test_jsonl(self):
+      """ """
+      r = JsonLinesReporter(self.folder)
+      r.start("suite")
+      r.case_finished(self.results("test_01"))
+      f = open(os.path.join(self.folder, JSONL_FILE))
+      self.assertEqual(json.loads(f.readline())["testcase"], "test_01")
+      f.close()
+      r.finish(self.summary({"passed": 1}))
+
+   def test_html_pages(self):
+      """ """
+      r = HtmlReporter(self.folder, page_size=2)
+      r.start("suite")
+      for n in range(5):
+         r.case_finished(self.results("test_%02d" % n, "failed" if n == 3 else "passed"))
+      r.finish(self.summary({"passed": 4, "failed": 1}))
+      self.assertEqual([p[FIRST] for p in r.pages], [HTML_PAGE_FILE % n for n in (1, 2, 3)])
+      f = open(os.path.join(self.folder, HTML_PAGE_FILE % 2))
+      page = f.read()
+      f.close()
+      self.assertIn('href="test_03/errors.txt"', page)
+      self.assertNotIn("test_01", page)
+      f = open(os.path.join(self.folder, HTML_FILE))
+      self.assertIn("Page 3</a>: 1 test cases", f.read())
+      f.close()
+
+   def test_create_reporters(self):
+      """ """
+      self.assertEqual(len(create_reporters(self.folder, ["junit", "html", "qwert"])), 2)
+
+
+if __name__ == "__main__":
+   # If this library is executed as a main program
+   # Then execute the unit tests
+   unittest.main()
@@ -0,0 +1,1184 @@
+#!/usr/bin/python3
+
+# Test Runner Library
+# Runs the test cases of a test suite and collects their results. Test cases
+# run in a pool of worker slots. A slot may be pinned to a set of CPUs so that
+# performance test cases see the same cores on every run, and a test case
+# marked exclusive=yes runs alone with no neighbours in the pool. The output
+# of every running test case is read in a single loop and handed to the
+# caller through callbacks so the GUI and other front ends can show progress.
+# To run unit tests for this library execute this library as main from the
+# command line. Reports of the run are written to the suite results folder
+# as the test cases finish, see lib/report.py. Python test cases are compiled
+# into a bytecode cache before the run starts, see lib/bytecode.py. Test
+# cases that fail may be retried once the main pass has started them all,
+# a test case that passes only on a retry is reported as flaky. A test case
+# with a parameter matrix is expanded into one test case per parameter set
+# as slots become free, see lib/suite.py.
+
+import os
+import re
+import sys
+import time
+import codecs
+import logging
+import selectors
+import subprocess
+import tempfile
+import shutil
+import unittest
+
+from config import as_config, ConfigError
+from workspace import Workspace, WorkspaceError, default_workspace_root
+from suite import option_value, option_values, option_flag, expand_test_cases, count_test_cases, PARAMS_AS
+from watcher import OutputWatcher
+from limits import ResourceLimits, LimitError, LIMIT_OPTIONS
+from report import create_reporters
+from profiler import TestCaseProfiler, ProfilerError, DEFAULT_TOP
+from registry import create_run_folder, FINISHED, STOPPED
+from bytecode import create_bytecode_cache, is_python
+
+# -----------------------------------------------------------------------------
+# Some useful variables
+VERSION            = "1.0.0"
+FIRST              = 0
+LAST               = -1
+PYTHON_INTERPRETER = sys.executable
+TC_OUTPUT_FILE     = "output.txt"
+TC_ERRORS_FILE     = "errors.txt"
+SUMMARY_FILE       = "summary.txt"
+PARAM_ENV_PREFIX   = "TESTMASTER_PARAM_"
+
+# Test case results
+passed         = "passed"          # Test case has finished without error or failed step
+failed         = "failed"          # Test case failed one or more steps
+error          = "error"           # Test case could not be run
+resource_limit = "resource-limit"  # Test case was stopped by a resource limit
+flaky          = "flaky"           # Test case failed, then passed when it was retried
+RETRY_RESULTS  = (failed, resource_limit)
+ATTEMPT_FOLDER = "attempt_%d"
+
+logger = logging.getLogger()
+
+
+class RunnerError(Exception):
+   """ Raised for a bad runner configuration """
+   pass
+
+
+def parse_cpu_list(text):
+   """ Converts a CPU list such as "0-3,6" to a list of CPU numbers """
+   cpus = []
+   for part in text.replace(' ', '').split(','):
+      if len(part) < 1:
+         continue
+      try:
+         if '-' in part:
+            first, last = part.split('-', 1)
+            cpus.extend(range(int(first), int(last) + 1))
+         else:
+            cpus.append(int(part))
+      except ValueError:
+         raise RunnerError("Bad CPU list \"%s\"" % text)
+   if len(cpus) < 1:
+      raise RunnerError("Empty CPU list \"%s\"" % text)
+   return sorted(set(cpus))
+
+
+def format_cpu_list(cpus):
+   """ Converts a list of CPU numbers to the short form, e.g. "0-3,6" """
+   ranges = []
+   for cpu in sorted(cpus):
+      if ranges and cpu == ranges[LAST][LAST] + 1:
+         ranges[LAST][LAST] = cpu
+      else:
+         ranges.append([cpu, cpu])
+   return ",".join(str(a) if a == b else "%d-%d" % (a, b) for a, b in ranges)
+
+
+class Slot():
+   """ A place in the worker pool, optionally pinned to a set of CPUs """
+
+   def __init__(self, name, cpus=None):
+      self.name = name
+      self.cpus = cpus  # None means the slot is not pinned
+      self.job  = None  # Test case running in this slot
+
+   def free(self):
+      return self.job is None
+
+
+def create_slots(config):
+   """ Creates the worker slots from the configuration (a RunnerConfig):
+          slot_<name> <cpu list>   a named slot pinned to the CPUs, e.g. slot_bench 2-3
+          jobs <count|auto>        number of unpinned slots when no named slots are set
+       Without either setting test cases run one at a time. """
+   slots = []
+   named = config.with_prefix("slot_")
+   for key in sorted(named):
+      slots.append(Slot(key[len("slot_"):], parse_cpu_list(named[key])))
+   if len(slots) > 0:
+      return slots
+   jobs = config.get("jobs")
+   count = len(os.sched_getaffinity(0)) if jobs == "auto" else jobs
+   return [Slot("worker%d" % n) for n in range(1, count + 1)]
+
+
+def create_suite_results_folder(results_home):
+   """ Creates the date time stamped folder that holds the results of one
+       run of a test suite and returns its path. The folder name is a unique
+       run id, see lib/registry.py; runs that should be registered use
+       RunRegistry.create_run() instead. """
+   run_id, folder = create_run_folder(results_home)
+   logger.info("Created suite results folder %s" % folder)
+   return folder
+
+
+def test_case_command(test_case):
+   """ Returns the command list that runs a test case file """
+   # If the test case is a python script then be sure to run it
+   # UNBUFFERED mode otherwise just execute the test case
+   if test_case.lower().endswith('.py'):
+      return [PYTHON_INTERPRETER, "-u", test_case]
+   return [test_case]
+
+
+def parameter_environment(param_id, params):
+   """ Returns the variables that hand a parameter set to a test case:
+       TESTMASTER_PARAM_ID and TESTMASTER_PARAM_<NAME> per parameter """
+   env = {PARAM_ENV_PREFIX + "ID": param_id}
+   for name, value in params.items():
+      env[PARAM_ENV_PREFIX + re.sub(r"[^A-Z0-9_]", "_", name.upper())] = value
+   return env
+
+
+class Job():
+   """ A test case running in a slot """
+
+   def __init__(self, case, slot):
+      self.case        = case
+      self.slot        = slot
+      self.process     = None
+      self.output      = []    # \__ chunks of decoded output
+      self.errors      = []    # /
+      self.decoders    = {"stdout": codecs.getincrementaldecoder("utf-8")(errors="replace"),
+                          "stderr": codecs.getincrementaldecoder("utf-8")(errors="replace")}
+      self.open        = 0     # Number of pipes still open
+      self.exited_at   = None  # Time the process was seen to exit
+      self.started_at  = time.time()
+      self.workspace   = None
+      self.watcher     = None
+      self.watch_match = None
+      self.limits      = None
+      self.profiler    = None
+      self.affinity    = None
+      self.killed      = False
+      self.stopped     = False  # killed because the run was stopped
+      self.timeout     = 0      # seconds the test case may run, 0 for no limit
+      self.timed_out   = False
+      self.compile_error = None   # message of a python test case that does not compile
+      self.attempt     = 1      # 1 for the first run of the test case, 2 for its first retry
+      self.captured    = {"stdout": 0, "stderr": 0}  # \__ bytes kept and dropped
+      self.dropped     = {"stdout": 0, "stderr": 0}  # /   by the output cap
+
+
+class TestRunner():
+   """ Runs test cases in a pool of worker slots """
+
+   def __init__(self, suite_results_folder, data_folder=None, configs=None,
+                on_start=None, on_output=None, on_finish=None, on_idle=None, history=None,
+                title=None, metrics=None, registered_run=None, on_retry=None):
+      """ Constructor for an object of type TestRunner
+             suite_results_folder : folder that gets a results folder per test case
+             data_folder          : testdata/<TARGET> folder for the workspaces
+             configs              : RunnerConfig, or a dictionary of settings
+             on_start(case)                 : a test case was started
+             on_output(case, data, stream)  : a test case wrote output
+             on_finish(case, results)       : a test case finished
+             on_idle()                      : called once per pass of the run loop
+             on_retry(case, results)        : a test case failed and will be retried
+             history              : ResultHistory that records each result
+             title                : name of the run in the reports
+             metrics              : RunnerMetrics that counts what the runner does
+             registered_run       : RegisteredRun of the results folder, finished
+                                    with the outcome when the run ends
+          A case is a dictionary with at least "file" and "options". The
+          runner adds "name" and "results_folder" to it. A case with a
+          "matrix" is run once per parameter set. """
+      self.suite_results_folder = suite_results_folder
+      self.data_folder          = data_folder
+      try:
+         self.config            = as_config(configs)
+      except ConfigError as e:
+         raise RunnerError(str(e))
+      self.on_start             = on_start
+      self.on_output            = on_output
+      self.on_finish            = on_finish
+      self.on_idle              = on_idle
+      self.on_retry             = on_retry
+      self.slots                = create_slots(self.config)
+      self.selector             = None
+      self.history              = history
+      self.metrics              = metrics
+      self.registered_run       = registered_run
+      self.results              = []
+      self.not_run              = []     # files of the test cases a stopped run skipped
+      self.retry_queue          = []     # test cases waiting for their next attempt
+      self.stopping             = False
+      self.stop_reason          = None
+      self.failures             = 0
+      self.title                = title or os.path.basename(suite_results_folder)
+
+      # Suite reports: junit, jsonl and html
+      self.reporters = create_reporters(suite_results_folder, self.config.get("reports"))
+
+      # Fail fast: stop starting test cases after this many did not pass, 
+      # and optionally kill the ones that are running. 0 turns it off.
+      self.fail_fast      = self.config.get("fail_fast")
+      self.fail_fast_kill = self.config.get("fail_fast_kill")
+
+      # Test case processes: timeout in seconds (0 for none), bytes of output
+      # kept per stream (0 keeps all), bytes read from a pipe at a time,
+      # seconds to wait for output before checking for exits and seconds to
+      # wait for the pipes after a test case exits
+      self.timeout        = self.config.get("timeout")
+      self.output_cap     = self.config.get("output_cap")
+      self.read_size      = self.config.get("read_size")
+      self.select_timeout = self.config.get("select_timeout")
+      self.stream_grace   = self.config.get("stream_grace")
+
+      # Retries: a test case that failed or hit a resource limit is run again
+      # up to this many times after the main pass, optionally in a new 
+      # workspace even when workspaces are turned off
+      self.retries         = self.config.get("retries")
+      self.retry_workspace = self.config.get("retry_workspace")
+
+      # Python test cases are run from compiled code in a cache of the runner
+      self.bytecode       = create_bytecode_cache(self.config.get("bytecode_cache"))
+
+      # Scratch workspace settings, see lib/workspace.py
+      self.workspace_mode            = self.config.get("workspace_mode")
+      self.workspace_root            = self.config.get("workspace_root") or \
+                                       default_workspace_root(self.config.get("workspace_tmpfs"))
+      self.workspace_keep_on_failure = self.config.get("workspace_keep_on_failure")
+      self.workspace_argument        = self.config.get("workspace_argument")
+
+   # -------------------------------------------------------------------------- run()
+   def run(self, cases, count=None):
+      """ Runs the test cases and returns the list of results. Cases are
+          taken from the iterable one at a time as slots become free, the
+          parameter sets of a matrix too. count is the number of test cases
+          they expand to when the caller has counted them already. """
+      self.results     = []
+      self.not_run     = []
+      self.retry_queue = []
+      self.stopping    = False
+      self.stop_reason = None
+      self.failures    = 0
+      self.started_at  = time.time()
+      self.selector    = selectors.DefaultSelector()
+      self.report("start", self.title)
+      if self.metrics is not None:
+         if count is None:
+            count = count_test_cases(cases) if hasattr(cases, "__len__") else 0
+         self.metrics.run_started(count, len(self.slots))
+      if self.bytecode is not None and hasattr(cases, "__len__"):
+         cases = self.compile_test_cases(cases)
+      pending       = expand_test_cases(cases)
+      next_case     = None
+      completed     = False
+      try:
+         while True:
+            # Start test cases while there are free slots for them
+            while not self.stopping:
+               if next_case is None:
+                  next_case = next(pending, None)
+                  # Retries wait until every test case has been started
+                  if next_case is None and len(self.retry_queue) > 0:
+                     next_case = self.retry_queue.pop(FIRST)
+                  if next_case is None:
+                     break
+               slot = self.pick_slot(next_case)
+               if slot is None:
+                  break
+               self.execute_test_case(next_case, slot)
+               next_case = None
+            if len(self.running()) < 1 and (next_case is None or self.stopping):
+               break
+            self.read_output()
+            self.reap()
+            if self.on_idle is not None:
+               self.on_idle()
+            if self.metrics is not None:
+               self.metrics.tick()
+         # Remember what a stopped run did not get to
+         if next_case is not None:
+            self.not_run.append(self.pending_name(next_case))
+         for case in pending:
+            self.not_run.append(self.pending_name(case))
+         # A stopped run keeps the last attempt of the test cases it did not retry
+         for case in self.retry_queue:
+            self.record_result(case, self.last_attempt(case), started=False)
+         self.retry_queue = []
+         completed = True
+      finally:
+         self.selector.close()
+         self.selector = None
+         if self.history is not None:
+            self.history.save()
+         if self.metrics is not None:
+            self.metrics.run_finished()
+         if not completed and self.registered_run is not None:
+            self.registered_run.finish(STOPPED, stop_reason="runner interrupted")
+      self.write_summary()
+      self.report("finish", {"counts"      : self.result_counts(),
+                             "duration"    : round(time.time() - self.started_at, 3),
+                             "stop_reason" : self.stop_reason,
+                             "not_run"     : len(self.not_run)})
+      if self.registered_run is not None:
+         self.registered_run.finish(FINISHED if self.stop_reason is None else STOPPED,
+                                    counts      = self.result_counts(),
+                                    stop_reason = self.stop_reason,
+                                    not_run     = len(self.not_run))
+      return self.results
+
+   def stop(self, kill=False, reason="stopped"):
+      """ Stops starting new test cases. Running test cases finish unless
+          kill is set. """
+      self.stopping = True
+      if self.stop_reason is None:
+         self.stop_reason = reason
+      if kill:
+         for job in self.running():
+            job.stopped = True
+            self.kill(job)
+
+   def running(self):
+      return [slot.job for slot in self.slots if not slot.free()]
+
+   def pending_name(self, case):
+      """ Names a test case that was not run in the summary """
+      if "param_id" in case:
+         return "%s[%s]" %(case["file"], case["param_id"])
+      return case["file"]
+
+   # -------------------------------------------------------------------------- pick_slot()
+   def pick_slot(self, case):
+      """ Returns the slot to start a test case in, or None if it has to wait.
+          An exclusive test case waits until the pool is empty and keeps it
+          empty until it is done. A test case may ask for a named slot. """
+      running = self.running()
+      if any(option_flag(job.case["options"], "exclusive") for job in running):
+         return None
+      exclusive = option_flag(case["options"], "exclusive")
+      if exclusive and len(running) > 0:
+         return None
+      name = option_value(case["options"], "slot")
+      if name is not None:
+         for slot in self.slots:
+            if slot.name == name:
+               return slot if slot.free() else None
+         logger.warning("Unknown slot %s for %s, using any slot" % (name, case["file"]))
+      for slot in self.slots:
+         if slot.free():
+            return slot
+      return None
+
+   # -------------------------------------------------------------------------- execute_test_case()
+   def execute_test_case(self, case, slot):
+      """ Prepares the results folder, workspace, watcher and limits for a
+          test case and starts it in the slot. """
+      job = Job(case, slot)
+      slot.job = job
+      job.attempt = len(case.get("attempts", [])) + 1
+      if job.attempt == 1:
+         case["name"] = self.short_name(case["file"])
+         if "param_id" in case:
+            # The parameter sets of a matrix get their results folders in
+            # the folder of the test case
+            case["results_folder"] = self.make_results_folder(os.path.join(case["name"], case["param_id"]))
+            case["name"] = "%s[%s]" %(case["name"], case["param_id"])
+         else:
+            case["results_folder"] = self.make_results_folder(case["name"])
+      options = case["options"]
+
+      # Give the test case its own scratch copy of testdata/<TARGET>
+      job.workspace = self.create_workspace(case["name"], retry=job.attempt > 1)
+      # Output patterns that fail the test case as soon as they appear
+      job.watcher = self.create_watcher(options)
+      # Resource limits for the test case process
+      job.limits = self.create_limits(options, case["name"])
+      job.timeout = self.test_case_timeout(options, case["name"])
+
+      command_list = test_case_command(case["file"])
+      # Run a python test case under a profiler when the suite asks for it
+      job.profiler = self.create_profiler(options, case)
+      if job.profiler is not None:
+         command_list = job.profiler.command(command_list)
+      elif self.bytecode is not None and is_python(case["file"]):
+         # Cases handed over one at a time were not compiled before the run
+         if case["file"] not in self.bytecode.cached:
+            message = self.bytecode.compile_script(case["file"])
+            if message is not None:
+               self.compile_failed(job, message)
+               return job
+         command_list = self.bytecode.command(command_list)
+      env = None
+      cwd = None
+      if job.workspace is not None:
+         env = job.workspace.environment()
+         cwd = job.workspace.path
+      # The parameter set of a matrix test case, as arguments in column
+      # order or as environment variables
+      if "params" in case:
+         params = self.parameter_values(case["params"], job.workspace)
+         if option_value(options, PARAMS_AS, "env") == "args":
+            command_list.extend(params.values())
+         else:
+            env = dict(os.environ if env is None else env)
+            env.update(parameter_environment(case["param_id"], params))
+      if job.workspace is not None and self.workspace_argument:
+         command_list.append(job.workspace.path)
+
+      # Resource limits and CPU pinning are applied in the child just before
+      # the test case starts
+      def preexec():
+         if job.limits is not None:
+            job.limits.preexec()
+         if slot.cpus is not None:
+            os.sched_setaffinity(0, slot.cpus)
+
+      message = "RUNING:\n%s\n\nRESULTS IN:\n%s\n\nSLOT: %s" %(case["file"], case["results_folder"], slot.name)
+      logger.info(message)
+      if self.on_start is not None:
+         self.on_start(case)
+      spawn_start = time.time()
+      try:
+         job.process = subprocess.Popen(command_list           ,
+                                        stdout=subprocess.PIPE ,
+                                        stderr=subprocess.PIPE ,
+                                        env=env                ,
+                                        cwd=cwd                ,
+                                        preexec_fn=preexec     )
+      except (OSError, subprocess.SubprocessError) as e:
+         message = "Unable to start %s: %s" %(case["file"], str(e))
+         logger.error(message)
+         job.errors.append(message)
+         self.finish(job, error, 127)
+         return job
+
+      if self.metrics is not None:
+         self.metrics.case_started(time.time() - spawn_start)
+
+      # Record the CPUs the test case really got, the slot pinning narrowed
+      # by whatever the runner itself was limited to
+      try:
+         job.affinity = format_cpu_list(os.sched_getaffinity(job.process.pid))
+      except OSError:
+         job.affinity = format_cpu_list(slot.cpus) if slot.cpus else None
+      self.selector.register(job.process.stdout, selectors.EVENT_READ, (job, "stdout"))
+      self.selector.register(job.process.stderr, selectors.EVENT_READ, (job, "stderr"))
+      job.open = 2
+      return job
+
+   # -------------------------------------------------------------------------- read_output()
+   def read_output(self):
+      """ Reads whatever output the running test cases have written """
+      if len(self.selector.get_map()) < 1:
+         time.sleep(self.select_timeout)  # Only test cases that closed their pipes
+         return
+      for key, _ in self.selector.select(self.select_timeout):
+         job, stream = key.data
+         data = os.read(key.fd, self.read_size)
+         if not data:
+            self.selector.unregister(key.fileobj)  # stream closed
+            job.open -= 1
+            # The last line may have no line end
+            if job.watcher is not None and job.watch_match is None:
+               job.watch_match = job.watcher.close(stream)
+               if job.watch_match is not None:
+                  message = "Watch pattern \"%s\" matched in %s: %s" %(job.watch_match["pattern"], job.case["name"], job.watch_match["line"])
+                  logger.warning(message)
+            continue
+         if self.metrics is not None:
+            self.metrics.case_output(stream, len(data))
+         # Output past the cap is still watched but no longer kept or shown
+         keep = self.output_cap == 0 or job.captured[stream] < self.output_cap
+         if keep:
+            job.captured[stream] += len(data)
+         else:
+            job.dropped[stream] += len(data)
+         data = job.decoders[stream].decode(data)
+         if not data:
+            continue
+         if keep:
+            if stream == "stdout":
+               job.output.append(data)
+            else:
+               job.errors.append(data)
+
+         # Check the new output against the watch patterns
+         if job.watcher is not None and job.watch_match is None:
+            job.watch_match = job.watcher.feed(data, stream)
+            if job.watch_match is not None:
+               message = "Watch pattern \"%s\" matched in %s: %s" %(job.watch_match["pattern"], job.case["name"], job.watch_match["line"])
+               logger.warning(message)
+               if job.watcher.kill:
+                  self.kill(job)
+
+         if self.on_output is not None and keep:
+            self.on_output(job.case, data, stream)
+
+   # -------------------------------------------------------------------------- reap()
+   def reap(self):
+      """ Finishes test cases whose process has exited """
+      now = time.time()
+      for job in self.running():
+         return_code = job.process.poll()
+         if return_code is None:
+            if job.timeout > 0 and now - job.started_at > job.timeout and not job.timed_out:
+               logger.warning("%s timed out after %gs" %(job.case["name"], job.timeout))
+               job.timed_out = True
+               self.kill(job)
+            continue
+         if job.exited_at is None:
+            job.exited_at = now
+         # Wait for the pipes to drain unless a child of the test case is
+         # still holding them open
+         if job.open > 0 and now - job.exited_at < self.stream_grace:
+            continue
+         for stream in (job.process.stdout, job.process.stderr):
+            if stream in self.selector.get_map():
+               self.selector.unregister(stream)
+         breach = None
+         if job.limits is not None:
+            breach = job.limits.breach(return_code, "".join(job.errors))
+         if job.timed_out:
+            breach = "timeout"
+         if job.stopped:
+            result = error
+         elif breach is not None:
+            result = resource_limit
+         elif return_code == 0 and job.watch_match is None:
+            result = passed
+         else:
+            result = failed
+         self.finish(job, result, return_code, breach)
+
+   def kill(self, job):
+      if job.process is not None and job.process.poll() is None:
+         job.process.kill()
+         job.killed = True
+
+   # -------------------------------------------------------------------------- finish()
+   def finish(self, job, result, return_code, breach=None):
+      """ Writes the output files and results of a finished test case and
+          frees its slot """
+      case = job.case
+      for stream, chunks in (("stdout", job.output), ("stderr", job.errors)):
+         tail = job.decoders[stream].decode(b"", final=True)
+         if tail and job.dropped[stream] == 0:
+            chunks.append(tail)
+         if job.dropped[stream] > 0:
+            chunks.append("\n[%d bytes of output dropped, output_cap is %d]\n" %(job.dropped[stream], self.output_cap))
+      if job.process is not None:
+         job.process.stdout.close()
+         job.process.stderr.close()
+
+      test_case_results = {"testcase"       : case["name"],
+                           "file"           : case["file"],
+                           "result"         : result,
+                           "results_folder" : case["results_folder"],
+                           "return_code"    : return_code,
+                           "slot"           : job.slot.name,
+                           "affinity"       : job.affinity,
+                           "duration"       : round(time.time() - job.started_at, 3) }
+      if "params" in case:
+         test_case_results["params"] = case["params"]
+      if job.watch_match is not None:
+         test_case_results["watch_match"] = job.watch_match
+      if job.compile_error is not None:
+         test_case_results["compile_error"] = job.compile_error.strip().splitlines()[LAST]
+      if job.dropped["stdout"] or job.dropped["stderr"]:
+         test_case_results["output_dropped"] = dict(job.dropped)
+      if breach is not None:
+         test_case_results["resource_limit"] = breach
+         if job.limits is not None and job.limits.guessed and not job.timed_out:
+            test_case_results["resource_limit_guessed"] = True  # from the error output, see lib/limits.py
+         logger.warning("%s hit its %s limit" %(case["name"], breach))
+      if job.limits is not None:
+         job.limits.remove_cgroup()
+      if job.profiler is not None and job.process is not None:
+         try:
+            test_case_results["profile"] = job.profiler.finish(case["name"], test_case_results["duration"])
+         except Exception as e:
+            message = "Unable to summarize the profile of %s: %s" %(case["name"], str(e))
+            logger.error(message)
+      workspace_path = self.release_workspace(job.workspace, result == passed)
+      if workspace_path:
+         test_case_results["workspace"] = workspace_path
+
+      retry = self.retry_allowed(job, result)
+      if retry or job.attempt > 1:
+         # Every attempt of a retried test case keeps its output in a
+         # numbered folder, the last one is also in the results folder
+         attempt_folder = os.path.join(case["results_folder"], ATTEMPT_FOLDER %job.attempt)
+         os.makedirs(attempt_folder, exist_ok=True)
+         self.write_results_file(attempt_folder, TC_OUTPUT_FILE, "".join(job.output))
+         self.write_results_file(attempt_folder, TC_ERRORS_FILE, "".join(job.errors))
+         test_case_results["attempt"] = job.attempt
+         test_case_results["attempt_folder"] = attempt_folder
+
+      # Write the output and errors files to the test case results folder
+      if not retry:
+         self.write_results_file(case["results_folder"], TC_OUTPUT_FILE, "".join(job.output))
+         self.write_results_file(case["results_folder"], TC_ERRORS_FILE, "".join(job.errors))
+
+      if job.stopped:
+         test_case_results["stopped"] = True
+
+      job.slot.job = None
+      if retry:
+         case.setdefault("attempts", []).append(test_case_results)
+         self.retry_queue.append(case)
+         logger.warning("%s %s on attempt %d, it will be retried" %(case["name"], result, job.attempt))
+         if self.metrics is not None:
+            self.metrics.case_retried()
+         if self.on_retry is not None:
+            self.on_retry(case, test_case_results)
+         return test_case_results
+      if job.attempt > 1:
+         test_case_results["attempts"] = [self.attempt_summary(r) for r in case["attempts"] + [test_case_results]]
+         if result == passed:
+            test_case_results["result"] = flaky
+            logger.warning("%s passed on attempt %d, reported as flaky" %(case["name"], job.attempt))
+      return self.record_result(case, test_case_results, started=job.process is not None)
+
+   # -------------------------------------------------------------------------- record_result()
+   def record_result(self, case, test_case_results, started=True):
+      """ Records the final result of a test case and hands it to the
+          history, the reports and the caller """
+      result = test_case_results["result"]
+      self.results.append(test_case_results)
+      if self.history is not None:
+         self.history.record(case, result)
+      self.report("case_finished", test_case_results)
+      if self.metrics is not None:
+         self.metrics.case_finished(result, test_case_results["duration"], started=started)
+      if self.on_finish is not None:
+         self.on_finish(case, test_case_results)
+
+      # Fail fast
+      if result not in (passed, flaky) and not test_case_results.get("stopped"):
+         self.failures += 1
+         if self.fail_fast > 0 and self.failures >= self.fail_fast and not self.stopping:
+            reason = "fail fast after %d failures" %self.failures
+            logger.warning("Stopping the run: %s" %reason)
+            self.stop(kill=self.fail_fast_kill, reason=reason)
+      return test_case_results
+
+   # -------------------------------------------------------------------------- retries
+   def retry_allowed(self, job, result):
+      """ True when a test case that did not pass gets another attempt """
+      if result not in RETRY_RESULTS or job.stopped or self.stopping:
+         return False
+      return job.attempt <= self.test_case_retries(job.case["options"], job.case["name"])
+
+   def test_case_retries(self, options, short_name):
+      """ Returns how often a test case may be retried, a retries= option
+          overrides the configuration """
+      value = option_value(options, "retries")
+      if value is None:
+         return self.retries
+      try:
+         return max(0, int(value))
+      except ValueError:
+         logger.error("Ignoring bad retries \"%s\" of %s" %(value, short_name))
+         return self.retries
+
+   def last_attempt(self, case):
+      """ Returns the results of the last attempt of a test case whose
+          retry was not started, its output is put in the results folder """
+      results = case["attempts"].pop()
+      results["attempts"] = [self.attempt_summary(r) for r in case["attempts"] + [results]]
+      for file_name in (TC_OUTPUT_FILE, TC_ERRORS_FILE):
+         source = os.path.join(results["attempt_folder"], file_name)
+         if os.path.isfile(source):
+            shutil.copyfile(source, os.path.join(case["results_folder"], file_name))
+      return results
+
+   def attempt_summary(self, results):
+      return {"attempt"     : results.get("attempt", 1),
+              "result"      : results["result"],
+              "return_code" : results["return_code"],
+              "duration"    : results["duration"],
+              "folder"      : results.get("attempt_folder")}
+
+   # -------------------------------------------------------------------------- compile_test_cases()
+   def compile_test_cases(self, cases):
+      """ Compiles the python test cases, and the helper modules in their
+          folders, before the first one starts. A test case that does not
+          compile gets the error result right away and is not run. Returns
+          the test cases to run. """
+      start    = time.time()
+      compiled = self.bytecode.compiled
+      files    = [case["file"] for case in cases]
+      errors   = self.bytecode.compile_scripts(files)
+      folders  = sorted(set(os.path.dirname(f) for f in files if is_python(f)))
+      for file_name, message in sorted(self.bytecode.compile_modules(folders, skip=files).items()):
+         logger.warning("Helper module %s does not compile:\n%s" %(file_name, message))
+      logger.info("Compiled %d python files in %.2fs (bytecode cache %s)" 
+                  %(self.bytecode.compiled - compiled, time.time() - start, self.bytecode.root))
+      runnable = []
+      for case in cases:
+         if case["file"] not in errors:
+            runnable.append(case)
+            continue
+         job = Job(case, Slot("none"))
+         case["name"] = self.short_name(case["file"])
+         case["results_folder"] = self.make_results_folder(case["name"])
+         self.compile_failed(job, errors[case["file"]])
+      return runnable
+
+   def compile_failed(self, job, message):
+      """ Finishes a test case that does not compile without running it """
+      logger.error("%s does not compile:\n%s" %(job.case["file"], message))
+      job.compile_error = message
+      job.errors.append(message)
+      self.finish(job, error, None)
+
+   # -------------------------------------------------------------------------- write_summary()
+   def write_summary(self):
+      """ Writes a plain text summary of the run to the suite results folder. 
+          A stopped run gets a partial summary listing the test cases it did 
+          not run. """
+      counts = self.result_counts()
+      lines = ["Test suite results %s" %self.suite_results_folder,
+               "Started  %s" %time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+               "Duration %.1fs" %(time.time() - self.started_at), ""]
+      for result in sorted(counts):
+         lines.append("%-15s %d" %(result, counts[result]))
+      if self.stop_reason is not None:
+         lines.append("")
+         lines.append("PARTIAL: %s, %d test cases not run" %(self.stop_reason, len(self.not_run)))
+      lines.append("")
+      for r in self.results:
+         lines.append("%-15s %-30s %8.2fs" %(r["result"], r["testcase"], r["duration"]))
+      if len(self.not_run) > 0:
+         lines.append("")
+         lines.append("Not run:")
+         lines.extend(self.not_run)
+      self.write_results_file(self.suite_results_folder, SUMMARY_FILE, "\n".join(lines) + "\n")
+
+   def result_counts(self):
+      counts = {}
+      for r in self.results:
+         counts[r["result"]] = counts.get(r["result"], 0) + 1
+      return counts
+
+   # -------------------------------------------------------------------------- report()
+   def report(self, method, *args):
+      """ Hands an event to every reporter. A reporter that cannot write
+          its file is dropped so the run itself carries on. """
+      for reporter in list(self.reporters):
+         try:
+            getattr(reporter, method)(*args)
+         except OSError as e:
+            message = "Unable to write the %s report: %s" %(type(reporter).__name__, str(e))
+            logger.error(message)
+            self.reporters.remove(reporter)
+
+   def write_results_file(self, folder, file_name, text):
+      text = text.strip()
+      if len(text) < 1:
+         return
+      results_file = os.path.join(folder, file_name)
+      try:
+         f = open(results_file, 'w')
+         f.write(text)
+         f.close()
+      except Exception as e:
+         message = "Unable to write to test case results file %s" %results_file
+         logger.error(message)
+
+   # -------------------------------------------------------------------------- results folders
+   def short_name(self, test_case):
+      short_name = os.path.basename(test_case)
+      if '.' in short_name:
+         short_name = short_name.split('.')[FIRST]
+      return short_name
+
+   def make_results_folder(self, short_name):
+      """ Creates the results folder of a test case. A test case that is run
+          more than once in a suite gets a numbered folder. The short name
+          may hold a subfolder. """
+      folder = os.path.join(self.suite_results_folder, short_name)
+      os.makedirs(os.path.dirname(folder), exist_ok=True)
+      counter = 1
+      while True:
+         try:
+            os.mkdir(folder)
+            break
+         except FileExistsError:
+            counter += 1
+            folder = os.path.join(self.suite_results_folder, "%s_%d" %(short_name, counter))
+      logger.info("Created test case results folder %s" %folder)
+      return folder
+
+   # -------------------------------------------------------------------------- create_workspace()
+   def create_workspace(self, short_name, retry=False):
+      """ Creates the private scratch workspace for a test case. Returns None
+          when workspaces are turned off or cannot be created, in which case
+          the test case runs in the current folder. A retry gets a workspace
+          when retry_workspace is set even if workspaces are turned off, an
+          auto workspace: its files are its own copies (reflinks where the 
+          file system has them), never links into the test data. """
+      mode = self.workspace_mode
+      if mode == "none" and retry and self.retry_workspace and self.data_folder is not None:
+         mode = "auto"
+      if mode == "none":
+         return None
+      try:
+         workspace = Workspace(self.data_folder,
+                               root            = self.workspace_root,
+                               mode            = mode,
+                               keep_on_failure = self.workspace_keep_on_failure,
+                               name            = short_name)
+         workspace.create()
+      except (OSError, WorkspaceError) as e:
+         message = "Unable to create a workspace for %s: %s" %(short_name, str(e))
+         logger.error(message)
+         return None
+      logger.info("Created %s workspace %s" %(workspace.used_mode, workspace.path))
+      return workspace
+
+   def release_workspace(self, workspace, passed):
+      """ Cleans up a workspace. Returns the path of the workspace if it was
+          kept on disk, otherwise returns None. """
+      if workspace is None or workspace.cleanup(passed):
+         return None
+      logger.info("Kept workspace %s of failed test case" %workspace.path)
+      return workspace.path
+
+   def parameter_values(self, params, workspace):
+      """ Returns the parameter set with the data files in testdata/<TARGET>
+          replaced by their copies in the workspace of the test case """
+      if workspace is None or self.data_folder is None:
+         return params
+      prefix = os.path.abspath(self.data_folder) + os.sep
+      return dict((name, os.path.join(workspace.path, value[len(prefix):]) if value.startswith(prefix) else value)
+                  for name, value in params.items())
+
+   # -------------------------------------------------------------------------- create_watcher()
+   def create_watcher(self, options):
+      """ Creates the output watcher for a test case from the suite "watch"
+          settings and the test case watch= options. Returns None if there
+          are no patterns or a pattern is not a valid regular expression. """
+      patterns = option_values(options, "watch")
+      if len(patterns) < 1:
+         return None
+      try:
+         return OutputWatcher(patterns, kill=option_flag(options, "watch_kill", True))
+      except Exception as e:
+         message = "Bad watch pattern in %s: %s" %(patterns, str(e))
+         logger.error(message)
+         return None
+
+   # -------------------------------------------------------------------------- create_profiler()
+   def create_profiler(self, options, case):
+      """ Creates the profiler for a test case that has profile=yes. Only
+          python test cases can be profiled. Returns None otherwise. """
+      if not option_flag(options, "profile"):
+         return None
+      if not case["file"].lower().endswith(".py"):
+         logger.warning("Not profiling %s, only python test cases can be profiled" %case["name"])
+         return None
+      try:
+         profiler = TestCaseProfiler(case["results_folder"],
+                                     profiler = option_value(options, "profiler"),
+                                     top      = int(option_value(options, "profile_top", DEFAULT_TOP)))
+      except (ProfilerError, ValueError) as e:
+         message = "Not profiling %s: %s" %(case["name"], str(e))
+         logger.error(message)
+         return None
+      logger.info("Profiling %s with %s" %(case["name"], profiler.profiler))
+      return profiler
+
+   def test_case_timeout(self, options, short_name):
+      """ Returns the timeout of a test case, a timeout= option overrides
+          the configuration """
+      value = option_value(options, "timeout")
+      if value is None:
+         return self.timeout
+      try:
+         return max(0.0, float(value))
+      except ValueError:
+         logger.error("Ignoring bad timeout \"%s\" of %s" %(value, short_name))
+         return self.timeout
+
+   # -------------------------------------------------------------------------- create_limits()
+   def create_limits(self, options, short_name):
+      """ Creates the resource limits for a test case from the configuration,
+          the suite settings and the test case options. Returns None when the
+          test case has no limits. """
+      values = {}
+      for key in LIMIT_OPTIONS:
+         values[key] = option_value(options, key, self.config.text(key))
+      try:
+         limits = ResourceLimits.from_options(values)
+      except LimitError as e:
+         message = "Ignoring limits for %s: %s" %(short_name, str(e))
+         logger.error(message)
+         return None
+      if not limits:
+         return None
+      limits.create_cgroup(short_name)
+      logger.info("Resource limits for %s: %s" %(short_name, limits.describe()))
+      return limits
+
+
+# Unit tests
+class UnitTests(unittest.TestCase):
+   """ """
+   def setUp(self):
+      self.scratch = tempfile.mkdtemp()
+      self.results = os.path.join(self.scratch, "results")
+      os.mkdir(self.results)
+
+   def tearDown(self):
+      shutil.rmtree(self.scratch, ignore_errors=True)
+
+   def script(self, name, code):
+      file_name = os.path.join(self.scratch, name)
+      f = open(file_name, 'w')
+      f.write(code)
+      f.close()
+      return file_name
+
+   def configs(self, settings):
+      """ Settings for a test runner, with the bytecode cache in the scratch
+          folder rather than in the cache of the user """
+      return dict({"bytecode_cache": os.path.join(self.scratch, "cache")}, **settings)
+
+   def case(self, file_name, **options):
+      return {"file": file_name, "options": dict((k, [v]) for k, v in options.items())}
+
+   def test_cpu_list(self):
+      """ """
+      self.assertEqual(parse_cpu_list("0-3,6"), [0, 1, 2, 3, 6])
+      self.assertEqual(format_cpu_list([6, 0, 1, 2, 3]), "0-3,6")
+      self.assertEqual(format_cpu_list([1, 3]), "1,3")
+      self.assertRaises(RunnerError, parse_cpu_list, "a-b")
+
+   def test_create_slots(self):
+      """ """
+      self.assertEqual(len(create_slots(as_config({}))), 1)
+      self.assertEqual(len(create_slots(as_config({"jobs": "3"}))), 3)
+      slots = create_slots(as_config({"jobs": "3", "slot_bench": "0", "slot_other": "0"}))
+      self.assertEqual([s.name for s in slots], ["bench", "other"])
+      self.assertEqual(slots[FIRST].cpus, [0])
+
+   def test_pass_and_fail(self):
+      """ """
+      good = self.script("good.py", "print('hello')\n")
+      bad  = self.script("bad.py", "import sys\nsys.stderr.write('oops')\nsys.exit(3)\n")
+      runner  = TestRunner(self.results, configs=self.configs({"jobs": "2"}))
+      results = runner.run([self.case(good), self.case(bad)])
+      results = dict((r["testcase"], r) for r in results)
+      self.assertEqual(results["good"]["result"], passed)
+      self.assertEqual(results["bad"]["result"], failed)
+      self.assertEqual(results["bad"]["return_code"], 3)
+      f = open(os.path.join(results["good"]["results_folder"], TC_OUTPUT_FILE))
+      self.assertEqual(f.read(), "hello")
+      f.close()
+
+   def test_parallel_slots(self):
+      """ """
+      sleeper = self.script("sleeper.py", "import time\ntime.sleep(0.5)\n")
+      runner  = TestRunner(self.results, configs=self.configs({"jobs": "4"}))
+      start   = time.time()
+      results = runner.run([self.case(sleeper) for n in range(4)])
+      self.assertLess(time.time() - start, 1.5)
+      self.assertEqual(len(set(r["results_folder"] for r in results)), 4)
+
+   def test_exclusive_runs_alone(self):
+      """ """
+      sleeper = self.script("sleeper.py", "import time\ntime.sleep(0.3)\n")
+      seen    = []
+      runner  = TestRunner(self.results, configs=self.configs({"jobs": "3"}))
+      runner.on_start = lambda case: seen.append(len(runner.running()) - 1)  # others
+      runner.run([self.case(sleeper), self.case(sleeper, exclusive="yes"), self.case(sleeper)])
+      self.assertEqual(seen[1], 0)  # nothing else running when it started
+      self.assertEqual(seen[2], 0)  # nothing started next to it
+
+   def test_pinned_slot_affinity(self):
+      """ """
+      cpu     = sorted(os.sched_getaffinity(0))[FIRST]
+      good    = self.script("good.py", "import os\nprint(sorted(os.sched_getaffinity(0)))\n")
+      runner  = TestRunner(self.results, configs=self.configs({"slot_bench": str(cpu)}))
+      results = runner.run([self.case(good)])
+      self.assertEqual(results[FIRST]["slot"], "bench")
+      self.assertEqual(results[FIRST]["affinity"], str(cpu))
+
+   def test_watch_kills(self):
+      """ """
+      hang    = self.script("hang.py", "import time\nprint('FATAL: broken')\ntime.sleep(30)\n")
+      runner  = TestRunner(self.results, configs=self.configs({}))
+      start   = time.time()
+      results = runner.run([self.case(hang, watch="FATAL")])
+      self.assertLess(time.time() - start, 10)
+      self.assertEqual(results[FIRST]["result"], failed)
+      self.assertEqual(results[FIRST]["watch_match"]["line"], "FATAL: broken")
+
+   def test_fail_fast(self):
+      """ """
+      bad     = self.script("bad.py", "import sys\nsys.exit(1)\n")
+      good    = self.script("good.py", "pass\n")
+      runner  = TestRunner(self.results, configs=self.configs({"fail_fast": "2"}))
+      results = runner.run([self.case(bad), self.case(good), self.case(bad), self.case(good), self.case(good)])
+      self.assertEqual([r["result"] for r in results], [failed, passed, failed])
+      self.assertEqual(runner.not_run, [good, good])
+      f = open(os.path.join(self.results, SUMMARY_FILE))
+      summary = f.read()
+      f.close()
+      self.assertIn("PARTIAL: fail fast after 2 failures, 2 test cases not run", summary)
+      f = open(os.path.join(self.results, "junit.xml"))
+      self.assertIn('skipped="2"', f.read())
+      f.close()
+
+   def test_compile_errors_first(self):
+      """ """
+      good    = self.script("good.py", "print('hello')\n")
+      bad     = self.script("bad.py", "print('a'\n")
+      started = []
+      runner  = TestRunner(self.results, configs=self.configs({}),
+                           on_start=lambda case: started.append(case["file"]))
+      results = runner.run([self.case(good), self.case(bad)])
+      self.assertEqual([(r["testcase"], r["result"]) for r in results], [("bad", error), ("good", passed)])
+      self.assertIn("SyntaxError", results[FIRST]["compile_error"])
+      self.assertEqual(started, [good])
+      self.assertEqual(runner.bytecode.compiled, 1)
+
+   def test_retry_and_flaky(self):
+      """ """
+      marker  = os.path.join(self.scratch, "marker")
+      flaky_  = self.script("flaky.py", "import os, sys\nif not os.path.exists(%r):\n   open(%r, 'w').close()\n"
+                                        "   print('first')\n   sys.exit(1)\nprint('second')\n" % (marker, marker))
+      bad     = self.script("bad.py", "import sys\nsys.exit(1)\n")
+      good    = self.script("good.py", "pass\n")
+      retried = []
+      runner  = TestRunner(self.results, configs=self.configs({"retries": "2"}), on_retry=lambda case, r: retried.append(r["testcase"]))
+      results = runner.run([self.case(flaky_), self.case(bad, retries="1"), self.case(good)])
+      self.assertEqual(retried, ["flaky", "bad"])
+      results = dict((r["testcase"], r) for r in results)
+      self.assertEqual(results["flaky"]["result"], flaky)
+      self.assertEqual([a["result"] for a in results["flaky"]["attempts"]], [failed, passed])
+      self.assertEqual(results["bad"]["result"], failed)
+      self.assertEqual(len(results["bad"]["attempts"]), 2)
+      self.assertNotIn("attempts", results["good"])
+      folder = results["flaky"]["results_folder"]
+      self.assertEqual(sorted(os.listdir(folder)), [ATTEMPT_FOLDER % 1, ATTEMPT_FOLDER % 2, TC_OUTPUT_FILE])
+      f = open(os.path.join(folder, ATTEMPT_FOLDER % 1, TC_OUTPUT_FILE))
+      self.assertEqual(f.read(), "first")
+      f.close()
+      f = open(os.path.join(self.results, "junit.xml"))
+      self.assertEqual(f.read().count("<flakyFailure"), 1)
+      f.close()
+
+   def test_parameter_matrix(self):
+      """ """
+      from suite import ParameterMatrix
+      data = os.path.join(self.scratch, "data")
+      os.mkdir(data)
+      f = open(os.path.join(data, "users.csv"), 'w')
+      f.write("id,user\n" + "".join("u%d,name%d\n" % (n, n) for n in range(20)))
+      f.close()
+      env  = self.script("env.py", "import os, sys\nprint(os.environ['TESTMASTER_PARAM_USER'])\n"
+                                   "sys.exit(os.environ['TESTMASTER_PARAM_ID'] == 'u3')\n")
+      args = self.script("args.py", "import sys\nprint(sys.argv[1:])\n")
+      env_case  = dict(self.case(env), matrix=ParameterMatrix("users.csv", data))
+      args_case = dict(self.case(args, params_as="args"), matrix=ParameterMatrix("users.csv", data))
+      runner  = TestRunner(self.results, data_folder=data, configs=self.configs({"jobs": "4"}))
+      results = dict((r["testcase"], r) for r in runner.run([env_case, args_case]))
+      self.assertEqual(len(results), 40)
+      self.assertEqual(results["env[u3]"]["result"], failed)
+      self.assertEqual(results["env[u4]"]["params"], {"id": "u4", "user": "name4"})
+      folder = results["env[u4]"]["results_folder"]
+      self.assertEqual(folder, os.path.join(self.results, "env", "u4"))
+      f = open(os.path.join(folder, TC_OUTPUT_FILE))
+      self.assertEqual(f.read(), "name4")
+      f.close()
+      f = open(os.path.join(results["args[u5]"]["results_folder"], TC_OUTPUT_FILE))
+      self.assertEqual(f.read(), "['u5', 'name5']")
+      f.close()
+      self.assertEqual(len(os.listdir(os.path.join(self.results, "args"))), 20)
+
+   def test_registered_run(self):
+      """ """
+      from registry import RunRegistry
+      bad      = self.script("bad.py", "import sys\nsys.exit(1)\n")
+      registry = RunRegistry(self.scratch)
+      run      = registry.create_run(title="suite")
+      runner   = TestRunner(run.folder, configs=self.configs({"fail_fast": "1"}), registered_run=run)
+      runner.run([self.case(bad), self.case(bad)])
+      entry = registry.read_entry(run.id)
+      self.assertEqual(entry["status"], STOPPED)
+      self.assertEqual((entry["counts"], entry["not_run"]), ({failed: 1}, 1))
+      self.assertEqual(registry.reap(), [])
+
+   def test_fail_fast_kill(self):
+      """ """
+      bad     = self.script("bad.py", "import sys\nsys.exit(1)\n")
+      hang    = self.script("hang.py", "import time\ntime.sleep(30)\n")
+      runner  = TestRunner(self.results, configs=self.configs({"jobs": "2", "fail_fast": "1", "fail_fast_kill": "yes"}))
+      start   = time.time()
+      results = dict((r["testcase"], r) for r in runner.run([self.case(hang), self.case(bad)]))
+      self.assertLess(time.time() - start, 10)
+      self.assertEqual(results["hang"]["result"], error)
+      self.assertTrue(results["hang"]["stopped"])
+
+   def test_metrics(self):
+      """ """
+      from metrics import RunnerMetrics
+      good    = self.script("good.py", "print('hello')\n")
+      metrics = RunnerMetrics()
+      runner  = TestRunner(self.results, configs=self.configs({"jobs": "2"}), metrics=metrics)
+      runner.run([self.case(good), self.case(good), self.case(os.path.join(self.scratch, "qwert"))])
+      self.assertEqual(metrics.completed, {passed: 2, error: 1})
+      self.assertEqual(metrics.output["stdout"], 12)
+      self.assertEqual((metrics.queued, metrics.running), (0, 0))
+      self.assertEqual(sum(metrics.spawns.counts), 2)
+
+   def test_profile(self):
+      """ """
+      bad     = self.script("bad.py", "import sys\nsys.exit(2)\n")
+      runner  = TestRunner(self.results, configs=self.configs({}))
+      results = runner.run([self.case(bad, profile="yes", profiler="cprofile")])
+      self.assertEqual(results[FIRST]["result"], failed)
+      self.assertEqual(results[FIRST]["return_code"], 2)
+      self.assertTrue(os.path.isfile(results[FIRST]["profile"]["summary"]))
+      self.assertIn("estimated for", results[FIRST]["profile"]["overhead"])
+
+   def test_timeout_and_output_cap(self):
+      """ """
+      hang    = self.script("hang.py", "import sys, time\nsys.stdout.write('x' * 300000)\nsys.stdout.flush()\ntime.sleep(30)\n")
+      runner  = TestRunner(self.results, configs=self.configs({"timeout": "1", "output_cap": "64K", "read_size": "16K"}))
+      start   = time.time()
+      results = runner.run([self.case(hang), self.case(hang, timeout="0.5")])
+      self.assertLess(time.time() - start, 10)
+      self.assertEqual([r["resource_limit"] for r in results], ["timeout", "timeout"])
+      self.assertGreater(results[FIRST]["output_dropped"]["stdout"], 0)
+      self.assertLess(os.path.getsize(os.path.join(results[FIRST]["results_folder"], TC_OUTPUT_FILE)), 100000)
+      self.assertRaises(RunnerError, TestRunner, self.results, configs=self.configs({"jobs": "many"}))
+
+   def test_start_error(self):
+      """ """
+      runner  = TestRunner(self.results, configs=self.configs({}))
+      results = runner.run([self.case(os.path.join(self.scratch, "qwert"))])
+      self.assertEqual(results[FIRST]["result"], error)
+
+
+if __name__ == "__main__":
+   # If this library is executed as a main program
+   # Then execute the unit tests
+   unittest.main()
@@ -0,0 +1,738 @@
+#!/usr/bin/python3
+
+# Test Suite Library
+# Reads test suite files. A test suite file lists the test cases to run, one
+# file name per line. Suite-wide settings and per test case options may be
+# given as well:
+#
+#    # Comment lines and blank lines are ignored
+#    set watch 'FATAL'             <- suite setting, applies to every test case
+#    test_01.py
+#    test_02.py  watch='^ERROR:'   <- option for this test case only
+#    net/test_*.py                 <- glob pattern, test cases in file name order
+#    **/*.py  tags='smoke and not slow'
+#    include common_suite.txt      <- the test cases of another suite file
+#    test_05.py  params=users.csv  <- run once per row of testdata/<TARGET>/users.csv
+#    test_06.py  params='inputs/*.json' params_as=args
+#
+# Lines with settings or options are split like a shell command line so
+# values holding spaces must be quoted. Use single quotes for regular
+# expressions so backslashes are kept. A line with only a file name is read
+# as it is, spaces and quotes included.
+# Settings and options may be repeated, every value is kept in order. When a
+# single value is needed the last one wins, so an option given on a test case
+# line overrides the same suite setting.
+#
+# Patterns are matched against the test case folder of the target: * and ?
+# stay within a folder, ** crosses folders. An included suite file is found
+# relative to the including one, its settings apply to its own test cases
+# only. The tags option keeps the test cases whose tags match an expression
+# of tag names, and, or, not and parentheses (a comma means or). Tags are
+# read from a comment at the top of each test case:
+#
+#    #!/usr/bin/python3
+#    # tags: smoke, network
+#
+# The params option makes a parameter matrix of a test case: the test case
+# is run once per row of a CSV file (the header row names the parameters, an
+# id column names the rows) or once per data file matching a pattern, both
+# relative to testdata/<TARGET>. The rows are read as the run gets to them.
+#
+# Directory listings and tags are cached and only read again when a folder
+# or test case file changes, so large target trees expand quickly. To run
+# unit tests for this library execute this library as main from the command
+# line.
+
+import os
+import re
+import sys
+import csv
+import json
+import shlex
+import shutil
+import functools
+import tempfile
+import unittest
+
+# -----------------------------------------------------------------------------
+# Some useful variables
+VERSION  = "1.0.0"
+FIRST    = 0
+LAST     = -1
+WARNING  = "\033[33mWARNING\033[0m"
+
+SET_KEYWORD     = "set"
+INCLUDE_KEYWORD = "include"
+TAGS_OPTION     = "tags"
+PARAMS_OPTION   = "params"
+PARAMS_AS       = "params_as"
+PARAMS_AS_MODES = ("env", "args")
+PARAM_ID_COLUMN = "id"         # CSV column that names the rows
+DATA_FILE_PARAM = "data_file"  # parameter of a data file matrix
+PATTERN_CHARS   = "*?["
+OPTION_TOKEN    = re.compile(r"\s\w+=")  # A key=value option after the file name
+SKIP_NAMES      = ("__pycache__",)
+HEADER_BYTES    = 4096  # Tags are looked for in the start of a test case
+TAGS_HEADER     = re.compile(r"^(?:#|//)\s*tags\s*:(.*)$", re.IGNORECASE)
+
+
+class SuiteError(Exception):
+   """ Raised when a test suite file cannot be read or parsed """
+   pass
+
+
+def split_suite_line(line, file_name="", line_number=0):
+   """ Splits a suite file line into tokens. Returns an empty list for blank
+       and comment lines. A test case line without options is taken whole as
+       the file name, so names holding spaces, quotes or backslashes read as
+       they always did. """
+   line = line.strip()
+   if len(line) < 1 or line.startswith('#'):
+      return []
+   if line.split(None, 1)[FIRST] not in (SET_KEYWORD, INCLUDE_KEYWORD) and not OPTION_TOKEN.search(line):
+      return [line]
+   try:
+      return shlex.split(line, comments=True)
+   except ValueError as e:
+      raise SuiteError("%s:%d: %s" % (file_name, line_number, str(e)))
+
+
+def parse_option(token, file_name="", line_number=0):
+   """ Splits a key=value token into a (key, value) tuple """
+   if '=' not in token:
+      raise SuiteError("%s:%d: expected key=value, found \"%s\"" % (file_name, line_number, token))
+   key, value = token.split('=', 1)
+   return key.strip(), value
+
+
+def add_option(options, key, value):
+   """ Adds a value to a dictionary of option lists """
+   options.setdefault(key, []).append(value)
+
+
+def read_test_suite(file_name, including=()):
+   """ Reads a test suite file and returns a dictionary with:
+          "settings" : suite settings {key: [values]}
+          "cases"    : list of {"name": file name or pattern, "options": {key: [values]},
+                                "line": line number, "source": suite file}
+          "files"    : the suite file and the suite files it includes
+          "dynamic"  : True when test cases are picked by pattern or tags
+       Raises SuiteError if the file cannot be read or a line is malformed. """
+   try:
+      f = open(file_name, 'r')
+      lines = f.readlines()
+      f.close()
+   except OSError as e:
+      raise SuiteError("Unable to read test suite %s: %s" % (file_name, str(e)))
+
+   settings = {}
+   cases    = []
+   files    = [os.path.abspath(file_name)]
+   dynamic  = False
+   for line_number, line in enumerate(lines, 1):
+      tokens = split_suite_line(line, file_name, line_number)
+      if len(tokens) < 1:
+         pass  # Skip blank and comment lines
+      elif tokens[FIRST] == SET_KEYWORD:
+         if len(tokens) < 3:
+            raise SuiteError("%s:%d: expected \"set <key> <value>\"" % (file_name, line_number))
+         add_option(settings, tokens[1], " ".join(tokens[2:]))
+         check_option(tokens[1], settings[tokens[1]][LAST], file_name, line_number)
+      elif tokens[FIRST] == INCLUDE_KEYWORD:
+         if len(tokens) != 2:
+            raise SuiteError("%s:%d: expected \"include <suite file>\"" % (file_name, line_number))
+         included_file = os.path.join(os.path.dirname(file_name), tokens[1])
+         if os.path.abspath(included_file) in including + (os.path.abspath(file_name),):
+            raise SuiteError("%s:%d: include loop, %s is already being read" % (file_name, line_number, tokens[1]))
+         included = read_test_suite(included_file, including + (os.path.abspath(file_name),))
+         for case in included["cases"]:
+            cases.append(dict(case, options=merge_options(included["settings"], case["options"])))
+         files.extend(f for f in included["files"] if f not in files)
+         dynamic = dynamic or included["dynamic"] or TAGS_OPTION in included["settings"]
+      else:
+         options = {}
+         for token in tokens[1:]:
+            key, value = parse_option(token, file_name, line_number)
+            check_option(key, value, file_name, line_number)
+            add_option(options, key, value)
+         cases.append({"name": tokens[FIRST], "options": options, "line": line_number, "source": file_name})
+         dynamic = dynamic or is_pattern(tokens[FIRST]) or TAGS_OPTION in options
+   dynamic = dynamic or TAGS_OPTION in settings
+   return {"settings": settings, "cases": cases, "files": files, "dynamic": dynamic}
+
+
+def check_option(key, value, file_name, line_number):
+   """ Finds a bad tag expression or params_as value when the suite is
+       read """
+   if key == TAGS_OPTION:
+      try:
+         tag_expression(value)
+      except ValueError as e:
+         raise SuiteError("%s:%d: %s" % (file_name, line_number, str(e)))
+   elif key == PARAMS_AS and value not in PARAMS_AS_MODES:
+      raise SuiteError("%s:%d: params_as is one of %s, found \"%s\"" %
+                       (file_name, line_number, ", ".join(PARAMS_AS_MODES), value))
+
+
+def is_pattern(name):
+   return any(c in name for c in PATTERN_CHARS)
+
+
+@functools.lru_cache(maxsize=256)
+def pattern_regex(pattern):
+   """ Compiles a glob pattern where * and ? stay within a folder and **
+       crosses folders """
+   regex = ""
+   i = 0
+   while i < len(pattern):
+      if pattern.startswith("**/", i):
+         regex += "(?:.*/)?"
+         i += 3
+      elif pattern.startswith("**", i):
+         regex += ".*"
+         i += 2
+      elif pattern[i] == '*':
+         regex += "[^/]*"
+         i += 1
+      elif pattern[i] == '?':
+         regex += "[^/]"
+         i += 1
+      elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+         end = pattern.index(']', i + 2)
+         body = pattern[i + 1:end].replace("\\", "\\\\")
+         if body[FIRST] == '!':
+            body = '^' + body[1:]
+         elif body[FIRST] == '^':
+            body = "\\" + body
+         regex += "[" + body + "]"
+         i = end + 1
+      else:
+         regex += re.escape(pattern[i])
+         i += 1
+   return re.compile(regex + r"\Z")
+
+
+# -----------------------------------------------------------------------------
+# Directory listings, read again only when the folder changes
+_listings = {}  # folder -> (mtime_ns, [(name, is folder)])
+
+
+def list_directory(folder):
+   """ Returns the sorted (name, is folder) entries of a folder, without
+       hidden entries and __pycache__ """
+   try:
+      stamp = os.stat(folder).st_mtime_ns
+   except OSError:
+      return []
+   cached = _listings.get(folder)
+   if cached is not None and cached[FIRST] == stamp:
+      return cached[1]
+   entries = []
+   try:
+      with os.scandir(folder) as scan:
+         for entry in scan:
+            if not entry.name.startswith('.') and entry.name not in SKIP_NAMES:
+               entries.append((entry.name, entry.is_dir()))
+   except OSError:
+      return []
+   entries.sort()
+   _listings[folder] = (stamp, entries)
+   return entries
+
+
+def find_test_cases(testcase_folder, pattern):
+   """ Returns the paths, relative to the test case folder, of the files
+       that match a pattern, in file name order. Each folder part of the
+       pattern is matched one folder level down, so only the folders it
+       names are listed; everything below a ** part is searched. """
+   pattern = pattern.lstrip("/")
+   regex   = pattern_regex(pattern)
+   parts   = pattern.split("/")
+   matches = []
+   folders = [("", FIRST)]  # (folder, index of the pattern part it has to match)
+   while folders:
+      relative, index = folders.pop(FIRST)
+      deep = "**" in parts[index]
+      last = index == len(parts) - 1
+      for name, is_folder in list_directory(os.path.join(testcase_folder, relative)):
+         path = relative + name
+         if is_folder:
+            if deep:
+               folders.append((path + "/", index))
+            elif not last and pattern_regex(parts[index]).match(name):
+               folders.append((path + "/", index + 1))
+         elif (deep or last) and regex.match(path):
+            matches.append(path)
+   return sorted(matches)
+
+
+# -----------------------------------------------------------------------------
+# Tags
+def read_tags(file_name):
+   """ Returns the tags of the "tags:" comments at the top of a test case """
+   f = open(file_name, 'rb')
+   header = f.read(HEADER_BYTES).decode("utf-8", "replace")
+   f.close()
+   tags = []
+   for line in header.splitlines():
+      line = line.strip()
+      if len(line) < 1:
+         continue
+      if not (line.startswith('#') or line.startswith("//")):
+         break  # End of the header comment
+      match = TAGS_HEADER.match(line)
+      if match:
+         tags.extend(t.lower() for t in re.split(r"[\s,]+", match.group(1)) if t)
+   return tags
+
+
+class TagCache():
+   """ Tags of the test cases by file, read again only when a file changes.
+       The cache may be kept in a file between runs of the program. """
+
+   def __init__(self, file_name=None):
+      self.file_name = file_name
+      self.entries   = {}  # path -> [mtime_ns, size, tags]
+      self.changed   = False
+      if file_name is not None:
+         try:
+            f = open(file_name, 'r')
+            self.entries = json.load(f)
+            f.close()
+         except (OSError, ValueError):
+            self.entries = {}
+
+   def tags(self, file_name):
+      """ Returns the set of tags of a test case """
+      try:
+         st = os.stat(file_name)
+      except OSError:
+         return set()
+      entry = self.entries.get(file_name)
+      if entry is None or entry[FIRST] != st.st_mtime_ns or entry[1] != st.st_size:
+         try:
+            entry = [st.st_mtime_ns, st.st_size, read_tags(file_name)]
+         except OSError:
+            return set()
+         self.entries[file_name] = entry
+         self.changed = True
+      return set(entry[2])
+
+   def save(self):
+      """ Writes the cache file in one step when tags were read """
+      if self.file_name is None or not self.changed:
+         return
+      try:
+         f = tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(self.file_name)),
+                                         prefix=".tags_", delete=False)
+         json.dump(self.entries, f)
+         f.close()
+         os.replace(f.name, self.file_name)
+         self.changed = False
+      except OSError:
+         pass  # Only a cache, the tags are read again next time
+
+
+_tag_cache = TagCache()  # Used when the caller does not keep one
+
+
+@functools.lru_cache(maxsize=256)
+def tag_expression(text):
+   """ Compiles a tag expression such as "smoke and not (slow or flaky)"
+       into a function of a set of tags. Raises ValueError when it is bad. """
+   tokens = re.findall(r"[(),]|[^\s(),]+", text.lower())
+   position = [0]
+
+   def peek():
+      return tokens[position[FIRST]] if position[FIRST] < len(tokens) else None
+
+   def take():
+      token = peek()
+      position[FIRST] += 1
+      return token
+
+   def either():
+      terms = [both()]
+      while peek() in ("or", ","):
+         take()
+         terms.append(both())
+      return terms[FIRST] if len(terms) == 1 else (lambda tags: any(t(tags) for t in terms))
+
+   def both():
+      factors = [single()]
+      while peek() == "and":
+         take()
+         factors.append(single())
+      return factors[FIRST] if len(factors) == 1 else (lambda tags: all(f(tags) for f in factors))
+
+   def single():
+      token = take()
+      if token == "not":
+         inner = single()
+         return lambda tags: not inner(tags)
+      if token == "(":
+         inner = either()
+         if take() != ")":
+            raise ValueError("missing ) in tag expression \"%s\"" % text)
+         return inner
+      if token is None or token in ("and", "or", ",", ")"):
+         raise ValueError("bad tag expression \"%s\"" % text)
+      return lambda tags: token in tags
+
+   match = either()
+   if peek() is not None:
+      raise ValueError("bad tag expression \"%s\"" % text)
+   return match
+
+
+# -----------------------------------------------------------------------------
+# Parameter matrices
+def param_label(text):
+   """ Makes the id of a parameter set safe to use as a folder name """
+   return re.sub(r"[^A-Za-z0-9_.+-]+", "_", text).strip("._") or "_"
+
+
+class ParameterMatrix():
+   """ The parameter sets a test case is run with: the rows of a CSV file or
+       the data files that match a pattern, relative to the test data folder
+       of the target. The sets are read as they are asked for so a matrix
+       of thousands of rows is never held in memory. """
+
+   def __init__(self, source, data_folder):
+      self.source      = source
+      self.data_folder = data_folder
+      self.csv_file    = None
+      self._count      = None  # (stamp of the parameter file, number of sets)
+      if not is_pattern(source) and source.lower().endswith(".csv"):
+         self.csv_file = os.path.join(data_folder, source)
+         if not os.path.isfile(self.csv_file):
+            raise SuiteError("parameter file %s not found" % self.csv_file)
+
+   def rows(self):
+      """ Yields the (id, {name: value}) parameter sets in file order. An id
+          an earlier set already has, ids that only differ in the characters
+          param_label() replaces included, gets _row<N> appended, N being
+          the number of the set, so every set has a result of its own. """
+      seen = set()
+      for number, (label, params) in enumerate(self._rows(), 1):
+         while label in seen:
+            label = "%s_row%d" % (label, number)
+         seen.add(label)
+         yield label, params
+
+   def _rows(self):
+      if self.csv_file is None:
+         for name in find_test_cases(self.data_folder, self.source):  # any file, not only test cases
+            yield param_label(os.path.splitext(name)[FIRST]), {DATA_FILE_PARAM: os.path.join(self.data_folder, name)}
+         return
+      try:
+         f = open(self.csv_file, 'r', newline='')
+      except OSError as e:
+         sys.stderr.write("%s -- Unable to read parameter file %s: %s\n" % (WARNING, self.csv_file, str(e)))
+         return
+      try:
+         reader = csv.DictReader(f, restval="")
+         for number, row in enumerate(reader, 1):
+            # Cells past the header have no name and are left out
+            params = dict((name.strip(), value.strip()) for name, value in row.items() if name)
+            yield param_label(params.get(PARAM_ID_COLUMN) or "row%d" % number), params
+      except (csv.Error, UnicodeDecodeError) as e:
+         sys.stderr.write("%s -- Stopped reading parameter file %s at line %d: %s\n" %
+                          (WARNING, self.csv_file, reader.line_num, str(e)))
+      finally:
+         f.close()
+
+   def __len__(self):
+      """ Counts the parameter sets without keeping them. The count of a
+          parameter file is kept until the file changes. """
+      stamp = None
+      if self.csv_file is not None:
+         try:
+            st = os.stat(self.csv_file)
+            stamp = (st.st_mtime_ns, st.st_size)
+         except OSError:
+            pass
+      if stamp is None or self._count is None or self._count[FIRST] != stamp:
+         self._count = (stamp, sum(1 for _ in self._rows()))
+      return self._count[LAST]
+
+   def is_empty(self):
+      """ True when there are no parameter sets, reads up to the first one """
+      rows = self._rows()
+      try:
+         return next(rows, None) is None
+      finally:
+         rows.close()
+
+
+def expand_test_cases(cases):
+   """ Yields the test cases, a test case with a parameter matrix as one
+       test case per parameter set with "param_id" and "params" added. The
+       other keys of a case are kept. """
+   for case in cases:
+      matrix = case.get("matrix")
+      if matrix is None:
+         yield case
+         continue
+      for param_id, params in matrix.rows():
+         row = dict((key, value) for key, value in case.items() if key != "matrix")
+         row["param_id"] = param_id
+         row["params"]   = params
+         yield row
+
+
+def count_test_cases(cases):
+   """ Number of test cases the cases expand to """
+   return sum(len(case["matrix"]) if case.get("matrix") is not None else 1 for case in cases)
+
+
+def resolve_test_cases(suite, testcase_folder, tag_cache=None, data_folder=None):
+   """ Finds the test cases of a suite in the test case folder of a target.
+       Returns a list of {"name", "file", "options"} dictionaries where file
+       is the full path of the test case, or None if it does not exist, and
+       options are the suite settings merged with the test case options. A
+       pattern expands to the test cases it matches, or to one test case
+       with no file when it matches none. Test cases whose tags do not
+       match the tags options are left out. A test case with a params
+       option gets the ParameterMatrix of the data folder as "matrix", see
+       expand_test_cases(). Raises SuiteError for a missing parameter file. """
+   if tag_cache is None:
+      tag_cache = _tag_cache
+   cases = []
+   for case in suite["cases"]:
+      options = merge_options(suite["settings"], case["options"])
+      filters = [tag_expression(text) for text in option_values(options, TAGS_OPTION)]
+      matrix  = None
+      source  = option_value(options, PARAMS_OPTION)
+      if source is not None:
+         try:
+            if data_folder is None:
+               raise SuiteError("params needs the test data folder of the target")
+            matrix = ParameterMatrix(source, data_folder)
+         except SuiteError as e:
+            raise SuiteError("%s:%d: %s" % (case.get("source", ""), case.get("line", 0), str(e)))
+      if is_pattern(case["name"]):
+         names = find_test_cases(testcase_folder, case["name"])
+         if len(names) < 1:
+            cases.append({"name": case["name"], "file": None, "options": options})
+            continue
+      else:
+         names = [case["name"]]
+      for name in names:
+         file_name = os.path.join(testcase_folder, name)
+         if not os.path.isfile(file_name):
+            file_name = None
+         elif len(filters) > 0:
+            tags = tag_cache.tags(file_name)
+            if not all(match(tags) for match in filters):
+               continue
+         cases.append({"name"    : name,
+                       "file"    : file_name,
+                       "options" : merge_options(options, {})})  # a copy per test case
+         if matrix is not None and file_name is not None:
+            cases[LAST]["matrix"] = matrix
+   tag_cache.save()
+   return cases
+
+
+def suite_affected(suite, changes, testcase_folder):
+   """ True when file changes may change the test cases of a suite: one of
+       its suite files changed, or a file in the test case folder did and
+       the suite picks test cases by pattern or tags """
+   if any(f in changes for f in suite.get("files", [])):
+      return True
+   if suite.get("dynamic"):
+      folder = os.path.abspath(testcase_folder) + os.sep
+      return any(c.startswith(folder) for c in changes)
+   return False
+
+
+def merge_options(settings, options):
+   """ Returns the effective options for a test case: the suite settings
+       followed by the test case options. """
+   merged = {}
+   for source in (settings, options):
+      for key, values in source.items():
+         merged.setdefault(key, []).extend(values)
+   return merged
+
+
+def option_value(options, key, default=None):
+   """ Returns the last value given for an option, or the default """
+   values = options.get(key)
+   if not values:
+      return default
+   return values[LAST]
+
+
+def option_values(options, key):
+   """ Returns every value given for an option """
+   return list(options.get(key, []))
+
+
+def option_flag(options, key, default=False):
+   """ Returns a yes/no style option as a boolean """
+   value = option_value(options, key)
+   if value is None:
+      return default
+   return value.strip().lower() in ("yes", "true", "on", "1")
+
+
+# Unit tests
+class UnitTests(unittest.TestCase):
+   """ """
+   def write_suite(self, text):
+      f = tempfile.NamedTemporaryFile('w', suffix=".txt", delete=False)
+      f.write(text)
+      f.close()
+      self.addCleanup(os.remove, f.name)
+      return f.name
+
+   def test_plain_suite(self):
+      """ """
+      suite = read_test_suite(self.write_suite("# comment\n\ntest_01.py\n  test_02.py  \n"))
+      self.assertEqual([c["name"] for c in suite["cases"]], ["test_01.py", "test_02.py"])
+      self.assertEqual(suite["settings"], {})
+
+   def test_plain_file_names(self):
+      """ """
+      text = "my test.py\nit's.py\nback\\slash.py\n'quoted name.py'  kill=no\n"
+      suite = read_test_suite(self.write_suite(text))
+      self.assertEqual([c["name"] for c in suite["cases"]],
+                       ["my test.py", "it's.py", "back\\slash.py", "quoted name.py"])
+      self.assertEqual(suite["cases"][FIRST]["options"], {})
+
+   def test_settings_and_options(self):
+      """ """
+      text = "set watch 'FATAL'\nset watch 'Traceback \\(most'\ntest_01.py watch='^ERROR' kill=no\n"
+      suite = read_test_suite(self.write_suite(text))
+      self.assertEqual(suite["settings"]["watch"], ["FATAL", "Traceback \\(most"])
+      case = suite["cases"][FIRST]
+      self.assertEqual(case["line"], 3)
+      merged = merge_options(suite["settings"], case["options"])
+      self.assertEqual(option_values(merged, "watch"), ["FATAL", "Traceback \\(most", "^ERROR"])
+      self.assertEqual(option_value(merged, "kill"), "no")
+      self.assertFalse(option_flag(merged, "kill", True))
+      self.assertTrue(option_flag(merged, "qwert", True))
+
+   def test_bad_option(self):
+      """ """
+      self.assertRaises(SuiteError, read_test_suite, self.write_suite("test_01.py kill=no qwert\n"))
+      self.assertRaises(SuiteError, read_test_suite, self.write_suite("set watch\n"))
+      self.assertRaises(SuiteError, read_test_suite, self.write_suite("test_01.py a='b\n"))
+
+   def test_resolve_test_cases(self):
+      """ """
+      folder = tempfile.mkdtemp()
+      self.addCleanup(os.rmdir, folder)
+      file_name = self.write_suite("set watch X\n%s  watch=Y\nqwert.py\n" % os.path.basename(__file__))
+      cases = resolve_test_cases(read_test_suite(file_name), os.path.dirname(os.path.abspath(__file__)))
+      self.assertEqual(cases[FIRST]["file"], os.path.abspath(__file__))
+      self.assertEqual(cases[FIRST]["options"]["watch"], ["X", "Y"])
+      self.assertIsNone(cases[LAST]["file"])
+      self.assertIsNone(resolve_test_cases(read_test_suite(file_name), folder)[FIRST]["file"])
+
+   def test_patterns_and_tags(self):
+      """ """
+      folder = tempfile.mkdtemp()
+      self.addCleanup(shutil.rmtree, folder)
+      os.mkdir(os.path.join(folder, "net"))
+      for name, header in (("test_01.py", "# tags: smoke\n"), ("test_02.py", "# tags: slow, smoke\n"),
+                           ("net/test_03.py", "#!/bin/sh\n# TAGS: network smoke\n"), ("net/test_04.sh", "echo\n# tags: smoke\n")):
+         f = open(os.path.join(folder, name), 'w')
+         f.write(header)
+         f.close()
+      suite = read_test_suite(self.write_suite("test_0[1-2].py\n**/*.py tags='smoke and not slow'\nnet/*\nqwert_*\n"))
+      self.assertTrue(suite["dynamic"])
+      cases = resolve_test_cases(suite, folder, TagCache(os.path.join(folder, ".tags.json")))
+      self.assertEqual([c["name"] for c in cases],
+                       ["test_01.py", "test_02.py", "net/test_03.py", "test_01.py", "net/test_03.py", "net/test_04.sh", "qwert_*"])
+      self.assertIsNone(cases[LAST]["file"])
+      self.assertIn(os.path.join(folder, "test_02.py"), TagCache(os.path.join(folder, ".tags.json")).entries)
+      self.assertTrue(suite_affected(suite, {os.path.join(folder, "test_09.py")}, folder))
+
+   def test_find_test_cases(self):
+      """ """
+      folder = tempfile.mkdtemp()
+      self.addCleanup(shutil.rmtree, folder)
+      for name in ("net/test_01.py", "net/ipv6/test_02.py", "disk/deep/test_03.py", "test_04.py"):
+         os.makedirs(os.path.dirname(os.path.join(folder, name)), exist_ok=True)
+         open(os.path.join(folder, name), 'w').close()
+      _listings.clear()
+      self.assertEqual(find_test_cases(folder, "net/test_*.py"), ["net/test_01.py"])
+      self.assertEqual(sorted(_listings), [os.path.join(folder, ""), os.path.join(folder, "net/")])  # disk/ was not listed
+      self.assertEqual(find_test_cases(folder, "n?t/**/test_*.py"), ["net/ipv6/test_02.py", "net/test_01.py"])
+      self.assertEqual(find_test_cases(folder, "*/*/test_*.py"), ["disk/deep/test_03.py", "net/ipv6/test_02.py"])
+      self.assertEqual(len(find_test_cases(folder, "**/test_*.py")), 4)
+
+   def test_tag_expression(self):
+      """ """
+      match = tag_expression("smoke and not (slow, flaky)")
+      self.assertTrue(match({"smoke"}))
+      self.assertFalse(match({"smoke", "flaky"}))
+      self.assertFalse(match(set()))
+      self.assertRaises(ValueError, tag_expression, "smoke and")
+      self.assertRaises(SuiteError, read_test_suite, self.write_suite("set tags '(smoke'\n"))
+
+   def test_include(self):
+      """ """
+      common = self.write_suite("set watch X\ntest_02.py\n")
+      suite  = read_test_suite(self.write_suite("test_01.py\ninclude %s\ntest_03.py\n" % os.path.basename(common)))
+      self.assertEqual([c["name"] for c in suite["cases"]], ["test_01.py", "test_02.py", "test_03.py"])
+      self.assertEqual([c["options"] for c in suite["cases"]], [{}, {"watch": ["X"]}, {}])
+      self.assertEqual(suite["settings"], {})
+      self.assertEqual(suite["files"][LAST], os.path.abspath(common))
+      self.assertFalse(suite["dynamic"])
+      f = open(common, 'a')
+      f.write("include %s\n" % os.path.basename(common))
+      f.close()
+      self.assertRaises(SuiteError, read_test_suite, common)
+
+   def test_parameter_matrix(self):
+      """ """
+      data = tempfile.mkdtemp()
+      self.addCleanup(shutil.rmtree, data)
+      os.mkdir(os.path.join(data, "inputs"))
+      for name, text in (("users.csv", "id,user, level\nadmin 1,root,9\n,guest,1,extra\n"),
+                         ("inputs/b.json", "{}"), ("inputs/a.json", "{}"), ("inputs/c.txt", "")):
+         f = open(os.path.join(data, name), 'w')
+         f.write(text)
+         f.close()
+      here  = os.path.basename(__file__)
+      suite = read_test_suite(self.write_suite("%s params=users.csv\n%s params='inputs/*.json' params_as=args\n%s\n" % (here, here, here)))
+      cases = resolve_test_cases(suite, os.path.dirname(os.path.abspath(__file__)), data_folder=data)
+      self.assertEqual(count_test_cases(cases), 5)
+      rows = list(expand_test_cases(cases))
+      self.assertEqual([r.get("param_id") for r in rows], ["admin_1", "row2", "inputs_a", "inputs_b", None])
+      self.assertEqual(rows[FIRST]["params"], {"id": "admin 1", "user": "root", "level": "9"})
+      self.assertEqual(rows[2]["params"], {DATA_FILE_PARAM: os.path.join(data, "inputs", "a.json")})
+      self.assertFalse(cases[FIRST]["matrix"].is_empty())
+      self.assertNotIn("matrix", rows[FIRST])
+      self.assertRaises(SuiteError, resolve_test_cases, read_test_suite(self.write_suite("%s params=qwert.csv\n" % here)),
+                        os.path.dirname(os.path.abspath(__file__)), data_folder=data)
+      self.assertRaises(SuiteError, read_test_suite, self.write_suite("test_01.py params_as=qwert\n"))
+
+   def test_duplicate_param_ids(self):
+      """ """
+      data = tempfile.mkdtemp()
+      self.addCleanup(shutil.rmtree, data)
+      f = open(os.path.join(data, "users.csv"), 'w')
+      f.write("id,user\na b,1\na_b,2\na b,3\n,4\nrow5,5\n")
+      f.close()
+      matrix = ParameterMatrix("users.csv", data)
+      self.assertEqual([label for label, _ in matrix.rows()], ["a_b", "a_b_row2", "a_b_row3", "row4", "row5"])
+      self.assertEqual(len(matrix), 5)
+      f = open(os.path.join(data, "empty.csv"), 'w')
+      f.write("id,user\n")
+      f.close()
+      self.assertTrue(ParameterMatrix("empty.csv", data).is_empty())
+
+   def test_missing_suite(self):
+      """ """
+      self.assertRaises(SuiteError, read_test_suite, "qwert")
+
+
+if __name__ == "__main__":
+   # If this library is executed as a main program
+   # Then execute the unit tests
+   unittest.main()
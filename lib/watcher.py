@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+
+# Output Watcher Library
+# Scans the streaming output of a running test case for regular expressions
+# such as FATAL or Traceback so that the test case can be failed (and killed)
+# the moment the pattern appears instead of when the test case exits. The
+# patterns are compiled once and every chunk of output is scanned once; only
+# the unfinished last line of a stream is kept and looked at again when more
+# output arrives, and only its last TAIL_LIMIT characters so that a very long
+# line (a progress bar redrawn with \r) does not get slower with every chunk.
+# A pattern must match within that many characters of an unfinished line.
+# Patterns that look at the end of a line ($, \Z, \b, lookaheads) could match
+# a line that is only half received, they wait for the end of the line (or of
+# the stream) instead. To run unit tests for this library execute this library as main from the
+# command line.
+
+import re
+import unittest
+from functools import lru_cache
+
+# -----------------------------------------------------------------------------
+# Some useful variables
+VERSION  = "1.0.0"
+FIRST    = 0
+LAST     = -1
+TAIL_LIMIT = 16 * 1024  # Characters of an unfinished line scanned again
+LINE_END   = re.compile(r"\$|\\[ZbB]|\(\?[=!]")  # looks at what follows a match
+
+
+@lru_cache(maxsize=128)
+def compile_patterns(patterns):
+   """ Compiles a tuple of patterns. Every test case of a suite usually shares
+       the same patterns so they are compiled once per run, not per case. """
+   return tuple(re.compile(p, re.MULTILINE) for p in patterns)
+
+
+@lru_cache(maxsize=128)
+def unfinished_line_patterns(patterns):
+   """ The compiled patterns whose match can not change when the line goes
+       on, the ones that may be scanned against an unfinished line """
+   return tuple(p for p in patterns if not LINE_END.search(p.pattern))
+
+
+class OutputWatcher():
+   """ Watches the output streams of one test case for a list of patterns """
+
+   def __init__(self, patterns, kill=True):
+      """ Constructor for an object of type OutputWatcher
+             patterns : list of regular expression strings. Patterns are
+                        matched line by line, ^ and $ match at line ends.
+             kill     : kill the test case when a pattern is found, otherwise
+                        only mark it failed when it exits
+          Raises re.error if a pattern is not a valid regular expression. """
+      self.patterns = compile_patterns(tuple(patterns))
+      self.partial  = unfinished_line_patterns(self.patterns)
+      self.kill     = kill
+      self.match    = None  # {"pattern", "line", "stream"} once a pattern is found
+      self._tails   = {}    # Unfinished last line of each stream
+
+   def __bool__(self):
+      return len(self.patterns) > 0
+
+   def feed(self, data, stream="stdout"):
+      """ Scans a new chunk of output from a stream. Returns the match
+          dictionary the first time a pattern is found, otherwise None. """
+      if self.match is not None or not self.patterns:
+         return None
+      text = self._tails.get(stream, "") + data
+      end  = text.rfind('\n')
+      self._tails[stream] = text[end + 1:][-TAIL_LIMIT:]
+      # Complete lines are scanned once. The unfinished line is scanned too so
+      # a test case that hangs without ending its line is still caught.
+      for block, patterns in ((text[:end + 1], self.patterns), (text[end + 1:], self.partial)):
+         if block and self._scan(block, stream, patterns):
+            return self.match
+      return None
+
+   def close(self, stream="stdout"):
+      """ Scans the unfinished last line of a stream that has ended with
+          every pattern. Returns the match dictionary when a pattern is
+          found there, otherwise None. """
+      tail = self._tails.pop(stream, "")
+      if self.match is not None or not tail:
+         return None
+      if self._scan(tail, stream, self.patterns):
+         return self.match
+      return None
+
+   def _scan(self, block, stream, patterns):
+      for pattern in patterns:
+         found = pattern.search(block)
+         if found:
+            start = block.rfind('\n', 0, found.start()) + 1
+            stop  = block.find('\n', found.start())
+            line  = block[start:] if stop == -1 else block[start:stop]
+            self.match = {"pattern" : pattern.pattern,
+                          "line"    : line.rstrip('\r'),
+                          "stream"  : stream }
+            return True
+      return False
+
+
+# Unit tests
+class UnitTests(unittest.TestCase):
+   """ """
+   def test_match_in_one_chunk(self):
+      """ """
+      w = OutputWatcher(["FATAL", "^Traceback"])
+      self.assertIsNone(w.feed("all good\n"))
+      match = w.feed("step 2\nFATAL: disk gone\nmore\n", "stderr")
+      self.assertEqual(match["line"], "FATAL: disk gone")
+      self.assertEqual(match["stream"], "stderr")
+      self.assertEqual(match["pattern"], "FATAL")
+
+   def test_match_split_across_chunks(self):
+      """ """
+      w = OutputWatcher(["^Traceback \\(most recent"])
+      self.assertIsNone(w.feed("ok\nTrace"))
+      self.assertIsNone(w.feed("back (most"))
+      self.assertEqual(w.feed(" recent call last):\n")["line"], "Traceback (most recent call last):")
+
+   def test_partial_line_match(self):
+      """ """
+      w = OutputWatcher(["FATAL"])
+      self.assertEqual(w.feed("FATAL and then hang")["line"], "FATAL and then hang")
+
+   def test_line_end_split_across_chunks(self):
+      """ """
+      w = OutputWatcher(["^ERROR$", r"FAIL\b"])
+      self.assertIsNone(w.feed("ERROR"))
+      self.assertIsNone(w.feed("S ignored\nFAIL"))
+      self.assertIsNone(w.feed("URES: 0\n"))
+      self.assertEqual(w.feed("ERROR\n")["line"], "ERROR")
+      w = OutputWatcher(["^ERROR$"])
+      self.assertIsNone(w.feed("ERROR"))
+      self.assertEqual(w.close()["line"], "ERROR")  # the stream ended there
+
+   def test_streams_are_separate(self):
+      """ """
+      w = OutputWatcher(["^ERROR$"])
+      self.assertIsNone(w.feed("ERR", "stdout"))
+      self.assertIsNone(w.feed("OR\n", "stderr"))
+
+   def test_only_first_match(self):
+      """ """
+      w = OutputWatcher(["X"])
+      self.assertIsNotNone(w.feed("X\n"))
+      self.assertIsNone(w.feed("X\n"))
+
+   def test_long_unfinished_line(self):
+      """ """
+      w = OutputWatcher(["FATAL"])
+      for n in range(2000):
+         self.assertIsNone(w.feed("\r%d%% done" % n + "." * 100))
+      self.assertLessEqual(len(w._tails["stdout"]), TAIL_LIMIT)
+      self.assertEqual(w.feed(" FATAL\n")["pattern"], "FATAL")
+
+   def test_patterns_compiled_once(self):
+      """ """
+      self.assertIs(OutputWatcher(["FATAL"]).patterns, OutputWatcher(["FATAL"]).patterns)
+
+   def test_bad_pattern(self):
+      """ """
+      self.assertRaises(re.error, OutputWatcher, ["("])
+
+   def test_no_patterns(self):
+      """ """
+      w = OutputWatcher([])
+      self.assertFalse(w)
+      self.assertIsNone(w.feed("FATAL\n"))
+
+
+if __name__ == "__main__":
+   # If this library is executed as a main program
+   # Then execute the unit tests
+   unittest.main()
@@ -0,0 +1,287 @@
+#!/usr/bin/python3
+
+# Workspace Library
+# Gives each running test case a private scratch folder that looks like a full
+# copy of testdata/<TARGET> without paying the cost of copying the data. The
+# folder is populated with reflinks, hardlinks, symlinks or an overlay mount and
+# is removed (or kept for a post-mortem) when the test case is done. To run unit
+# tests for this library execute this library as main from the command line.
+
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+# -----------------------------------------------------------------------------
+# Some useful variables
+VERSION  = "1.0.0"
+FIRST    = 0
+LAST     = -1
+ERROR    = "\033[31mERROR\033[0m"
+WARNING  = "\033[33mWARNING\033[0m"
+
+# Environment variable that holds the workspace path for the test case
+WORKSPACE_ENV = "TESTMASTER_WORKSPACE"
+
+# Ways of populating a workspace
+#    none     - no workspace, the test case runs as it always has
+#    auto     - reflink, then copy, whichever works first. The files of the
+#               workspace are always its own.
+#    reflink  - copy-on-write clones (btrfs, xfs), data is shared until written
+#    hardlink - files share the inode with testdata, a test that rewrites a file
+#               in place also changes the original. Creating, deleting and
+#               renaming files is private to the workspace. Never picked by
+#               auto, only used when asked for.
+#    symlink  - works across file systems (e.g. a tmpfs workspace), but writing
+#               through a link changes the original file. Never picked by auto.
+#    copy     - a plain copy, slow for large data sets
+#    overlay  - overlay mount with testdata as the read-only lower layer. Needs
+#               fuse-overlayfs or root, falls back to auto otherwise.
+WORKSPACE_MODES = ["none", "auto", "reflink", "hardlink", "symlink", "copy", "overlay"]
+AUTO_ORDER      = ["reflink", "copy"]
+SHARED_MODES    = ["hardlink", "symlink"]  # files written in place change testdata
+TMPFS_ROOT      = "/dev/shm"
+
+
+class WorkspaceError(Exception):
+   """ Raised when a workspace cannot be created """
+   pass
+
+
+def default_workspace_root(tmpfs=False):
+   """ Returns the folder under which workspaces are created. When tmpfs is
+       requested and /dev/shm is available the workspaces live in memory. """
+   if tmpfs and os.path.isdir(TMPFS_ROOT):
+      return os.path.join(TMPFS_ROOT, "testmaster")
+   return os.path.join(tempfile.gettempdir(), "testmaster")
+
+
+class Workspace():
+   """ A private scratch folder for one running test case """
+
+   def __init__(self, data_folder, root=None, mode="auto", keep_on_failure=False, name="testcase"):
+      """ Constructor for an object of type Workspace
+             data_folder     : testdata/<TARGET> folder used to populate the workspace
+             root            : folder that holds the workspaces
+             mode            : one of WORKSPACE_MODES
+             keep_on_failure : leave the workspace on disk if the test case fails
+             name            : prefix for the workspace folder name """
+      if mode not in WORKSPACE_MODES:
+         raise WorkspaceError("Unknown workspace mode \"%s\"" % mode)
+      self.data_folder     = data_folder
+      self.root            = root if root else default_workspace_root()
+      self.mode            = mode
+      self.keep_on_failure = keep_on_failure
+      self.name            = name
+      self.path            = None  # Folder handed to the test case
+      self.used_mode       = None  # Mode that actually populated the workspace
+      self._base           = None  # Folder that owns everything we created
+      self._mounted        = None  # Unmount command when an overlay is mounted
+
+   def create(self):
+      """ Creates and populates the workspace and returns its path """
+      os.makedirs(self.root, exist_ok=True)
+      self._base = tempfile.mkdtemp(prefix="%s_" % self.name, dir=self.root)
+      self.path  = os.path.join(self._base, "data")
+      have_data  = self.data_folder is not None and os.path.isdir(self.data_folder)
+
+      if not have_data:
+         os.mkdir(self.path)
+         self.used_mode = "empty"
+         return self.path
+
+      modes = [self.mode]
+      if self.mode == "overlay":
+         modes = ["overlay"] + AUTO_ORDER
+      elif self.mode == "auto":
+         modes = AUTO_ORDER
+      for mode in modes:
+         try:
+            getattr(self, "_populate_%s" % mode)()
+            self.used_mode = mode
+            return self.path
+         except (OSError, subprocess.SubprocessError, WorkspaceError) as e:
+            sys.stderr.write("%s -- Workspace mode %s failed: %s\n" % (WARNING, mode, str(e)))
+            self._discard_partial()
+      raise WorkspaceError("Unable to populate workspace from %s" % self.data_folder)
+
+   def environment(self, base=None):
+      """ Returns a copy of the environment with the workspace variable set """
+      env = dict(os.environ if base is None else base)
+      env[WORKSPACE_ENV] = self.path
+      return env
+
+   def cleanup(self, passed=True):
+      """ Removes the workspace. When the test case failed and keep_on_failure
+          is set the workspace is left in place. Returns True if removed. A
+          kept overlay workspace is unmounted so mounts do not pile up, its
+          path is then the upper layer: the files the test case wrote. """
+      if self._base is None:
+         return False
+      if not passed and self.keep_on_failure:
+         if self._mounted is not None:
+            self._unmount()
+            self.path = os.path.join(self._base, "upper")
+         return False
+      self._unmount()
+      shutil.rmtree(self._base, ignore_errors=True)
+      self._base = None
+      return True
+
+   # -------------------------------------------------------------------------- populate methods
+   def _populate_copy(self):
+      shutil.copytree(self.data_folder, self.path, symlinks=True)
+
+   def _populate_reflink(self):
+      cp = shutil.which("cp")
+      if cp is None:
+         raise WorkspaceError("cp not found")
+      subprocess.run([cp, "-a", "--reflink=always", self.data_folder, self.path],
+                     check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+   def _populate_hardlink(self):
+      shutil.copytree(self.data_folder, self.path, symlinks=True, copy_function=os.link)
+
+   def _populate_symlink(self):
+      self._link_tree(lambda src, dst: os.symlink(os.path.abspath(src), dst))
+
+   def _populate_overlay(self):
+      upper = os.path.join(self._base, "upper")
+      work  = os.path.join(self._base, "work")
+      for folder in (upper, work, self.path):
+         os.makedirs(folder, exist_ok=True)
+      options = "lowerdir=%s,upperdir=%s,workdir=%s" % (os.path.abspath(self.data_folder), upper, work)
+      fuse = shutil.which("fuse-overlayfs")
+      if fuse is not None:
+         command = [fuse, "-o", options, self.path]
+         unmount = [shutil.which("fusermount3") or shutil.which("fusermount") or "fusermount", "-u", self.path]
+      elif os.geteuid() == 0:
+         command = ["mount", "-t", "overlay", "overlay", "-o", options, self.path]
+         unmount = ["umount", self.path]
+      else:
+         raise WorkspaceError("overlay needs fuse-overlayfs or root")
+      subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+      self._mounted = unmount
+
+   def _link_tree(self, link):
+      """ Recreates the folder tree of the data folder and links each file """
+      for folder, _, files in os.walk(self.data_folder):
+         relative = os.path.relpath(folder, self.data_folder)
+         target   = os.path.normpath(os.path.join(self.path, relative))
+         os.makedirs(target, exist_ok=True)
+         for f in files:
+            link(os.path.join(folder, f), os.path.join(target, f))
+
+   def _unmount(self):
+      if self._mounted is not None:
+         subprocess.run(self._mounted, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+         self._mounted = None
+
+   def _discard_partial(self):
+      """ Removes whatever a failed populate method left behind """
+      self._unmount()
+      for item in os.listdir(self._base):
+         shutil.rmtree(os.path.join(self._base, item), ignore_errors=True)
+
+
+# Unit tests
+class UnitTests(unittest.TestCase):
+   """ """
+   def setUp(self):
+      self.scratch = tempfile.mkdtemp()
+      self.data    = os.path.join(self.scratch, "testdata")
+      self.root    = os.path.join(self.scratch, "workspaces")
+      os.makedirs(os.path.join(self.data, "sub"))
+      with open(os.path.join(self.data, "a.txt"), 'w') as f:
+         f.write("A")
+      with open(os.path.join(self.data, "sub", "b.txt"), 'w') as f:
+         f.write("B")
+
+   def tearDown(self):
+      shutil.rmtree(self.scratch, ignore_errors=True)
+
+   def test_hardlink_workspace(self):
+      """ """
+      w = Workspace(self.data, root=self.root, mode="hardlink")
+      path = w.create()
+      self.assertEqual(w.used_mode, "hardlink")
+      self.assertTrue(os.path.samefile(os.path.join(path, "sub", "b.txt"),
+                                       os.path.join(self.data, "sub", "b.txt")))
+      os.remove(os.path.join(path, "a.txt"))  # private to the workspace
+      self.assertTrue(os.path.isfile(os.path.join(self.data, "a.txt")))
+      self.assertTrue(w.cleanup(passed=True))
+      self.assertFalse(os.path.exists(path))
+
+   def test_symlink_workspace(self):
+      """ """
+      w = Workspace(self.data, root=self.root, mode="symlink")
+      path = w.create()
+      self.assertTrue(os.path.islink(os.path.join(path, "a.txt")))
+      with open(os.path.join(path, "sub", "b.txt"), 'r') as f:
+         self.assertEqual(f.read(), "B")
+      w.cleanup()
+
+   def test_auto_workspace(self):
+      """ """
+      w = Workspace(self.data, root=self.root, mode="auto")
+      path = w.create()
+      self.assertIn(w.used_mode, AUTO_ORDER)
+      self.assertFalse(set(SHARED_MODES) & set(AUTO_ORDER))
+      self.assertTrue(os.path.isfile(os.path.join(path, "sub", "b.txt")))
+      self.assertEqual(w.environment({})[WORKSPACE_ENV], path)
+      # Rewriting a file in place leaves testdata alone
+      with open(os.path.join(path, "a.txt"), 'w') as f:
+         f.write("changed in place")
+      with open(os.path.join(self.data, "a.txt"), 'r') as f:
+         self.assertEqual(f.read(), "A")
+      w.cleanup()
+
+   def test_keep_on_failure(self):
+      """ """
+      w = Workspace(self.data, root=self.root, mode="copy", keep_on_failure=True)
+      path = w.create()
+      self.assertFalse(w.cleanup(passed=False))
+      self.assertTrue(os.path.isdir(path))
+      self.assertTrue(w.cleanup(passed=True))
+
+   def test_keep_overlay_on_failure(self):
+      """ """
+      w = Workspace(self.data, root=self.root, mode="overlay", keep_on_failure=True)
+      path = w.create()
+      if w.used_mode != "overlay":
+         w.cleanup()
+         self.skipTest("overlay mounts not available here")
+      with open(os.path.join(path, "new.txt"), 'w') as f:
+         f.write("N")
+      self.assertFalse(w.cleanup(passed=False))
+      self.assertFalse(os.path.ismount(path))
+      self.assertEqual(os.listdir(w.path), ["new.txt"])
+      self.assertTrue(w.cleanup(passed=True))
+
+   def test_missing_data_folder(self):
+      """ """
+      w = Workspace(os.path.join(self.scratch, "qwert"), root=self.root)
+      path = w.create()
+      self.assertEqual(w.used_mode, "empty")
+      self.assertEqual(os.listdir(path), [])
+      w.cleanup()
+
+   def test_unique_workspaces(self):
+      """ """
+      w1 = Workspace(self.data, root=self.root, mode="symlink", name="test_01")
+      w2 = Workspace(self.data, root=self.root, mode="symlink", name="test_01")
+      self.assertNotEqual(w1.create(), w2.create())
+      w1.cleanup()
+      w2.cleanup()
+
+   def test_bad_mode(self):
+      """ """
+      self.assertRaises(WorkspaceError, Workspace, self.data, self.root, "qwert")
+
+
+if __name__ == "__main__":
+   # If this library is executed as a main program
+   # Then execute the unit tests
+   unittest.main()